@@ -2,16 +2,71 @@
 Main Flask application for Token Probability Visualizer.
 """
 
-from flask import Flask, request, jsonify, render_template
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import json
+import queue
+import threading
+import time
 
+from flask import (
+    Flask,
+    Response,
+    g,
+    has_request_context,
+    request,
+    jsonify,
+    render_template,
+    stream_with_context,
+)
+
+from models.branch_trie import BranchTrie, entries_to_sequence, token_entries
+from models.client_registry import ClientRegistry
+from models.generation_history import GenerationHistory, prompt_hash
+from models.generation_store import GenerationStore
+from models.model_list_cache import ModelListCache
 from models.openai_client import OpenAIClient
+from models.rate_limiter import (
+    RequestScheduler,
+    SchedulerTimeout,
+    is_throttled,
+    is_upstream_timeout,
+)
+from models.response_cache import ResponseCache
+from models.single_flight import SingleFlight
 from models.token_processor import TokenProcessor
+from models.token_sequence import TokenSequence
+from utils import compression, export, metrics
 import config
 
 # Initialize Flask application
 app = Flask(__name__)
 app.config["SECRET_KEY"] = config.SECRET_KEY
 
+# Rate limits and 429 backoff for every upstream completion call of this process
+request_scheduler = RequestScheduler()
+
+# Process-wide pool of OpenAI clients shared by all worker threads
+client_registry = ClientRegistry(scheduler=request_scheduler)
+
+# Cache of deterministic generation results
+response_cache = ResponseCache() if config.RESPONSE_CACHE_ENABLED else None
+
+# Model listings per service/credential set, refreshed in the background
+model_list_cache = ModelListCache()
+
+# Identical concurrent deterministic requests share one upstream call
+single_flight = SingleFlight()
+
+# Every generation, persisted so past runs can be reopened after a restart
+generation_history = GenerationHistory() if config.HISTORY_PATH else None
+
+# Recent generations, kept so views can be re-derived without calling the model
+generation_store = GenerationStore(history=generation_history)
+
+# Explored continuations of generations, for branching from alternative tokens
+branch_trie = BranchTrie()
+
 
 def get_openai_client(
     service_type: str,
@@ -19,21 +74,32 @@ def get_openai_client(
     azure_api_key: str = None,
     azure_endpoint: str = None,
     azure_api_version: str = None,
+    timeout: float | None = None,
 ):
-    """Helper function to instantiate OpenAIClient."""
+    """
+    Helper function to get a pooled OpenAIClient from the client registry.
+
+    With a timeout, the client's upstream calls time out after that many
+    seconds instead of config.UPSTREAM_TIMEOUT (see parse_upstream_timeout).
+    Within a request the client is leased until the request ends (see
+    release_clients), so registry eviction cannot close it while in use.
+    """
     # The default for service_type argument in this helper should come from the actual request or a sensible default if not provided in request context.
     # For calls from /api/models and /api/generate, service_type is explicitly passed.
     # config.STARTUP_SERVICE_TYPE is not directly used here as service_type is already resolved by the route.
     try:
-        client = OpenAIClient(
+        in_request = has_request_context()
+        get_client = client_registry.acquire if in_request else client_registry.get
+        client = get_client(
             service_type=service_type,  # This is the crucial part, passed by the route
             api_key=api_key or config.OPENAI_API_KEY,
             azure_api_key=azure_api_key or config.AZURE_OPENAI_API_KEY,
             azure_endpoint=azure_endpoint or config.AZURE_OPENAI_ENDPOINT,
             azure_api_version=azure_api_version or config.AZURE_API_VERSION,
         )
-        app.logger.info(f"OpenAIClient instantiated for service type: {service_type}")
-        return client
+        if in_request:
+            g.setdefault("leased_clients", []).append(client)
+        return client if timeout is None else client.with_timeout(timeout)
     except ValueError as e:
         app.logger.error(
             f"Error instantiating OpenAIClient for service type {service_type}: {e}"
@@ -46,6 +112,340 @@ def get_openai_client(
         raise
 
 
+@app.teardown_request
+def release_clients(error: BaseException | None = None) -> None:
+    """
+    Hand back the clients get_openai_client leased for the request.
+
+    Streamed responses keep the request context until the stream ends, so
+    their clients stay leased for the whole stream.
+    """
+    for client in g.pop("leased_clients", []):
+        client_registry.release(client)
+
+
+def request_timings() -> dict | None:
+    """Return the stage timings of the current request, or None outside a request."""
+    if not has_request_context():
+        return None
+    if "timings" not in g:
+        g.timings = {}
+    return g.timings
+
+
+def timed(stage: str):
+    """Time a block as a stage of the current request (see utils.metrics)."""
+    return metrics.stage_timer(stage, request_timings())
+
+
+def record_error(error: Exception) -> None:
+    """Count an error against the current request's endpoint."""
+    endpoint = request.url_rule.rule if request.url_rule else request.path
+    metrics.record_error(endpoint, error)
+    if is_upstream_timeout(error):
+        metrics.record_cancelled(endpoint, "timeout")
+
+
+def error_response(error: Exception) -> tuple:
+    """
+    Build the JSON error response for a failed generation.
+
+    Calls held back by rate limits get 429, with a Retry-After header when the
+    scheduler knows how long to wait; upstream calls that timed out get 504;
+    other errors get 500.
+    """
+    if is_upstream_timeout(error):
+        return jsonify({"error": str(error)}), 504
+    if not is_throttled(error):
+        return jsonify({"error": str(error)}), 500
+    headers = {}
+    if isinstance(error, SchedulerTimeout):
+        headers["Retry-After"] = str(max(1, round(error.retry_after)))
+    return jsonify({"error": str(error)}), 429, headers
+
+
+def model_list_key(service_type: str) -> tuple:
+    """Return the model list cache key for the configured credentials of a service."""
+    return ClientRegistry.make_key(
+        service_type,
+        config.OPENAI_API_KEY,
+        config.AZURE_OPENAI_API_KEY,
+        config.AZURE_OPENAI_ENDPOINT,
+        config.AZURE_API_VERSION,
+    )
+
+
+def fetch_available_models(service_type: str) -> list:
+    """
+    List a service's models on a client leased for just this call.
+
+    Model list refreshes run in the background and may outlive the request
+    that started them, so they hold their own lease instead of using the
+    request's client, which is released (and may be closed) when it ends.
+    """
+    client = client_registry.acquire(
+        service_type=service_type,
+        api_key=config.OPENAI_API_KEY,
+        azure_api_key=config.AZURE_OPENAI_API_KEY,
+        azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
+        azure_api_version=config.AZURE_API_VERSION,
+    )
+    try:
+        return client.get_available_models()
+    finally:
+        client_registry.release(client)
+
+
+def prewarm_model_list() -> None:
+    """Fetch the startup service's model list in the background."""
+
+    def fetch():
+        service_type = config.STARTUP_SERVICE_TYPE
+        try:
+            model_list_cache.get(
+                model_list_key(service_type),
+                lambda: fetch_available_models(service_type),
+            )
+        except Exception as e:
+            app.logger.warning(f"Could not prewarm model list for {service_type}: {e}")
+
+    threading.Thread(target=fetch, daemon=True).start()
+
+
+def parse_generation_params(data: dict, service_type: str) -> dict:
+    """Extract generation settings from a request payload, applying defaults."""
+    prompt = data.get("prompt", "")
+
+    # Determine model to use: if service_type is azure, and model in data is not set or not "gpt-35-turbo", force it.
+    # Otherwise, use the model from data or the overall config default.
+    current_default_model_for_service = (
+        "gpt-35-turbo" if service_type == "azure" else config.DEFAULT_MODEL
+    )
+    model = data.get("model", current_default_model_for_service)
+    if service_type == "azure" and model != "gpt-35-turbo":
+        model = "gpt-35-turbo"  # Force to Azure's specific model if service is Azure
+
+    temperature = float(data.get("temperature", config.DEFAULT_TEMPERATURE))
+    top_p = float(data.get("top_p", config.DEFAULT_TOP_P))
+    max_tokens = int(data.get("max_tokens", config.DEFAULT_MAX_TOKENS))
+
+    return {
+        "prompt": prompt,
+        "model": model,
+        "temperature": temperature,
+        "top_p": top_p,
+        "max_tokens": max_tokens,
+    }
+
+
+def response_cache_key(data: dict, service_type: str, params: dict) -> str | None:
+    """
+    Return the response cache key for a request, or None if it should not be cached.
+
+    Requests with temperature 0 are cached by default; other settings only when
+    the payload opts in with "cache": true.
+    """
+    if response_cache is None:
+        return None
+    if params["temperature"] != 0 and not data.get("cache", False):
+        return None
+    return ResponseCache.make_key(
+        service_type, logprobs=config.DEFAULT_LOGPROBS, **params
+    )
+
+
+def coalesce_key(
+    service_type: str,
+    params: dict,
+    response_format: str,
+    timeout: float | None = None,
+) -> str | None:
+    """
+    Return the single-flight key for a request, or None if it must not be coalesced.
+
+    Only deterministic requests (temperature 0) are coalesced, since callers
+    sharing a result must be able to expect the same output. The upstream
+    timeout (the client's effective one) is part of the key, so a caller is
+    never held to a shared call's longer or shorter timeout.
+    """
+    if not config.COALESCE_ENABLED or params["temperature"] != 0:
+        return None
+    key = ResponseCache.make_key(
+        service_type, logprobs=config.DEFAULT_LOGPROBS, **params
+    )
+    return f"{key}:{response_format}:{timeout}"
+
+
+def run_coalesced(key: str | None, produce):
+    """
+    Run produce, sharing its result with identical requests already in flight.
+
+    Args:
+        key: Key from coalesce_key, or None to always run produce
+        produce: Function building the response body
+
+    Returns:
+        The response body; bodies joined from another request have "coalesced" set
+    """
+    if key is None:
+        return produce()
+    body, shared = single_flight.do(key, produce)
+    if not shared:
+        return body
+    metrics.COALESCED_REQUESTS.inc()
+    return {**body, "coalesced": True}
+
+
+def build_generation_response(
+    text: str,
+    tokens: TokenSequence,
+    top_p: float,
+    response_format: str = "full",
+    **extra,
+) -> dict:
+    """
+    Build the JSON body for a generation in the requested format.
+
+    Formats:
+        full: processed token list plus server-rendered HTML
+        compact: processed tokens as parallel columns, rendered in the browser
+        raw: unprocessed token logprobs as columns; the browser derives the
+             nucleus/selection chance itself and can redo it for any top_p
+        packed: like raw, with a string table for token texts and float32
+                logprobs in base64 (see TokenSequence.to_packed)
+
+    Args:
+        text: The generated text
+        tokens: Raw tokens with logprobs
+        top_p: The top_p value used for selection chances
+        response_format: One of "full", "compact", "raw" or "packed"
+        **extra: Additional fields to include in the response
+
+    Returns:
+        Response dictionary
+    """
+    if response_format == "raw":
+        return {"text": text, "format": "raw", "raw": tokens.to_columns(), **extra}
+    if response_format == "packed":
+        return {"text": text, "format": "packed", "packed": tokens.to_packed(), **extra}
+
+    # Process tokens for visualization, passing top_p
+    with timed("process_tokens"):
+        processed_tokens = TokenProcessor.process_tokens(tokens, top_p=top_p)
+    metrics.TOKENS_PROCESSED.inc(len(tokens))
+
+    # Compact mode leaves formatting and HTML generation to the browser
+    if response_format == "compact":
+        return {
+            "text": text,
+            "format": "compact",
+            "tokens": TokenProcessor.to_compact(processed_tokens),
+            **extra,
+        }
+
+    # Generate HTML for visualization
+    with timed("tokens_to_html"):
+        html = TokenProcessor.tokens_to_html(processed_tokens)
+
+    return {"text": text, "tokens": processed_tokens, "html": html, **extra}
+
+
+def parse_upstream_timeout(data: dict) -> float | None:
+    """
+    Return the upstream timeout a request asks for with "timeout", in seconds.
+
+    The value is capped at config.UPSTREAM_MAX_TIMEOUT. Returns None when the
+    payload has none, so the client keeps config.UPSTREAM_TIMEOUT.
+    """
+    if data.get("timeout") is None:
+        return None
+    timeout = float(data["timeout"])
+    if timeout <= 0:
+        raise ValueError("timeout must be a positive number of seconds")
+    return min(timeout, config.UPSTREAM_MAX_TIMEOUT)
+
+
+def parse_sample_count(data: dict) -> int:
+    """Return the number of samples requested with "n", validating its range."""
+    n_samples = int(data.get("n", 1))
+    if not 1 <= n_samples <= config.MAX_SAMPLES:
+        raise ValueError(f"n must be between 1 and {config.MAX_SAMPLES}")
+    return n_samples
+
+
+def build_samples_response(
+    service_type: str,
+    params: dict,
+    samples: list[tuple[str, TokenSequence]],
+    response_format: str = "full",
+) -> dict:
+    """
+    Build the JSON body for several samples of one prompt.
+
+    Every sample is stored as its own generation and rendered in the requested
+    format (see build_generation_response); the tokens of all samples are
+    processed in one pass. Per-position statistics across the samples are
+    added under "stats" (see TokenProcessor.sample_statistics).
+
+    Args:
+        service_type: Service the samples came from
+        params: Generation settings from parse_generation_params
+        samples: (generated_text, tokens) per sample
+        response_format: One of "full", "compact", "raw" or "packed"
+
+    Returns:
+        Response dictionary
+    """
+    sequences = [tokens for _, tokens in samples]
+    if response_format == "raw":
+        sample_bodies = [
+            {"text": text, "raw": tokens.to_columns()} for text, tokens in samples
+        ]
+    elif response_format == "packed":
+        sample_bodies = [
+            {"text": text, "packed": tokens.to_packed()} for text, tokens in samples
+        ]
+    else:
+        with timed("process_tokens"):
+            processed = TokenProcessor.process_samples(sequences, params["top_p"])
+        metrics.TOKENS_PROCESSED.inc(sum(len(tokens) for tokens in sequences))
+        if response_format == "compact":
+            sample_bodies = [
+                {"text": text, "tokens": TokenProcessor.to_compact(processed_tokens)}
+                for (text, _), processed_tokens in zip(samples, processed)
+            ]
+        else:
+            with timed("tokens_to_html"):
+                sample_bodies = [
+                    {
+                        "text": text,
+                        "tokens": processed_tokens,
+                        "html": TokenProcessor.tokens_to_html(processed_tokens),
+                    }
+                    for (text, _), processed_tokens in zip(samples, processed)
+                ]
+
+    stored_params = {"service_type": service_type, **params}
+    for body, (text, tokens) in zip(sample_bodies, samples):
+        body["generation_id"] = generation_store.add(
+            stored_params, text, tokens, request_timings()
+        )
+
+    with timed("sample_stats"):
+        stats = TokenProcessor.sample_statistics(sequences)
+    return {
+        "format": response_format,
+        "n": len(samples),
+        "samples": sample_bodies,
+        "stats": stats,
+    }
+
+
+def sse_event(event: str, payload: dict) -> str:
+    """Format a payload as a Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
 @app.route("/")
 def index():
     """Render the main application page."""
@@ -60,25 +460,27 @@ def get_models():
     ).lower()  # MODIFIED to use renamed config var
 
     try:
-        client = get_openai_client(service_type)
-        if not client:
-            return jsonify(
-                {
-                    "error": f"Could not initialize OpenAI client for service type: {service_type}"
-                }
-            ), 500
-
-        models = client.get_available_models()
+        # Served from the model list cache; stale listings are refreshed in the background
+        model_list = model_list_cache.get(
+            model_list_key(service_type),
+            lambda: fetch_available_models(service_type),
+        )
         # Determine default model based on service type for the response
         current_default_model = config.DEFAULT_MODEL
         if service_type == "azure":
             current_default_model = "gpt-35-turbo"  # Azure's specific model/deployment
 
-        return jsonify({"models": models, "default_model": current_default_model})
+        response = jsonify(
+            {"models": model_list.models, "default_model": current_default_model}
+        )
+        response.set_etag(model_list.etag)
+        response.cache_control.max_age = config.MODEL_LIST_BROWSER_MAX_AGE
+        return response.make_conditional(request)
     except Exception as e:
         app.logger.error(
             f"Error getting models for service type {service_type}: {str(e)}"
         )
+        record_error(e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -91,7 +493,10 @@ def generate():
     ).lower()  # MODIFIED to use renamed config var
 
     try:
-        client = get_openai_client(service_type)
+        with timed("client"):
+            client = get_openai_client(
+                service_type, timeout=parse_upstream_timeout(data)
+            )
         if not client:
             return jsonify(
                 {
@@ -99,42 +504,888 @@ def generate():
                 }
             ), 500
 
-        prompt = data.get("prompt", "")
+        params = parse_generation_params(data, service_type)
+        response_format = data.get("format", request.args.get("format", "full"))
+        n_samples = parse_sample_count(data)
+
+        # Several samples come from one API call where the model supports n
+        if n_samples > 1:
+            with metrics.upstream_timer(
+                service_type, params["model"], request_timings()
+            ):
+                samples = client.generate_samples(
+                    **params, logprobs=config.DEFAULT_LOGPROBS, n=n_samples
+                )
+            body = build_samples_response(
+                service_type, params, samples, response_format
+            )
+            with timed("json_encode"):
+                return jsonify(body)
+
+        def produce() -> dict:
+            # Generate text with token probabilities, reusing a cached result if possible
+            cache_key = response_cache_key(data, service_type, params)
+            cached = response_cache.get(cache_key) if cache_key else None
+            if cached:
+                text, tokens = cached
+            else:
+                with metrics.upstream_timer(
+                    service_type, params["model"], request_timings()
+                ):
+                    text, tokens = client.generate_with_probabilities(
+                        **params, logprobs=config.DEFAULT_LOGPROBS
+                    )
+                if cache_key:
+                    response_cache.put(cache_key, text, tokens)
 
-        # Determine model to use: if service_type is azure, and model in data is not set or not "gpt-35-turbo", force it.
-        # Otherwise, use the model from data or the overall config default.
-        current_default_model_for_service = (
-            "gpt-35-turbo" if service_type == "azure" else config.DEFAULT_MODEL
+            generation_id = generation_store.add(
+                {"service_type": service_type, **params},
+                text,
+                tokens,
+                request_timings(),
+            )
+            return build_generation_response(
+                text,
+                tokens,
+                params["top_p"],
+                response_format,
+                generation_id=generation_id,
+                cached=cached is not None,
+                coalesced=False,
+            )
+
+        # Identical deterministic requests in flight share one upstream call
+        body = run_coalesced(
+            coalesce_key(service_type, params, response_format, client.timeout),
+            produce,
         )
-        model = data.get("model", current_default_model_for_service)
-        if service_type == "azure" and model != "gpt-35-turbo":
-            model = (
-                "gpt-35-turbo"  # Force to Azure's specific model if service is Azure
+        with timed("json_encode"):
+            return jsonify(body)
+    except Exception as e:
+        record_error(e)
+        return error_response(e)
+
+
+@app.route("/api/score", methods=["POST"])
+def score_prompt():
+    """
+    Get the probability of every token of the prompt itself.
+
+    Takes the payload of /api/generate (prompt, model, service_type, top_p,
+    format); the prompt is scored instead of continued, in overlapping windows
+    for long texts (see OpenAIClient.score_prompt), and rendered like a
+    generation of it. Needs a model served by the completions endpoint.
+    """
+    data = request.json or {}
+    service_type = data.get("service_type", config.STARTUP_SERVICE_TYPE).lower()
+    prompt = data.get("prompt", "")
+    if not prompt:
+        return jsonify({"error": "prompt must not be empty"}), 400
+    if len(prompt) > config.SCORE_MAX_CHARS:
+        return jsonify(
+            {"error": f"At most {config.SCORE_MAX_CHARS} characters can be scored"}
+        ), 400
+
+    try:
+        with timed("client"):
+            client = get_openai_client(
+                service_type, timeout=parse_upstream_timeout(data)
             )
+        # Scores are the model's untempered probabilities of the prompt
+        params = {
+            **parse_generation_params(data, service_type),
+            "temperature": 1.0,
+            "max_tokens": 0,
+        }
+        response_format = data.get("format", request.args.get("format", "full"))
 
-        temperature = float(data.get("temperature", config.DEFAULT_TEMPERATURE))
-        top_p = float(data.get("top_p", config.DEFAULT_TOP_P))
-        max_tokens = int(data.get("max_tokens", config.DEFAULT_MAX_TOKENS))
+        # Scoring is deterministic, so results are always cacheable
+        cache_key = (
+            ResponseCache.make_key(
+                f"{service_type}:score",
+                params["model"],
+                prompt,
+                1.0,
+                1.0,
+                0,
+                config.DEFAULT_LOGPROBS,
+            )
+            if response_cache is not None
+            else None
+        )
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached:
+            text, tokens = cached
+        else:
+            with metrics.upstream_timer(
+                service_type, params["model"], request_timings()
+            ):
+                text, tokens = client.score_prompt(
+                    prompt, params["model"], logprobs=config.DEFAULT_LOGPROBS
+                )
+            if cache_key:
+                response_cache.put(cache_key, text, tokens)
 
-        # Generate text with token probabilities
-        text, tokens = client.generate_with_probabilities(
-            prompt=prompt,
-            model=model,
-            temperature=temperature,
-            top_p=top_p,
-            max_tokens=max_tokens,
-            logprobs=config.DEFAULT_LOGPROBS,
+        generation_id = generation_store.add(
+            {"service_type": service_type, "mode": "score", **params},
+            text,
+            tokens,
+            request_timings(),
+        )
+        body = build_generation_response(
+            text,
+            tokens,
+            params["top_p"],
+            response_format,
+            generation_id=generation_id,
+            cached=cached is not None,
         )
+        with timed("json_encode"):
+            return jsonify(body)
+    except Exception as e:
+        record_error(e)
+        return error_response(e)
 
-        # Process tokens for visualization, passing top_p
-        processed_tokens = TokenProcessor.process_tokens(tokens, top_p=top_p)
 
-        # Generate HTML for visualization
-        html = TokenProcessor.tokens_to_html(processed_tokens)
+@app.route("/api/generate/stream", methods=["POST"])
+def generate_stream():
+    """Generate text and stream processed tokens as Server-Sent Events."""
+    data = request.json
+    service_type = data.get("service_type", config.STARTUP_SERVICE_TYPE).lower()
+
+    try:
+        with timed("client"):
+            client = get_openai_client(
+                service_type, timeout=parse_upstream_timeout(data)
+            )
+        params = parse_generation_params(data, service_type)
+    except Exception as e:
+        record_error(e)
+        return jsonify({"error": str(e)}), 500
+
+    cache_key = response_cache_key(data, service_type, params)
+    cached = response_cache.get(cache_key) if cache_key else None
+
+    # With include_raw, each event also carries the raw token for live re-derivation
+    include_raw = bool(data.get("include_raw", False))
+    stored_params = {"service_type": service_type, **params}
+
+    def token_event(processed_token: dict, raw_token: dict) -> str:
+        payload = {"token": processed_token}
+        if include_raw:
+            payload["raw"] = raw_token
+        return sse_event("token", payload)
+
+    def event_stream():
+        started = time.perf_counter()
+        if cached:
+            text, tokens = cached
+            with timed("process_tokens"):
+                processed_tokens = TokenProcessor.process_tokens(
+                    tokens, top_p=params["top_p"]
+                )
+            metrics.TOKENS_PROCESSED.inc(len(tokens))
+            for i, processed_token in enumerate(processed_tokens):
+                yield token_event(processed_token, tokens.token_dict(i))
+            generation_id = generation_store.add(
+                stored_params, text, tokens, {"stream": time.perf_counter() - started}
+            )
+            yield sse_event(
+                "done", {"text": text, "generation_id": generation_id, "cached": True}
+            )
+            return
+
+        text_parts = []
+        raw_tokens = []
+        token_stream = client.stream_with_probabilities(
+            **params, logprobs=config.DEFAULT_LOGPROBS
+        )
+        try:
+            # Upstream latency here spans the whole stream, until the last token
+            with metrics.upstream_timer(service_type, params["model"]):
+                for raw_token in token_stream:
+                    processed_token = TokenProcessor.process_token(
+                        raw_token, top_p=params["top_p"]
+                    )
+                    text_parts.append(processed_token["text"])
+                    raw_tokens.append(raw_token)
+                    yield token_event(processed_token, raw_token)
+            metrics.TOKENS_PROCESSED.inc(len(raw_tokens))
+            text = "".join(text_parts)
+            tokens = TokenSequence.from_list(raw_tokens)
+            if cache_key:
+                response_cache.put(cache_key, text, tokens)
+            generation_id = generation_store.add(
+                stored_params, text, tokens, {"stream": time.perf_counter() - started}
+            )
+            yield sse_event(
+                "done", {"text": text, "generation_id": generation_id, "cached": False}
+            )
+        except GeneratorExit:
+            # The server closes the response when the client disconnects
+            metrics.record_cancelled("/api/generate/stream", "disconnect")
+            raise
+        except Exception as e:
+            app.logger.error(f"Error streaming generation: {str(e)}")
+            record_error(e)
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            # Closing the token stream closes the upstream SDK stream
+            token_stream.close()
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/compare/stream", methods=["POST"])
+def compare_stream():
+    """
+    Generate one prompt with several models at once and stream them side by side.
+
+    The payload has a "models" list; each entry is a model name or an object with
+    "model" and optional "service_type". Other settings (prompt, temperature,
+    top_p, max_tokens, service_type) apply to every model. All generations run
+    concurrently, and their tokens are streamed as Server-Sent Events tagged with
+    the entry's "column" as they arrive, so the total wait is the slowest model.
+
+    Events: "start" (the columns), "token" and "done" or "error" per column,
+    then "end" once every column has finished.
+    """
+    data = request.json or {}
+    targets = data.get("models")
+    if not isinstance(targets, list) or not targets:
+        return jsonify({"error": "models must be a non-empty list"}), 400
+    if len(targets) > config.COMPARE_MAX_MODELS:
+        return jsonify(
+            {"error": f"At most {config.COMPARE_MAX_MODELS} models can be compared"}
+        ), 400
+
+    default_service_type = data.get("service_type", config.STARTUP_SERVICE_TYPE)
+    columns = []
+    try:
+        for target in targets:
+            if not isinstance(target, dict):
+                target = {"model": target}
+            service_type = target.get("service_type", default_service_type).lower()
+            params = parse_generation_params(
+                {**data, "model": target.get("model")}, service_type
+            )
+            with timed("client"):
+                client = get_openai_client(
+                    service_type, timeout=parse_upstream_timeout(data)
+                )
+            columns.append((service_type, params, client))
+    except Exception as e:
+        record_error(e)
+        return jsonify({"error": str(e)}), 500
+
+    include_raw = bool(data.get("include_raw", False))
+    events: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    def run_column(column: int, service_type: str, params: dict, client) -> None:
+        started = time.perf_counter()
+        cache_key = response_cache_key(data, service_type, params)
+        cached = response_cache.get(cache_key) if cache_key else None
+        raw_tokens = []
+        try:
+            if cached:
+                text, tokens = cached
+                token_stream = (tokens.token_dict(i) for i in range(len(tokens)))
+            else:
+                token_stream = client.stream_with_probabilities(
+                    **params, logprobs=config.DEFAULT_LOGPROBS
+                )
+            # Cached results are replayed without counting as upstream latency
+            timer = (
+                nullcontext()
+                if cached
+                else metrics.upstream_timer(service_type, params["model"])
+            )
+            try:
+                with timer:
+                    for raw_token in token_stream:
+                        if stop.is_set():
+                            # The client disconnected; the upstream stream is closed below
+                            if not cached:
+                                metrics.record_cancelled(
+                                    "/api/compare/stream", "disconnect"
+                                )
+                            return
+                        raw_tokens.append(raw_token)
+                        payload = {
+                            "column": column,
+                            "token": TokenProcessor.process_token(
+                                raw_token, top_p=params["top_p"]
+                            ),
+                        }
+                        if include_raw:
+                            payload["raw"] = raw_token
+                        events.put(("token", payload))
+            finally:
+                token_stream.close()
+            metrics.TOKENS_PROCESSED.inc(len(raw_tokens))
+
+            if not cached:
+                tokens = TokenSequence.from_list(raw_tokens)
+                text = "".join(token["text"] for token in raw_tokens)
+                if cache_key:
+                    response_cache.put(cache_key, text, tokens)
+            seconds = time.perf_counter() - started
+            generation_id = generation_store.add(
+                {"service_type": service_type, **params},
+                text,
+                tokens,
+                {"stream": seconds},
+            )
+            events.put(
+                (
+                    "done",
+                    {
+                        "column": column,
+                        "text": text,
+                        "generation_id": generation_id,
+                        "cached": cached is not None,
+                        "seconds": seconds,
+                    },
+                )
+            )
+        except Exception as e:
+            app.logger.error(f"Error streaming {params['model']} for comparison: {e}")
+            metrics.record_error("/api/compare/stream", e)
+            if is_upstream_timeout(e):
+                metrics.record_cancelled("/api/compare/stream", "timeout")
+            events.put(("error", {"column": column, "error": str(e)}))
+        finally:
+            events.put((None, column))
+
+    def event_stream():
+        executor = ThreadPoolExecutor(
+            max_workers=len(columns), thread_name_prefix="compare"
+        )
+        try:
+            for column, (service_type, params, client) in enumerate(columns):
+                executor.submit(run_column, column, service_type, params, client)
+            yield sse_event(
+                "start",
+                {
+                    "columns": [
+                        {
+                            "column": column,
+                            "service_type": service_type,
+                            "model": params["model"],
+                        }
+                        for column, (service_type, params, _) in enumerate(columns)
+                    ]
+                },
+            )
+            remaining = len(columns)
+            while remaining:
+                event, payload = events.get()
+                if event is None:
+                    remaining -= 1
+                else:
+                    yield sse_event(event, payload)
+            yield sse_event("end", {})
+        finally:
+            # Also reached when the client disconnects: stop the remaining streams
+            stop.set()
+            executor.shutdown(wait=False)
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/generate/batch", methods=["POST"])
+def generate_batch():
+    """
+    Generate text for many prompts concurrently.
+
+    The payload has an "items" list; each item is a prompt string or an object
+    with its own prompt/model/temperature/top_p/max_tokens. Top-level settings
+    apply to every item that does not override them. Results keep the input
+    order, and a failing item reports its error without failing the batch.
+    """
+    data = request.json or {}
+    service_type = data.get("service_type", config.STARTUP_SERVICE_TYPE).lower()
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return jsonify(
+            {"error": f"A batch can hold at most {config.BATCH_MAX_ITEMS} items"}
+        ), 400
+
+    try:
+        with timed("client"):
+            client = get_openai_client(
+                service_type, timeout=parse_upstream_timeout(data)
+            )
+        concurrency = min(
+            int(data.get("concurrency", config.BATCH_MAX_CONCURRENCY)),
+            config.BATCH_MAX_CONCURRENCY,
+        )
+    except Exception as e:
+        record_error(e)
+        return jsonify({"error": str(e)}), 500
+
+    defaults = {k: v for k, v in data.items() if k not in ("items", "concurrency")}
+    response_format = data.get("format", request.args.get("format", "full"))
+
+    # Resolve settings and cache hits first; only misses go to the API
+    results: list = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        item_data = {
+            **defaults,
+            **(item if isinstance(item, dict) else {"prompt": item}),
+        }
+        try:
+            params = parse_generation_params(item_data, service_type)
+        except Exception as e:
+            record_error(e)
+            results[index] = {"index": index, "error": str(e)}
+            continue
+        cache_key = response_cache_key(item_data, service_type, params)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached:
+            results[index] = (params, cached, True)
+        else:
+            pending.append((index, params, cache_key))
+
+    with timed("upstream"):
+        outcomes = client.generate_batch(
+            [
+                {**params, "logprobs": config.DEFAULT_LOGPROBS}
+                for _, params, _ in pending
+            ],
+            max_concurrency=concurrency,
+        )
+    for (index, params, cache_key), outcome in zip(pending, outcomes):
+        if isinstance(outcome, Exception):
+            record_error(outcome)
+            results[index] = {"index": index, "error": str(outcome)}
+            continue
+        if cache_key:
+            response_cache.put(cache_key, *outcome)
+        results[index] = (params, outcome, False)
+
+    response_items = []
+    for index, result in enumerate(results):
+        if isinstance(result, dict):
+            response_items.append(result)
+            continue
+        params, (text, tokens), cached = result
+        try:
+            generation_id = generation_store.add(
+                {"service_type": service_type, **params}, text, tokens
+            )
+            response_items.append(
+                {
+                    "index": index,
+                    **build_generation_response(
+                        text,
+                        tokens,
+                        params["top_p"],
+                        response_format,
+                        generation_id=generation_id,
+                        cached=cached,
+                    ),
+                }
+            )
+        except Exception as e:
+            record_error(e)
+            response_items.append({"index": index, "error": str(e)})
+
+    failed = sum(1 for item in response_items if "error" in item)
+    with timed("json_encode"):
+        return jsonify(
+            {
+                "results": response_items,
+                "succeeded": len(response_items) - failed,
+                "failed": failed,
+            }
+        )
+
+
+@app.route("/api/generations/<generation_id>/view", methods=["POST"])
+def view_generation(generation_id: str):
+    """Re-derive a stored generation for a new top_p/temperature without the API."""
+    stored = generation_store.get(generation_id)
+    if stored is None:
+        return jsonify({"error": f"Unknown generation id: {generation_id}"}), 404
+    params, text, tokens = stored
+
+    data = request.json or {}
+    try:
+        top_p = float(data.get("top_p", params["top_p"]))
+        temperature = float(data.get("temperature", 1.0))
+        view_tokens = TokenProcessor.rescale_temperature(tokens, temperature)
+        response_format = data.get("format", request.args.get("format", "full"))
+        body = build_generation_response(
+            text,
+            view_tokens,
+            top_p,
+            response_format,
+            generation_id=generation_id,
+            view={"top_p": top_p, "temperature": temperature},
+        )
+        with timed("json_encode"):
+            return jsonify(body)
+    except Exception as e:
+        record_error(e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/branch", methods=["POST"])
+def explore_branch():
+    """
+    Continue a stored generation from one of the alternatives at a position.
+
+    Takes generation_id, position and alternative (the text of an alternative
+    token at that position), plus optional max_tokens and format. The model
+    continues from prompt + the tokens before position + the alternative.
+    Explored paths are kept in branch_trie, so revisiting a branch reuses its
+    cached tokens and only the tokens past its end are requested.
+
+    The response is the whole path (tokens before position, the alternative
+    and its continuation) in the requested format, stored as a new generation
+    so it can be branched from in turn.
+    """
+    data = request.json or {}
+    generation_id = data.get("generation_id", "")
+    stored = generation_store.get(generation_id)
+    if stored is None:
+        return jsonify({"error": f"Unknown generation id: {generation_id}"}), 404
+    params, _, tokens = stored
+    if params.get("mode") == "score":
+        return jsonify({"error": "Branches can only be explored from generations"}), 400
+    # Chat models answer a conversation and cannot be made to extend a text exactly
+    if not OpenAIClient.can_continue(params["service_type"], params["model"]):
+        return jsonify(
+            {"error": "Branches can only be explored with completions models"}
+        ), 400
+
+    try:
+        position = int(data.get("position", -1))
+        if not 0 <= position < len(tokens):
+            raise ValueError(f"position must be between 0 and {len(tokens) - 1}")
+        entries = token_entries(tokens)
+        alternative = data.get("alternative")
+        alternatives = dict(entries[position][2])
+        if alternative == entries[position][0] or alternative not in alternatives:
+            raise ValueError("alternative must be one of the alternative tokens")
+        max_tokens = int(data.get("max_tokens", params["max_tokens"]))
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    service_type = params["service_type"]
+    response_format = data.get("format", request.args.get("format", "full"))
+    try:
+        key = BranchTrie.make_key(service_type, params, config.DEFAULT_LOGPROBS)
+        branch_trie.add_path(key, entries)
+        path = entries[:position] + [
+            (alternative, alternatives[alternative], entries[position][2])
+        ]
+        cached, finished = branch_trie.continuation(
+            key, [entry[0] for entry in path], max_tokens
+        )
+        path += cached
+
+        new_tokens = TokenSequence()
+        if len(cached) < max_tokens and not finished:
+            with timed("client"):
+                client = get_openai_client(
+                    service_type, timeout=parse_upstream_timeout(data)
+                )
+            with metrics.upstream_timer(
+                service_type, params["model"], request_timings()
+            ):
+                _, new_tokens, finished = client.continue_with_probabilities(
+                    params["prompt"],
+                    "".join(entry[0] for entry in path),
+                    params["model"],
+                    params["temperature"],
+                    params["top_p"],
+                    max_tokens - len(cached),
+                    config.DEFAULT_LOGPROBS,
+                )
+            path += token_entries(new_tokens)
+        branch_trie.add_path(key, path, finished)
+
+        branch_tokens = entries_to_sequence(path)
+        text = "".join(branch_tokens.texts)
+        branch = {
+            "parent": generation_id,
+            "position": position,
+            "cached_tokens": len(cached),
+            "new_tokens": len(new_tokens),
+        }
+        branch_id = generation_store.add(
+            {
+                **params,
+                "max_tokens": max_tokens,
+                "branch_of": generation_id,
+                "position": position,
+            },
+            text,
+            branch_tokens,
+            request_timings(),
+        )
+        body = build_generation_response(
+            text,
+            branch_tokens,
+            params["top_p"],
+            response_format,
+            generation_id=branch_id,
+            branch=branch,
+        )
+        with timed("json_encode"):
+            return jsonify(body)
+    except Exception as e:
+        record_error(e)
+        return error_response(e)
+
+
+@app.route("/api/history", methods=["GET"])
+def list_history():
+    """
+    List persisted generations, newest first.
+
+    Query parameters: model, prompt (or its prompt_hash), since and until (Unix
+    times) filter the listing; limit caps its length.
+    """
+    if generation_history is None:
+        return jsonify({"enabled": False, "generations": []})
+    args = request.args
+    digest = args.get("prompt_hash")
+    if "prompt" in args:
+        digest = prompt_hash(args["prompt"])
+    try:
+        limit = min(int(args.get("limit", 50)), config.HISTORY_LIST_MAX)
+        generations = generation_history.list(
+            model=args.get("model"),
+            digest=digest,
+            since=float(args["since"]) if "since" in args else None,
+            until=float(args["until"]) if "until" in args else None,
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with timed("json_encode"):
+        return jsonify(
+            {"enabled": True, "generations": generations, **generation_history.stats()}
+        )
+
+
+@app.route("/api/history/<generation_id>", methods=["GET"])
+def get_history(generation_id: str):
+    """
+    Reopen a persisted generation without calling the API.
+
+    Rendered like /api/generate in the "format" query parameter, for the
+    stored top_p unless "top_p" is given, plus the generation's params,
+    creation time and timings.
+    """
+    record = generation_history.get(generation_id) if generation_history else None
+    if record is None:
+        return jsonify({"error": f"Unknown generation id: {generation_id}"}), 404
 
-        return jsonify({"text": text, "tokens": processed_tokens, "html": html})
+    response_format = request.args.get("format", "full")
+    extra = {
+        "generation_id": generation_id,
+        "params": record.params,
+        "created": record.created,
+        "timings": record.timings,
+    }
+    try:
+        if response_format == "packed":
+            # The record already holds the packed columns; encode them from the map
+            body = {
+                "text": record.text,
+                "format": "packed",
+                "packed": record.to_packed(),
+                **extra,
+            }
+        else:
+            top_p = float(request.args.get("top_p", record.params.get("top_p", 1.0)))
+            body = build_generation_response(
+                record.text, record.tokens(), top_p, response_format, **extra
+            )
+        with timed("json_encode"):
+            response = jsonify(body)
     except Exception as e:
+        record_error(e)
         return jsonify({"error": str(e)}), 500
+    # Stored generations never change
+    response.headers["Cache-Control"] = "private, max-age=86400"
+    return response
+
+
+@app.route("/api/export", methods=["GET", "POST"])
+def export_tokens():
+    """
+    Export token-level rows of stored generations as Arrow or Parquet.
+
+    Parameters come from the query string or, for POST, a JSON body: "format"
+    ("parquet" or "arrow", the IPC stream format) and either "generation_ids"
+    (e.g. those returned by /api/generate/batch) or the /api/history filters
+    model, prompt, since and until; without either, the whole history is
+    exported. Rows are streamed in record batches as they are written.
+    """
+    if not export.available():
+        return jsonify({"error": "Exports need the pyarrow package"}), 501
+    data = request.get_json(silent=True) or request.args
+    export_format = data.get("format", "parquet")
+    if export_format not in export.EXPORT_FORMATS:
+        return jsonify(
+            {"error": f"format must be one of {', '.join(export.EXPORT_FORMATS)}"}
+        ), 400
+
+    generation_ids = data.get("generation_ids")
+    if isinstance(generation_ids, str):
+        generation_ids = [i for i in generation_ids.split(",") if i]
+    if not generation_ids:
+        if generation_history is None:
+            return jsonify(
+                {"error": "generation_ids are required when the history is disabled"}
+            ), 400
+        try:
+            generation_ids = [
+                entry["id"]
+                for entry in generation_history.list(
+                    model=data.get("model"),
+                    digest=prompt_hash(data["prompt"]) if "prompt" in data else None,
+                    since=float(data["since"]) if "since" in data else None,
+                    until=float(data["until"]) if "until" in data else None,
+                    limit=None,
+                )
+            ]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    def sources():
+        # Generations are loaded one at a time as the export is written, from the
+        # history where possible so the export does not churn the in-memory store
+        for generation_id in generation_ids:
+            record = (
+                generation_history.get(generation_id) if generation_history else None
+            )
+            if record is not None:
+                yield generation_id, record.params, record.tokens()
+                continue
+            stored = generation_store.get(generation_id)
+            if stored is None:
+                app.logger.warning(
+                    f"Skipping unknown generation {generation_id} in export"
+                )
+                continue
+            params, _, tokens = stored
+            yield generation_id, params, tokens
+
+    mimetype, extension = export.EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(export.export_stream(sources(), export_format)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="tokens.{extension}"'},
+    )
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+def get_cache_stats():
+    """Get response cache hit/miss counters and sizes, and request coalescing counts."""
+    coalescing = single_flight.stats()
+    if response_cache is None:
+        return jsonify({"enabled": False, "coalescing": coalescing})
+    return jsonify(
+        {"enabled": True, **response_cache.stats(), "coalescing": coalescing}
+    )
+
+
+@app.route("/api/branch/stats", methods=["GET"])
+def get_branch_stats():
+    """Get the number of explored generation trees and cached tokens."""
+    return jsonify(branch_trie.stats())
+
+
+@app.route("/api/scheduler/stats", methods=["GET"])
+def get_scheduler_stats():
+    """Get rate limiter queue depths, 429 cooldowns and retry/timeout counts."""
+    return jsonify(request_scheduler.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Expose request, stage and cache metrics in the Prometheus text format."""
+    if not config.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    if response_cache is not None:
+        stats = response_cache.stats()
+        for result in ("hits", "misses", "disk_hits"):
+            metrics.RESPONSE_CACHE_EVENTS.set(stats[result], result=result)
+        metrics.RESPONSE_CACHE_ENTRIES.set(stats["memory_entries"], tier="memory")
+        if stats["disk_entries"] is not None:
+            metrics.RESPONSE_CACHE_ENTRIES.set(stats["disk_entries"], tier="disk")
+    return Response(
+        metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.after_request
+def record_request_metrics(response: Response) -> Response:
+    """Count the request and its response size, and add the Server-Timing header."""
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.HTTP_REQUESTS.inc(
+        endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    if not response.is_streamed:
+        metrics.HTTP_RESPONSE_BYTES.inc(
+            response.calculate_content_length() or 0, endpoint=endpoint
+        )
+    timings = g.get("timings")
+    if config.SERVER_TIMING_ENABLED and timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """
+    Compress JSON and text bodies for clients that accept gzip or brotli.
+
+    Registered after record_request_metrics so it runs first, and the response
+    size metric counts the compressed bytes. Streams are sent uncompressed so
+    their events are not held back in a compression buffer.
+    """
+    if (
+        response.is_streamed
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    body = response.get_data()
+    if not compression.should_compress(len(body), response.mimetype):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = compression.choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    with timed("compress"):
+        response.set_data(compression.compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # The compressed body is a different representation of the same resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
 
 @app.route("/api/config", methods=["GET"])
@@ -166,5 +1417,8 @@ def get_config():
 
 
 if __name__ == "__main__":
+    # Fetch the model list at startup so the first page load does not wait for it
+    if config.MODEL_LIST_PREWARM:
+        prewarm_model_list()
     # Run the Flask application
     app.run(host="0.0.0.0", port=config.PORT, debug=config.DEBUG)
@@ -0,0 +1,386 @@
+"""
+ASGI entry point for Token Probability Visualizer.
+
+Serves /api/generate and /api/models with AsyncOpenAIClient on the event loop,
+so a single process can hold many generations in flight without a thread per
+request. All other routes are served by the Flask application.
+
+Run with an ASGI server, e.g.: uvicorn asgi:application --port 5000
+"""
+
+from urllib.parse import parse_qs
+import asyncio
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    app,
+    build_generation_response,
+    build_samples_response,
+    coalesce_key,
+    generation_store,
+    model_list_cache,
+    model_list_key,
+    parse_generation_params,
+    parse_sample_count,
+    parse_upstream_timeout,
+    prewarm_model_list,
+    response_cache,
+    response_cache_key,
+)
+from models.client_registry import AsyncClientRegistry
+from models.rate_limiter import (
+    AsyncRequestScheduler,
+    SchedulerTimeout,
+    is_throttled,
+    is_upstream_timeout,
+)
+from models.single_flight import AsyncSingleFlight
+from utils import compression, metrics
+import config
+
+# Rate limits for calls made on the event loop; Flask routes use app.request_scheduler
+async_request_scheduler = AsyncRequestScheduler()
+
+# Pool of async OpenAI clients; the ASGI server runs one event loop per process
+async_client_registry = AsyncClientRegistry(scheduler=async_request_scheduler)
+
+# Coalescing for requests served on the event loop; Flask routes use app.single_flight
+async_single_flight = AsyncSingleFlight()
+
+flask_application = WsgiToAsgi(app)
+
+
+def get_async_openai_client(service_type: str, lease: bool = False):
+    """
+    Helper function to get a pooled AsyncOpenAIClient from the registry.
+
+    With lease, the client is acquired (see ClientRegistry.acquire) and must be
+    handed back with async_client_registry.release() once the request is done.
+    """
+    get_client = async_client_registry.acquire if lease else async_client_registry.get
+    try:
+        return get_client(
+            service_type=service_type,
+            api_key=config.OPENAI_API_KEY,
+            azure_api_key=config.AZURE_OPENAI_API_KEY,
+            azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
+            azure_api_version=config.AZURE_API_VERSION,
+        )
+    except Exception as e:
+        app.logger.error(
+            f"Error instantiating AsyncOpenAIClient for service type {service_type}: {e}"
+        )
+        raise
+
+
+async def afetch_available_models(service_type: str) -> list:
+    """List a service's models on a client leased for just this call (see app.fetch_available_models)."""
+    client = get_async_openai_client(service_type, lease=True)
+    try:
+        return await client.get_available_models()
+    finally:
+        async_client_registry.release(client)
+
+
+async def read_body(receive) -> bytes:
+    """Read the complete request body from the ASGI receive channel."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(
+    send,
+    payload: dict,
+    status: int = 200,
+    headers: list | None = None,
+    accept_encoding: str = "",
+) -> None:
+    """Send a JSON response, compressed if accept_encoding allows (see utils.compression)."""
+    body = json.dumps(payload).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), *(headers or [])]
+    if compression.should_compress(len(body), "application/json"):
+        headers.append((b"vary", b"Accept-Encoding"))
+        encoding = compression.choose_encoding(accept_encoding)
+        if encoding is not None:
+            body = compression.compress(body, encoding)
+            headers.append((b"content-encoding", encoding.encode("ascii")))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                *headers,
+                (b"content-length", str(len(body)).encode("ascii")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_for_disconnect(receive) -> None:
+    """Return once the client has disconnected; call after the body has been read."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnect(receive, work) -> tuple:
+    """
+    Await work, cancelling it if the client disconnects first.
+
+    Cancelling the work cancels its upstream SDK request, which closes the
+    upstream connection so the model stops generating.
+
+    Returns:
+        Tuple of (result, disconnected); the result is None if the client disconnected
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task.done():
+        return task.result(), False
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return None, True
+
+
+def request_header(scope, name: bytes) -> str:
+    """Return a request header value, or an empty string if absent."""
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin1")
+    return ""
+
+
+async def get_models(scope, receive, send):
+    """Get available models from OpenAI API based on service_type."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin1"))
+    service_type = query.get("service_type", [config.STARTUP_SERVICE_TYPE])[0].lower()
+
+    try:
+        model_list = await model_list_cache.aget(
+            model_list_key(service_type),
+            lambda: afetch_available_models(service_type),
+        )
+        current_default_model = config.DEFAULT_MODEL
+        if service_type == "azure":
+            current_default_model = "gpt-35-turbo"  # Azure's specific model/deployment
+
+        etag = f'"{model_list.etag}"'
+        cache_headers = [
+            (b"etag", etag.encode("ascii")),
+            (
+                b"cache-control",
+                f"max-age={config.MODEL_LIST_BROWSER_MAX_AGE}".encode("ascii"),
+            ),
+        ]
+        if_none_match = request_header(scope, b"if-none-match")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            await send(
+                {"type": "http.response.start", "status": 304, "headers": cache_headers}
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send_json(
+            send,
+            {"models": model_list.models, "default_model": current_default_model},
+            headers=cache_headers,
+            accept_encoding=request_header(scope, b"accept-encoding"),
+        )
+    except Exception as e:
+        app.logger.error(
+            f"Error getting models for service type {service_type}: {str(e)}"
+        )
+        metrics.record_error("/api/models", e)
+        await send_json(send, {"error": str(e)}, 500)
+
+
+async def generate(scope, receive, send):
+    """Generate text and get token probabilities without blocking a thread."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin1"))
+    try:
+        data = json.loads(await read_body(receive) or b"{}")
+    except ValueError:
+        await send_json(send, {"error": "Request body must be JSON"}, 400)
+        return
+    service_type = data.get("service_type", config.STARTUP_SERVICE_TYPE).lower()
+
+    timings = {}
+    pooled_client = None
+    try:
+        with metrics.stage_timer("client", timings):
+            pooled_client = get_async_openai_client(service_type, lease=True)
+        timeout = parse_upstream_timeout(data)
+        client = (
+            pooled_client if timeout is None else pooled_client.with_timeout(timeout)
+        )
+        params = parse_generation_params(data, service_type)
+        response_format = data.get("format", query.get("format", ["full"])[0])
+        n_samples = parse_sample_count(data)
+
+        async def produce_samples() -> dict:
+            with metrics.upstream_timer(service_type, params["model"], timings):
+                samples = await client.generate_samples(
+                    **params, logprobs=config.DEFAULT_LOGPROBS, n=n_samples
+                )
+            return await asyncio.to_thread(
+                build_samples_response, service_type, params, samples, response_format
+            )
+
+        async def produce() -> dict:
+            # Generate text with token probabilities, reusing a cached result if possible;
+            # cache, history and token processing block, so they run in worker threads
+            cache_key = response_cache_key(data, service_type, params)
+            cached = (
+                await asyncio.to_thread(response_cache.get, cache_key)
+                if cache_key
+                else None
+            )
+            if cached:
+                text, tokens = cached
+            else:
+                with metrics.upstream_timer(service_type, params["model"], timings):
+                    text, tokens = await client.generate_with_probabilities(
+                        **params, logprobs=config.DEFAULT_LOGPROBS
+                    )
+                if cache_key:
+                    await asyncio.to_thread(response_cache.put, cache_key, text, tokens)
+
+            generation_id = await asyncio.to_thread(
+                generation_store.add,
+                {"service_type": service_type, **params},
+                text,
+                tokens,
+                timings,
+            )
+            return await asyncio.to_thread(
+                build_generation_response,
+                text,
+                tokens,
+                params["top_p"],
+                response_format,
+                generation_id=generation_id,
+                cached=cached is not None,
+                coalesced=False,
+            )
+
+        async def produce_coalesced() -> dict:
+            body, shared = await async_single_flight.ado(key, produce)
+            if shared:
+                metrics.COALESCED_REQUESTS.inc()
+                body = {**body, "coalesced": True}
+            return body
+
+        # Several samples come from one API call where the model supports n;
+        # identical deterministic requests in flight share one upstream call,
+        # which is left running if this client disconnects, as others may share it
+        key = coalesce_key(service_type, params, response_format, client.timeout)
+        shared_work = None
+        if n_samples > 1:
+            work = produce_samples()
+        elif key is None:
+            work = produce()
+        else:
+            shared_work = asyncio.ensure_future(produce_coalesced())
+            work = asyncio.shield(shared_work)
+        body, disconnected = await run_until_disconnect(receive, work)
+        if disconnected:
+            metrics.record_cancelled("/api/generate", "disconnect")
+            if shared_work is not None and not shared_work.done():
+                # The shared call still uses the client; release it once that ends
+                leased, pooled_client = pooled_client, None
+                shared_work.add_done_callback(
+                    lambda _: async_client_registry.release(leased)
+                )
+            return
+        headers = []
+        if config.SERVER_TIMING_ENABLED and timings:
+            headers.append(
+                (b"server-timing", metrics.server_timing_header(timings).encode())
+            )
+        await send_json(
+            send,
+            body,
+            headers=headers,
+            accept_encoding=request_header(scope, b"accept-encoding"),
+        )
+    except Exception as e:
+        metrics.record_error("/api/generate", e)
+        headers = []
+        if isinstance(e, SchedulerTimeout):
+            headers.append((b"retry-after", str(max(1, round(e.retry_after))).encode()))
+        if is_upstream_timeout(e):
+            metrics.record_cancelled("/api/generate", "timeout")
+            status = 504
+        else:
+            status = 429 if is_throttled(e) else 500
+        await send_json(send, {"error": str(e)}, status, headers)
+    finally:
+        if pooled_client is not None:
+            async_client_registry.release(pooled_client)
+
+
+def counting_send(scope, send):
+    """Wrap send to record request and response byte metrics, like the Flask hook."""
+
+    async def wrapper(message):
+        if message["type"] == "http.response.start":
+            metrics.HTTP_REQUESTS.inc(
+                endpoint=scope["path"],
+                method=scope["method"],
+                status=message["status"],
+            )
+        elif message["type"] == "http.response.body":
+            metrics.HTTP_RESPONSE_BYTES.inc(
+                len(message.get("body", b"")), endpoint=scope["path"]
+            )
+        await send(message)
+
+    return wrapper
+
+
+# Routes handled natively on the event loop; everything else goes to Flask
+ASYNC_ROUTES = {
+    ("GET", "/api/models"): get_models,
+    ("POST", "/api/generate"): generate,
+}
+
+
+async def application(scope, receive, send):
+    """ASGI application combining the async routes with the Flask app."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Fetch the model list at startup so the first page load does not wait for it
+                if config.MODEL_LIST_PREWARM:
+                    prewarm_model_list()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_client_registry.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http":
+        handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            await handler(scope, receive, counting_send(scope, send))
+            return
+
+    await flask_application(scope, receive, send)
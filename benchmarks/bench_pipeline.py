@@ -0,0 +1,247 @@
+"""
+Benchmarks for the token processing and rendering pipeline.
+
+Measures each stage of an /api/generate request on synthetic responses from the
+offline mock backend, across token counts and logprob widths:
+
+    parse_chat         OpenAIClient._chat_response_tokens
+    parse_completion   OpenAIClient._completion_response_tokens
+    process_tokens     TokenProcessor.process_tokens
+    tokens_to_html     TokenProcessor.tokens_to_html
+    json_full          JSON encoding of the "full" response format
+    json_compact       JSON encoding of the "compact" response format
+    json_raw           JSON encoding of the "raw" response format
+    json_packed        JSON encoding of the "packed" response format
+    gzip_raw           gzip of the encoded "raw" response (utils.compression)
+    gzip_packed        gzip of the encoded "packed" response
+
+For every stage the median time per call, token throughput and peak traced
+memory are recorded. Results can be saved as a baseline and compared later.
+Building the synthetic inputs for 100k tokens takes a minute or two; use
+--quick to skip that size.
+
+Usage (from the repository root):
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --quick --save baseline.json
+    python benchmarks/bench_pipeline.py --compare baseline.json --threshold 0.1
+"""
+
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MODEL_LIST_PREWARM", "false")
+
+import numpy as np  # noqa: E402
+
+from app import app, build_generation_response  # noqa: E402
+from models.mock_backend import MockOpenAI  # noqa: E402
+from models.openai_client import OpenAIClient  # noqa: E402
+from models.token_processor import TokenProcessor  # noqa: E402
+from utils import compression  # noqa: E402
+
+DEFAULT_TOKEN_COUNTS = [10, 100, 1_000, 10_000, 100_000]
+QUICK_TOKEN_COUNTS = [10, 100, 1_000, 10_000]
+DEFAULT_WIDTHS = [1, 5, 20]
+TOP_P = 0.9
+PROMPT = "Benchmark prompt"
+
+
+def make_inputs(n_tokens: int, width: int) -> dict:
+    """Build synthetic chat and completions responses plus their parsed forms."""
+    mock = MockOpenAI(token_latency=0, first_token_latency=0)
+    chat_response = mock.chat.completions.create(
+        model="gpt-4",
+        messages=[{"role": "user", "content": PROMPT}],
+        temperature=1.0,
+        max_tokens=n_tokens,
+        logprobs=True,
+        top_logprobs=width,
+    )
+    completion_response = mock.completions.create(
+        model="gpt-3.5-turbo-instruct",
+        prompt=PROMPT,
+        temperature=1.0,
+        max_tokens=n_tokens,
+        logprobs=width,
+    )
+    text, tokens = OpenAIClient._chat_response_tokens(chat_response)
+    processed = TokenProcessor.process_tokens(tokens, top_p=TOP_P)
+    raw = build_generation_response(text, tokens, TOP_P, "raw")
+    packed = build_generation_response(text, tokens, TOP_P, "packed")
+    return {
+        "chat_response": chat_response,
+        "completion_response": completion_response,
+        "text": text,
+        "tokens": tokens,
+        "processed": processed,
+        "full": build_generation_response(text, tokens, TOP_P, "full"),
+        "compact": build_generation_response(text, tokens, TOP_P, "compact"),
+        "raw": raw,
+        "packed": packed,
+        "raw_json": app.json.dumps(raw).encode("utf-8"),
+        "packed_json": app.json.dumps(packed).encode("utf-8"),
+    }
+
+
+STAGES = {
+    "parse_chat": lambda d: OpenAIClient._chat_response_tokens(d["chat_response"]),
+    "parse_completion": lambda d: OpenAIClient._completion_response_tokens(
+        d["completion_response"]
+    ),
+    "process_tokens": lambda d: TokenProcessor.process_tokens(d["tokens"], top_p=TOP_P),
+    "tokens_to_html": lambda d: TokenProcessor.tokens_to_html(d["processed"]),
+    "json_full": lambda d: app.json.dumps(d["full"]),
+    "json_compact": lambda d: app.json.dumps(d["compact"]),
+    "json_raw": lambda d: app.json.dumps(d["raw"]),
+    "json_packed": lambda d: app.json.dumps(d["packed"]),
+    "gzip_raw": lambda d: compression.compress(d["raw_json"], "gzip"),
+    "gzip_packed": lambda d: compression.compress(d["packed_json"], "gzip"),
+}
+
+
+def time_stage(func, data: dict, min_time: float, min_repeats: int) -> float:
+    """Return the median seconds per call over enough repeats to fill min_time."""
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_repeats or time.perf_counter() - started < min_time:
+        t0 = time.perf_counter()
+        func(data)
+        timings.append(time.perf_counter() - t0)
+    return statistics.median(timings)
+
+
+def peak_memory(func, data: dict) -> int:
+    """Return the peak bytes allocated by one call, as traced by tracemalloc."""
+    tracemalloc.start()
+    try:
+        func(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(
+    token_counts: list[int],
+    widths: list[int],
+    stages: list[str],
+    min_time: float,
+    min_repeats: int,
+) -> dict:
+    """Run the benchmark grid and return the results keyed by stage/tokens/width."""
+    results = {}
+    for n_tokens in token_counts:
+        for width in widths:
+            data = make_inputs(n_tokens, width)
+            for stage in stages:
+                func = STAGES[stage]
+                seconds = time_stage(func, data, min_time, min_repeats)
+                key = f"{stage}/{n_tokens}/{width}"
+                results[key] = {
+                    "stage": stage,
+                    "tokens": n_tokens,
+                    "width": width,
+                    "seconds": seconds,
+                    "tokens_per_second": n_tokens / seconds if seconds else None,
+                    "peak_bytes": peak_memory(func, data),
+                }
+                print(format_row(results[key]), flush=True)
+    return results
+
+
+def format_row(result: dict, baseline: dict | None = None) -> str:
+    row = (
+        f"{result['stage']:<17} {result['tokens']:>7} {result['width']:>3}  "
+        f"{result['seconds'] * 1000:>10.3f} ms  "
+        f"{result['tokens_per_second']:>12,.0f} tok/s  "
+        f"{result['peak_bytes'] / 1024:>10,.0f} KiB"
+    )
+    if baseline is not None:
+        row += f"  {relative_change(result, baseline):>+7.1%}"
+    return row
+
+
+def relative_change(result: dict, baseline: dict) -> float:
+    """Relative change in time per call; positive means slower than the baseline."""
+    return result["seconds"] / baseline["seconds"] - 1.0
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print the comparison against a baseline and return the regressed keys."""
+    print(f"\nComparison with baseline (time change, regression > {threshold:.0%}):")
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        print(format_row(result, baseline[key]))
+        if relative_change(result, baseline[key]) > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help="skip 100k tokens")
+    parser.add_argument("--tokens", type=int, nargs="+", help="token counts")
+    parser.add_argument("--widths", type=int, nargs="+", help="logprob widths")
+    parser.add_argument(
+        "--stages", nargs="+", choices=list(STAGES), default=list(STAGES)
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="seconds to time each case"
+    )
+    parser.add_argument(
+        "--min-repeats", type=int, default=3, help="minimum calls per case"
+    )
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against a saved JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown reported as a regression (default 0.1 = 10%%)",
+    )
+    args = parser.parse_args()
+
+    token_counts = args.tokens or (
+        QUICK_TOKEN_COUNTS if args.quick else DEFAULT_TOKEN_COUNTS
+    )
+    widths = args.widths or DEFAULT_WIDTHS
+
+    print(
+        f"{'stage':<17} {'tokens':>7} {'k':>3}  {'time/call':>13}  "
+        f"{'throughput':>18}  {'peak memory':>14}"
+    )
+    results = run(token_counts, widths, args.stages, args.min_time, args.min_repeats)
+
+    if args.save:
+        payload = {
+            "meta": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "results": results,
+        }
+        Path(args.save).write_text(json.dumps(payload, indent=2))
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
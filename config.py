@@ -2,6 +2,7 @@
 Configuration settings for the Token Probability Visualizer application.
 """
 
+import json
 import os
 from dotenv import load_dotenv
 
@@ -12,8 +13,8 @@ DEBUG = True
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-key-for-token-visualizer")
 PORT = 5000
 
-# OpenAI Service Type ('openai' or 'azure') - This is the service used at startup.
-# User can switch in the UI.
+# OpenAI Service Type ('openai', 'azure' or 'mock') - This is the service used at startup.
+# User can switch in the UI. 'mock' generates seeded tokens offline, without an API key.
 STARTUP_SERVICE_TYPE = os.environ.get("STARTUP_SERVICE_TYPE", "openai").lower()
 
 # OpenAI API settings
@@ -24,6 +25,42 @@ AZURE_OPENAI_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY", "")
 AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT", "")
 AZURE_API_VERSION = os.environ.get("AZURE_API_VERSION", "")
 
+# Offline mock backend settings (service type 'mock')
+MOCK_SEED = int(os.environ.get("MOCK_SEED", "0"))
+MOCK_TOKEN_LATENCY = float(
+    os.environ.get("MOCK_TOKEN_LATENCY", "0.02")
+)  # Seconds per generated token
+MOCK_FIRST_TOKEN_LATENCY = float(
+    os.environ.get("MOCK_FIRST_TOKEN_LATENCY", "0.2")
+)  # Seconds before the first token
+
+# Shared OpenAI client pool settings
+# Clients are reused across requests with the same service type and credentials.
+CLIENT_POOL_MAX_CONNECTIONS = int(os.environ.get("CLIENT_POOL_MAX_CONNECTIONS", "100"))
+CLIENT_POOL_MAX_KEEPALIVE = int(os.environ.get("CLIENT_POOL_MAX_KEEPALIVE", "20"))
+CLIENT_POOL_KEEPALIVE_EXPIRY = float(
+    os.environ.get("CLIENT_POOL_KEEPALIVE_EXPIRY", "30")
+)  # Seconds an idle keep-alive connection is held open
+CLIENT_REGISTRY_MAX_CLIENTS = int(os.environ.get("CLIENT_REGISTRY_MAX_CLIENTS", "16"))
+CLIENT_REGISTRY_IDLE_TIMEOUT = float(
+    os.environ.get("CLIENT_REGISTRY_IDLE_TIMEOUT", "600")
+)  # Seconds before an unused client is closed and evicted
+
+# Model list cache for /api/models
+MODEL_LIST_CACHE_TTL = float(
+    os.environ.get("MODEL_LIST_CACHE_TTL", "3600")
+)  # Seconds a listing is served before it is refreshed in the background
+MODEL_LIST_CACHE_STALE_TTL = float(
+    os.environ.get("MODEL_LIST_CACHE_STALE_TTL", "86400")
+)  # Seconds past the TTL a stale listing may be served while refreshing
+MODEL_LIST_BROWSER_MAX_AGE = int(
+    os.environ.get("MODEL_LIST_BROWSER_MAX_AGE", "300")
+)  # Cache-Control max-age sent to browsers
+MODEL_LIST_PREWARM = os.environ.get("MODEL_LIST_PREWARM", "true").lower() == "true"
+
+# Seconds a model that rejected logprobs is requested without them before trying again
+CAPABILITY_CACHE_TTL = float(os.environ.get("CAPABILITY_CACHE_TTL", "86400"))
+
 # Default model settings
 DEFAULT_MODEL = "gpt-3.5-turbo-instruct"
 DEFAULT_TEMPERATURE = 0.8
@@ -31,6 +68,115 @@ DEFAULT_TOP_P = 1.0
 DEFAULT_MAX_TOKENS = 10
 DEFAULT_LOGPROBS = 10
 
+# Batch generation settings (/api/generate/batch)
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+
+# Lowest temperature used when re-deriving probabilities for a temperature view
+MIN_VIEW_TEMPERATURE = 0.01
+
+# Number of recent generations kept in memory for re-deriving top_p/temperature views
+GENERATION_STORE_MAX_ENTRIES = 128
+
+# Persistent generation history (opt-in): every generation is appended to this
+# segment file and can be reopened from /api/history. The file is never pruned,
+# so history is off unless a path is set. Relative paths are resolved against
+# the application directory, so the history is the same however the server is started
+HISTORY_PATH = os.environ.get("HISTORY_PATH", "")
+if HISTORY_PATH:
+    HISTORY_PATH = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), HISTORY_PATH
+    )
+HISTORY_LIST_MAX = int(
+    os.environ.get("HISTORY_LIST_MAX", "500")
+)  # Most entries returned by one /api/history listing
+
+# Token-level Arrow/Parquet exports (/api/export, needs the pyarrow package)
+EXPORT_BATCH_ROWS = int(
+    os.environ.get("EXPORT_BATCH_ROWS", "65536")
+)  # Rows per record batch / Parquet row group
+EXPORT_PARQUET_COMPRESSION = os.environ.get("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+# Token sequences at least this long are processed with the vectorized NumPy path
+VECTORIZED_MIN_TOKENS = 64
+
+# Response cache for deterministic generations (temperature 0, or opt-in per request)
+RESPONSE_CACHE_ENABLED = (
+    os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_TTL = float(
+    os.environ.get("RESPONSE_CACHE_TTL", "86400")
+)  # Seconds, 0 = never expire
+# Path of the SQLite file for the on-disk tier; leave empty for a memory-only cache
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "")
+RESPONSE_CACHE_MAX_DISK_ENTRIES = int(
+    os.environ.get("RESPONSE_CACHE_MAX_DISK_ENTRIES", "10000")
+)
+
+# Multi-sample mode: /api/generate with "n" returns n samples plus per-position stats
+MAX_SAMPLES = int(os.environ.get("MAX_SAMPLES", "16"))
+
+# Prompt scoring (/api/score): logprobs of an existing text, scored in overlapping
+# windows on completions models
+SCORE_MAX_CHARS = int(os.environ.get("SCORE_MAX_CHARS", "200000"))
+SCORE_WINDOW_CHARS = int(
+    os.environ.get("SCORE_WINDOW_CHARS", "8000")
+)  # Characters per window, roughly 2000 tokens of English text
+SCORE_OVERLAP_CHARS = int(
+    os.environ.get("SCORE_OVERLAP_CHARS", "1000")
+)  # Characters shared by consecutive windows, for context at each seam
+SCORE_MAX_CONCURRENCY = int(os.environ.get("SCORE_MAX_CONCURRENCY", "4"))
+
+# Branch exploration (/api/branch): tokens of explored continuations kept in memory
+BRANCH_TRIE_MAX_NODES = int(os.environ.get("BRANCH_TRIE_MAX_NODES", "200000"))
+
+# Model comparison: most models per /api/compare/stream request, all dispatched at once
+COMPARE_MAX_MODELS = int(os.environ.get("COMPARE_MAX_MODELS", "6"))
+
+# Coalescing of identical concurrent deterministic (temperature 0) generations
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "true").lower() == "true"
+COALESCE_WINDOW = float(
+    os.environ.get("COALESCE_WINDOW", "1.0")
+)  # Seconds a finished result stays joinable, 0 = only while in flight
+
+# Upstream timeouts: seconds a call may wait for a response, or for the next chunk
+# of a stream, before it is abandoned. Requests can ask for their own "timeout"
+# up to UPSTREAM_MAX_TIMEOUT; 0 leaves the SDK default of 600 seconds.
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "120"))
+UPSTREAM_MAX_TIMEOUT = float(os.environ.get("UPSTREAM_MAX_TIMEOUT", "600"))
+
+# Upstream rate limits per service type and model (requests and estimated tokens
+# per minute, 0 = unlimited). RATE_LIMITS overrides them per lane as JSON, e.g.
+# {"openai:gpt-4o": {"rpm": 500, "tpm": 30000}, "azure": {"rpm": 60}}
+RATE_LIMIT_RPM = float(os.environ.get("RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_TPM = float(os.environ.get("RATE_LIMIT_TPM", "0"))
+RATE_LIMITS = json.loads(os.environ.get("RATE_LIMITS", "{}"))
+RATE_LIMIT_MAX_RETRIES = int(
+    os.environ.get("RATE_LIMIT_MAX_RETRIES", "4")
+)  # Retries of a call rejected with HTTP 429
+RATE_LIMIT_BACKOFF_BASE = float(
+    os.environ.get("RATE_LIMIT_BACKOFF_BASE", "1.0")
+)  # Seconds before the first retry when the 429 has no Retry-After header
+RATE_LIMIT_BACKOFF_MAX = float(os.environ.get("RATE_LIMIT_BACKOFF_MAX", "60"))
+RATE_LIMIT_MAX_WAIT = float(
+    os.environ.get("RATE_LIMIT_MAX_WAIT", "120")
+)  # Seconds a call may wait for its turn before failing with HTTP 429
+
+# Compression of API response bodies (gzip, or brotli if the brotli package is installed)
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(
+    os.environ.get("COMPRESSION_MIN_SIZE", "1024")
+)  # Bytes; smaller bodies are sent as they are
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "5"))
+
+# Metrics: Prometheus text format at /metrics, and per-request Server-Timing headers
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+SERVER_TIMING_ENABLED = (
+    os.environ.get("SERVER_TIMING_ENABLED", "true").lower() == "true"
+)
+
 # Available models
 AVAILABLE_MODELS = [
     "gpt-3.5-turbo-instruct",
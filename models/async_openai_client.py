@@ -0,0 +1,408 @@
+"""
+Asyncio OpenAI API client for token probability visualization.
+"""
+
+from typing import Awaitable, Callable, Dict, List, Any, Tuple, Optional, Union
+import asyncio
+import copy
+import logging
+
+import httpx
+from openai import AsyncOpenAI, AsyncAzureOpenAI
+
+from models.mock_backend import AsyncMockOpenAI
+from models.model_capabilities import (
+    ModelCapabilities,
+    logprobs_rejected,
+    n_rejected,
+)
+from models.openai_client import OpenAIClient
+from models.rate_limiter import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AsyncRequestScheduler,
+    estimate_tokens,
+)
+from models.token_sequence import TokenSequence
+import config
+
+
+class AsyncOpenAIClient:
+    """
+    Asyncio counterpart of OpenAIClient.
+
+    Requests are awaited instead of blocking a thread, so a single event loop can
+    hold many generations in flight. Responses are parsed with the same helpers
+    as OpenAIClient, so both clients return identical results.
+    """
+
+    def __init__(
+        self,
+        service_type: str = config.STARTUP_SERVICE_TYPE,
+        api_key: Optional[str] = None,
+        azure_api_key: Optional[str] = config.AZURE_OPENAI_API_KEY,
+        azure_endpoint: Optional[str] = config.AZURE_OPENAI_ENDPOINT,
+        azure_api_version: Optional[str] = config.AZURE_API_VERSION,
+        http_client: Optional[httpx.AsyncClient] = None,
+        scheduler: Optional[AsyncRequestScheduler] = None,
+        capabilities: Optional[ModelCapabilities] = None,
+    ):
+        """
+        Initialize the async client for either standard OpenAI or Azure OpenAI.
+
+        Args:
+            service_type: 'openai', 'azure' or 'mock' (offline, see models/mock_backend.py).
+            api_key: OpenAI API key. If None, will try to get from environment variable (config.OPENAI_API_KEY).
+            azure_api_key: Azure OpenAI API key.
+            azure_endpoint: Azure OpenAI endpoint name (e.g., your-resource-name).
+            azure_api_version: Azure OpenAI API version.
+            http_client: Optional shared async HTTP client (connection pool) for the SDK.
+                         If None, the SDK creates its own.
+            scheduler: Optional rate limiter every completion call goes through
+                       (see OpenAIClient).
+            capabilities: Optional record of models that reject logprobs, to
+                          share with other clients. If None, the client keeps
+                          its own.
+        """
+        self.service_type = service_type
+        self.scheduler = scheduler
+        self.capabilities = capabilities or ModelCapabilities()
+        self.timeout: Optional[float] = config.UPSTREAM_TIMEOUT or None
+        self.client: Any
+        sdk_options: Dict[str, Any] = {"max_retries": 0} if scheduler else {}
+
+        if self.service_type == "mock":
+            self.client = AsyncMockOpenAI(http_client=http_client)
+        elif self.service_type == "azure":
+            if not all([azure_api_key, azure_endpoint, azure_api_version]):
+                raise ValueError(
+                    "For Azure OpenAI, AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, "
+                    "and AZURE_API_VERSION must be provided or set in config."
+                )
+            self.client = AsyncAzureOpenAI(
+                api_key=azure_api_key,
+                api_version=azure_api_version,
+                azure_endpoint=f"https://{azure_endpoint}.openai.azure.com/",
+                http_client=http_client,
+                **sdk_options,
+            )
+        else:
+            self.api_key = api_key or config.OPENAI_API_KEY
+            if not self.api_key:
+                raise ValueError(
+                    "OpenAI API key is required. Set it as an argument or OPENAI_API_KEY environment variable/config."
+                )
+            self.client = AsyncOpenAI(
+                api_key=self.api_key, http_client=http_client, **sdk_options
+            )
+
+    async def close(self) -> None:
+        """Close the underlying SDK client and release its connection pool."""
+        await self.client.close()
+
+    def with_timeout(self, timeout: Optional[float]) -> "AsyncOpenAIClient":
+        """
+        Return a copy of the client whose upstream calls time out after timeout seconds.
+
+        The copy shares the SDK client, connection pool and rate limiter, and
+        must not be closed itself. None leaves the SDK's default timeout.
+        """
+        client = copy.copy(self)
+        client.timeout = timeout
+        return client
+
+    async def _schedule(
+        self,
+        create: Callable[..., Awaitable[Any]],
+        create_args: Dict[str, Any],
+        priority: int,
+        prompt: str,
+    ) -> Any:
+        """Make an SDK create call, through the rate limiter if there is one."""
+        if self.timeout is not None:
+            create_args = {**create_args, "timeout": self.timeout}
+        if self.scheduler is None:
+            return await create(**create_args)
+        return await self.scheduler.acall(
+            self.service_type,
+            create_args["model"],
+            lambda: create(**create_args),
+            tokens=estimate_tokens(
+                prompt, create_args["max_tokens"], create_args.get("n") or 1
+            ),
+            priority=priority,
+        )
+
+    def _chat_logprobs(self, model: str, logprobs: Optional[int]) -> Optional[int]:
+        """Return the logprobs to request from model, or None if it rejects them."""
+        if logprobs is None or logprobs <= 0:
+            return None
+        if not self.capabilities.supports_logprobs(self.service_type, model):
+            return None
+        return logprobs
+
+    async def _create_chat(
+        self, request_args: Dict[str, Any], priority: int, prompt: str
+    ) -> Any:
+        """Async variant of OpenAIClient._create_chat."""
+        try:
+            return await self._schedule(
+                self.client.chat.completions.create, request_args, priority, prompt
+            )
+        except Exception as e:
+            if "logprobs" not in request_args or not logprobs_rejected(e):
+                raise
+            self.capabilities.mark_logprobs_unsupported(
+                self.service_type, request_args["model"], e
+            )
+            request_args = {
+                k: v
+                for k, v in request_args.items()
+                if k not in ("logprobs", "top_logprobs")
+            }
+            return await self._schedule(
+                self.client.chat.completions.create, request_args, priority, prompt
+            )
+
+    async def get_available_models(self) -> List[Dict[str, Any]]:
+        """
+        Get a list of available models.
+        For Azure, this returns the configured model(s).
+        For standard OpenAI, it fetches from the API.
+
+        Returns:
+            List of model information dictionaries.
+        """
+        if self.service_type == "azure":
+            return [{"id": "gpt-35-turbo", "name": "gpt-35-turbo"}]
+        response = await self.client.models.list()
+        return [
+            {"id": model.id, "name": model.id}
+            for model in response.data
+            if "gpt" in model.id
+        ]
+
+    async def generate_with_probabilities(
+        self,
+        prompt: str,
+        model: str = config.DEFAULT_MODEL,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        max_tokens: int = 100,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Tuple[str, TokenSequence]:
+        """
+        Generate text and get token probabilities.
+
+        Takes the same arguments as OpenAIClient.generate_with_probabilities.
+
+        Returns:
+            Tuple of (generated_text, token_probabilities)
+        """
+        if OpenAIClient._uses_completions_api(self.service_type, model):
+            api_response = await self._schedule(
+                self.client.completions.create,
+                {
+                    "model": model,
+                    "prompt": prompt,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "max_tokens": max_tokens,
+                    "logprobs": logprobs if logprobs is not None else 0,
+                },
+                priority,
+                prompt,
+            )
+            return OpenAIClient._completion_response_tokens(api_response)
+
+        api_response = await self._create_chat(
+            OpenAIClient._chat_request(
+                prompt,
+                model,
+                temperature,
+                top_p,
+                max_tokens,
+                self._chat_logprobs(model, logprobs),
+            ),
+            priority,
+            prompt,
+        )
+        return OpenAIClient._chat_response_tokens(api_response)
+
+    async def continue_with_probabilities(
+        self,
+        prompt: str,
+        prefix: str,
+        model: str = config.DEFAULT_MODEL,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        max_tokens: int = 100,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Tuple[str, TokenSequence, bool]:
+        """
+        Continue a response to prompt that already starts with prefix.
+
+        Takes the same arguments as OpenAIClient.continue_with_probabilities.
+
+        Returns:
+            Tuple of (generated_text, token_probabilities, finished) for the text
+            after prefix
+
+        Raises:
+            ValueError: If the model is not served by the completions endpoint.
+        """
+        if not OpenAIClient.can_continue(self.service_type, model):
+            raise ValueError(
+                f"Continuing needs a model served by the completions endpoint, not {model}"
+            )
+        text = prompt + prefix
+        api_response = await self._schedule(
+            self.client.completions.create,
+            OpenAIClient._continuation_request(
+                model, text, temperature, top_p, max_tokens, logprobs
+            ),
+            priority,
+            text,
+        )
+        generated_text, tokens = OpenAIClient._completion_response_tokens(api_response)
+        return generated_text, tokens, api_response.choices[0].finish_reason == "stop"
+
+    async def score_prompt(
+        self,
+        prompt: str,
+        model: str = config.DEFAULT_MODEL,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        window_chars: int = config.SCORE_WINDOW_CHARS,
+        overlap_chars: int = config.SCORE_OVERLAP_CHARS,
+        max_concurrency: int = config.SCORE_MAX_CONCURRENCY,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Tuple[str, TokenSequence]:
+        """
+        Get the probability of every token of an existing text.
+
+        Takes the same arguments as OpenAIClient.score_prompt; windows are
+        scored concurrently on the event loop.
+
+        Returns:
+            Tuple of (prompt, token_probabilities)
+        """
+        if not OpenAIClient._uses_completions_api(self.service_type, model):
+            raise ValueError(
+                f"Scoring needs a model served by the completions endpoint, not {model}"
+            )
+        starts = OpenAIClient._score_windows(len(prompt), window_chars, overlap_chars)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def score(start: int):
+            window = prompt[start : start + window_chars]
+            async with semaphore:
+                api_response = await self._schedule(
+                    self.client.completions.create,
+                    OpenAIClient._score_request(model, window, logprobs),
+                    priority,
+                    window,
+                )
+            return start, OpenAIClient._echo_tokens(api_response.choices[0], start)
+
+        windows = await asyncio.gather(*(score(start) for start in starts))
+        return prompt, OpenAIClient._stitch_windows(list(windows), overlap_chars)
+
+    async def generate_samples(
+        self,
+        prompt: str,
+        model: str = config.DEFAULT_MODEL,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        max_tokens: int = 100,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        n: int = 1,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> List[Tuple[str, TokenSequence]]:
+        """
+        Generate n independent samples for one prompt.
+
+        Takes the same arguments as OpenAIClient.generate_samples and likewise
+        falls back to concurrent single generations if n choices are unavailable.
+
+        Returns:
+            List of n tuples of (generated_text, token_probabilities)
+        """
+        request_args = {
+            "prompt": prompt,
+            "model": model,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+            "logprobs": logprobs,
+        }
+        samples: List[Tuple[str, TokenSequence]] = []
+        try:
+            completions_api, create_args = OpenAIClient._samples_request(
+                self.service_type,
+                n=n,
+                **{**request_args, "logprobs": self._chat_logprobs(model, logprobs)},
+            )
+            # Chat calls go through _create_chat, so a model rejecting logprobs
+            # is retried without them like single generations
+            api_response = (
+                await self._schedule(
+                    self.client.completions.create, create_args, priority, prompt
+                )
+                if completions_api
+                else await self._create_chat(create_args, priority, prompt)
+            )
+            samples = OpenAIClient._response_samples(api_response, completions_api)
+        except Exception as e:
+            # Only a model refusing n gets separate calls; other errors would recur
+            if not n_rejected(e):
+                raise
+            logging.warning(
+                f"Could not request {n} choices from model {model} in one call, "
+                f"falling back to separate calls: {e}"
+            )
+
+        if len(samples) < n:
+            for outcome in await self.generate_batch(
+                [request_args] * (n - len(samples)),
+                max_concurrency=n,
+                priority=priority,
+            ):
+                if isinstance(outcome, Exception):
+                    raise outcome
+                samples.append(outcome)
+        return samples[:n]
+
+    async def generate_batch(
+        self,
+        requests: List[Dict[str, Any]],
+        max_concurrency: int = config.BATCH_MAX_CONCURRENCY,
+        priority: int = PRIORITY_BATCH,
+    ) -> List[Union[Tuple[str, TokenSequence], Exception]]:
+        """
+        Run several generations concurrently on the event loop.
+
+        Args:
+            requests: Keyword argument dictionaries for generate_with_probabilities,
+                      one per generation (prompt, model, temperature, ...).
+            max_concurrency: Maximum number of requests awaiting a response at once.
+            priority: Scheduling priority of requests that do not set their own.
+
+        Returns:
+            List in the same order as requests; each entry is either a tuple of
+            (generated_text, token_probabilities) or the exception that request raised
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run(request_args: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    return await self.generate_with_probabilities(
+                        **{"priority": priority, **request_args}
+                    )
+                except Exception as e:
+                    logging.warning(f"Batch generation failed: {e}")
+                    return e
+
+        return list(await asyncio.gather(*(run(args) for args in requests)))
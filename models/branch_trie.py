@@ -0,0 +1,163 @@
+"""
+Prefix trie of explored continuations, for branching from alternative tokens.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import math
+import threading
+
+from models.token_sequence import TokenSequence
+import config
+
+# (text, logprob, ((alternative text, logprob), ...)) of one token
+TokenEntry = Tuple[str, Optional[float], Tuple[Tuple[str, Optional[float]], ...]]
+
+
+def _optional(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def token_entries(tokens: TokenSequence) -> List[TokenEntry]:
+    """Convert a TokenSequence to trie token entries."""
+    offsets = tokens.alt_offsets
+    return [
+        (
+            text,
+            _optional(tokens.logprobs[i]),
+            tuple(
+                (tokens.alt_texts[j], _optional(tokens.alt_logprobs[j]))
+                for j in range(offsets[i], offsets[i + 1])
+            ),
+        )
+        for i, text in enumerate(tokens.texts)
+    ]
+
+
+def entries_to_sequence(entries: Iterable[TokenEntry]) -> TokenSequence:
+    """Build a TokenSequence from trie token entries."""
+    tokens = TokenSequence()
+    for text, logprob, alternatives in entries:
+        tokens.append(text, logprob, alternatives)
+    return tokens
+
+
+class _Node:
+    """
+    One token of an explored path.
+
+    The first child is the continuation the model generated after this token;
+    further children are alternatives that were branched to.
+    """
+
+    __slots__ = ("entry", "children", "finished")
+
+    def __init__(self, entry: Optional[TokenEntry]):
+        self.entry = entry
+        self.children: Dict[str, "_Node"] = {}
+        self.finished = False
+
+
+class BranchTrie:
+    """
+    Thread-safe store of explored generation trees.
+
+    Each tree is keyed by the settings that determine a generation (service
+    type, model, prompt, temperature, top_p) and holds every token path seen
+    for them: the original generations and every continuation generated after
+    an alternative token. Revisiting a path returns its cached tokens, and
+    extending one only needs the tokens past its end.
+
+    Trees are evicted least recently used first once the total number of
+    nodes exceeds max_nodes.
+    """
+
+    def __init__(self, max_nodes: int = config.BRANCH_TRIE_MAX_NODES):
+        """
+        Initialize the trie.
+
+        Args:
+            max_nodes: Maximum number of tokens kept across all trees.
+        """
+        self.max_nodes = max_nodes
+        self._roots: "OrderedDict[tuple, Tuple[_Node, int]]" = OrderedDict()
+        self._nodes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(service_type: str, params: Dict[str, Any], logprobs: int) -> tuple:
+        """Build the tree key from a generation's settings (max_tokens is left out)."""
+        return (
+            service_type,
+            params["model"],
+            params["prompt"],
+            params["temperature"],
+            params["top_p"],
+            logprobs,
+        )
+
+    def add_path(
+        self, key: tuple, entries: Sequence[TokenEntry], finished: bool = False
+    ) -> None:
+        """
+        Record a token path from the start of the generation.
+
+        Args:
+            key: Tree key from make_key
+            entries: Tokens of the path, in order
+            finished: Whether the model stopped after the last token
+        """
+        with self._lock:
+            root, size = self._roots.pop(key, (None, 0))
+            if root is None:
+                root = _Node(None)
+            node = root
+            for entry in entries:
+                child = node.children.get(entry[0])
+                if child is None:
+                    child = node.children[entry[0]] = _Node(entry)
+                    size += 1
+                    self._nodes += 1
+                node = child
+            if finished and entries:
+                node.finished = True
+            self._roots[key] = (root, size)
+            while self._nodes > self.max_nodes and len(self._roots) > 1:
+                _, (_, evicted) = self._roots.popitem(last=False)
+                self._nodes -= evicted
+
+    def continuation(
+        self, key: tuple, path: Sequence[str], limit: int
+    ) -> Tuple[List[TokenEntry], bool]:
+        """
+        Return the cached tokens generated after a path.
+
+        Args:
+            key: Tree key from make_key
+            path: Token texts from the start of the generation
+            limit: Maximum number of tokens returned
+
+        Returns:
+            Tuple of (up to limit cached tokens, whether the model stopped after
+            the last of them so there is nothing more to generate)
+        """
+        with self._lock:
+            item = self._roots.get(key)
+            if item is None:
+                return [], False
+            self._roots.move_to_end(key)
+            node = item[0]
+            for text in path:
+                node = node.children.get(text)
+                if node is None:
+                    return [], False
+            cached = []
+            while len(cached) < limit and node.children:
+                node = next(iter(node.children.values()))
+                cached.append(node.entry)
+            return cached, node.finished and not node.children
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of trees and tokens held."""
+        with self._lock:
+            return {"trees": len(self._roots), "nodes": self._nodes}
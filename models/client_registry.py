@@ -0,0 +1,365 @@
+"""
+Process-wide registry of reusable OpenAI clients.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+import httpx
+from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+
+from models.async_openai_client import AsyncOpenAIClient
+from models.model_capabilities import ModelCapabilities
+from models.openai_client import OpenAIClient
+from models.rate_limiter import RequestScheduler
+import config
+
+RegistryKey = Tuple[str, str, str, str]
+
+
+def _fingerprint(secret: Optional[str]) -> str:
+    """Hash a credential so raw keys are never used as dictionary keys or logged."""
+    if not secret:
+        return ""
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:16]
+
+
+class _RegistryEntry:
+    """A pooled client together with its last-use timestamp and open leases."""
+
+    __slots__ = ("client", "last_used", "leases", "evicted")
+
+    def __init__(self, client: Any):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.evicted = False
+
+
+class ClientRegistry:
+    """
+    Thread-safe cache of warmed OpenAIClient instances.
+
+    Each client owns an HTTP connection pool, so reusing it across requests keeps
+    TLS sessions and keep-alive connections warm. Clients are keyed by service
+    type, credentials, endpoint and API version; clients that stay unused for
+    longer than the idle timeout are closed and evicted.
+
+    Callers that use a client for a whole request take it with acquire() and
+    hand it back with release(). A leased client is never evicted as idle, and
+    one evicted to make room is only closed once its last lease is released,
+    so its connection pool is not closed under a request in flight.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = config.CLIENT_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections: int = config.CLIENT_POOL_MAX_KEEPALIVE,
+        keepalive_expiry: float = config.CLIENT_POOL_KEEPALIVE_EXPIRY,
+        max_clients: int = config.CLIENT_REGISTRY_MAX_CLIENTS,
+        idle_timeout: float = config.CLIENT_REGISTRY_IDLE_TIMEOUT,
+        scheduler: Optional[RequestScheduler] = None,
+    ):
+        """
+        Initialize the registry.
+
+        Args:
+            max_connections: Maximum concurrent connections per client pool.
+            max_keepalive_connections: Maximum idle keep-alive connections per pool.
+            keepalive_expiry: Seconds an idle keep-alive connection is kept open.
+            max_clients: Maximum number of distinct clients held at once.
+            idle_timeout: Seconds after which an unused client is evicted.
+            scheduler: Optional rate limiter shared by every client created
+                       (an AsyncRequestScheduler for AsyncClientRegistry).
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.scheduler = scheduler
+        # Shared by every client, so a model's missing logprobs support is learned once
+        self.capabilities = ModelCapabilities()
+        self._entries: Dict[RegistryKey, _RegistryEntry] = {}
+        # Entries with open leases by id of their client, including evicted ones
+        self._leased: Dict[int, _RegistryEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        service_type: str,
+        api_key: Optional[str] = None,
+        azure_api_key: Optional[str] = None,
+        azure_endpoint: Optional[str] = None,
+        azure_api_version: Optional[str] = None,
+    ) -> RegistryKey:
+        """
+        Build the registry key for a set of client settings.
+
+        Only the settings relevant to the service type take part in the key,
+        so e.g. a configured Azure key does not split the OpenAI pool.
+
+        Returns:
+            Tuple of (service_type, credential fingerprint, endpoint, api_version)
+        """
+        if service_type == "azure":
+            return (
+                service_type,
+                _fingerprint(azure_api_key),
+                azure_endpoint or "",
+                azure_api_version or "",
+            )
+        return (service_type, _fingerprint(api_key), "", "")
+
+    def get(
+        self,
+        service_type: str,
+        api_key: Optional[str] = None,
+        azure_api_key: Optional[str] = None,
+        azure_endpoint: Optional[str] = None,
+        azure_api_version: Optional[str] = None,
+    ) -> OpenAIClient:
+        """
+        Return a pooled client for the given settings, creating it if needed.
+
+        The client is not leased, so it may be closed by a later eviction; use
+        acquire() for a client held across a request.
+
+        Raises:
+            ValueError: If the settings are incomplete for the service type.
+        """
+        return self._get(
+            service_type,
+            api_key,
+            azure_api_key,
+            azure_endpoint,
+            azure_api_version,
+            lease=False,
+        )
+
+    def acquire(
+        self,
+        service_type: str,
+        api_key: Optional[str] = None,
+        azure_api_key: Optional[str] = None,
+        azure_endpoint: Optional[str] = None,
+        azure_api_version: Optional[str] = None,
+    ) -> OpenAIClient:
+        """
+        Lease a pooled client for the given settings, creating it if needed.
+
+        The client stays open until it is handed back with release(), even if
+        it is evicted in the meantime.
+
+        Raises:
+            ValueError: If the settings are incomplete for the service type.
+        """
+        return self._get(
+            service_type,
+            api_key,
+            azure_api_key,
+            azure_endpoint,
+            azure_api_version,
+            lease=True,
+        )
+
+    def release(self, client: OpenAIClient) -> None:
+        """End a lease taken with acquire(), closing the client if it was evicted meanwhile."""
+        with self._lock:
+            entry = self._leased.get(id(client))
+            if entry is None:
+                return
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            if entry.leases > 0:
+                return
+            del self._leased[id(client)]
+            if not entry.evicted:
+                return
+        self._close_client(client)
+
+    def clear(self) -> None:
+        """Close and drop every pooled client; leased ones are closed when released."""
+        with self._lock:
+            closing = [
+                self._evict(key, self._entries[key]) for key in list(self._entries)
+            ]
+        self._close_clients(closing)
+
+    def _get(
+        self,
+        service_type: str,
+        api_key: Optional[str],
+        azure_api_key: Optional[str],
+        azure_endpoint: Optional[str],
+        azure_api_version: Optional[str],
+        lease: bool,
+    ) -> OpenAIClient:
+        """Return (and optionally lease) a pooled client, creating it if needed."""
+        key = self.make_key(
+            service_type, api_key, azure_api_key, azure_endpoint, azure_api_version
+        )
+        with self._lock:
+            closing = self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is None:
+                client = self._create_client(
+                    service_type,
+                    api_key,
+                    azure_api_key,
+                    azure_endpoint,
+                    azure_api_version,
+                )
+                if len(self._entries) >= self.max_clients:
+                    closing.append(self._evict_least_recently_used())
+                entry = _RegistryEntry(client)
+                self._entries[key] = entry
+                logging.info(
+                    f"Created pooled {type(client).__name__} for service type: {service_type}"
+                )
+            entry.last_used = time.monotonic()
+            if lease:
+                entry.leases += 1
+                self._leased[id(entry.client)] = entry
+            client = entry.client
+        # Clients are closed outside the lock, so a slow close does not block get()
+        self._close_clients(closing)
+        return client
+
+    def _create_client(
+        self,
+        service_type: str,
+        api_key: Optional[str],
+        azure_api_key: Optional[str],
+        azure_endpoint: Optional[str],
+        azure_api_version: Optional[str],
+    ) -> OpenAIClient:
+        """Create a client with its own pooled HTTP client."""
+        http_client = DefaultHttpxClient(limits=self.limits)
+        try:
+            return OpenAIClient(
+                service_type=service_type,
+                api_key=api_key,
+                azure_api_key=azure_api_key,
+                azure_endpoint=azure_endpoint,
+                azure_api_version=azure_api_version,
+                http_client=http_client,
+                scheduler=self.scheduler,
+                capabilities=self.capabilities,
+            )
+        except Exception:
+            http_client.close()
+            raise
+
+    def _close_client(self, client: OpenAIClient) -> None:
+        """Close an evicted client."""
+        client.close()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _close_clients(self, clients: List[Optional[OpenAIClient]]) -> None:
+        """Close evicted clients returned by _evict; None stands for a leased one."""
+        for client in clients:
+            if client is not None:
+                self._close_client(client)
+
+    def _evict(self, key: RegistryKey, entry: _RegistryEntry) -> Optional[OpenAIClient]:
+        """
+        Drop an entry. Caller holds the lock.
+
+        Returns:
+            The client to close, or None if it is leased and will be closed by
+            the release of its last lease
+        """
+        del self._entries[key]
+        if entry.leases:
+            entry.evicted = True
+            return None
+        return entry.client
+
+    def _evict_idle(self) -> List[Optional[OpenAIClient]]:
+        """Evict clients idle for longer than the idle timeout. Caller holds the lock."""
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [
+            k for k, e in self._entries.items() if e.last_used < cutoff and not e.leases
+        ]
+        for key in idle:
+            logging.info(f"Evicted idle pooled client for service type: {key[0]}")
+        return [self._evict(key, self._entries[key]) for key in idle]
+
+    def _evict_least_recently_used(self) -> Optional[OpenAIClient]:
+        """Evict the least recently used client, preferring unleased ones. Caller holds the lock."""
+        key = min(
+            self._entries,
+            key=lambda k: (self._entries[k].leases > 0, self._entries[k].last_used),
+        )
+        return self._evict(key, self._entries[key])
+
+
+class AsyncClientRegistry(ClientRegistry):
+    """
+    Registry of AsyncOpenAIClient instances for use on a single event loop.
+
+    Async HTTP connection pools are bound to the loop they were created on, so
+    one registry should be used per event loop (e.g. per ASGI worker process).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._closing: set = set()
+
+    def get(self, *args, **kwargs) -> AsyncOpenAIClient:
+        """Return a pooled async client for the given settings, creating it if needed."""
+        return super().get(*args, **kwargs)
+
+    def acquire(self, *args, **kwargs) -> AsyncOpenAIClient:
+        """Lease a pooled async client for the given settings (see ClientRegistry.acquire)."""
+        return super().acquire(*args, **kwargs)
+
+    async def aclose(self) -> None:
+        """Close and drop every pooled client, waiting for the connections to close."""
+        with self._lock:
+            clients = [entry.client for entry in self._entries.values()]
+            clients += [e.client for e in self._leased.values() if e.evicted]
+            self._entries.clear()
+            self._leased.clear()
+        await asyncio.gather(*(client.close() for client in clients), *self._closing)
+
+    def _create_client(
+        self,
+        service_type: str,
+        api_key: Optional[str],
+        azure_api_key: Optional[str],
+        azure_endpoint: Optional[str],
+        azure_api_version: Optional[str],
+    ) -> AsyncOpenAIClient:
+        """Create an async client with its own pooled HTTP client."""
+        return AsyncOpenAIClient(
+            service_type=service_type,
+            api_key=api_key,
+            azure_api_key=azure_api_key,
+            azure_endpoint=azure_endpoint,
+            azure_api_version=azure_api_version,
+            http_client=DefaultAsyncHttpxClient(limits=self.limits),
+            scheduler=self.scheduler,
+            capabilities=self.capabilities,
+        )
+
+    def _close_client(self, client: AsyncOpenAIClient) -> None:
+        """Close an evicted client on the running loop, or synchronously if none is running."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(client.close())
+            return
+        # Keep a reference so the task is not garbage collected before it runs
+        task = loop.create_task(client.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
@@ -0,0 +1,478 @@
+"""
+Persistent history of generations in an append-only, memory-mapped segment file.
+"""
+
+from array import array
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import base64
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # fcntl is POSIX-only; without it a file must not be shared
+    fcntl = None
+
+from models.token_sequence import TokenSequence
+import config
+
+# Segment file layout (all integers and floats little-endian):
+#
+#   file header   FILE_MAGIC
+#   record*       RECORD_HEADER, then the sections below, then a CRC-32 of
+#                 everything before it in the record
+#
+# Record sections, each padded to a multiple of 4 bytes:
+#   meta          JSON object with params, text and timings
+#   string table  uint32 length per distinct token text, then the UTF-8 bytes
+#   text ids      uint32 per token, indexing the string table
+#   logprobs      float32 per token, NaN where missing
+#   alt_offsets   uint32 per token + 1 (see TokenSequence)
+#   alt text ids  uint32 per alternative
+#   alt logprobs  float32 per alternative
+FILE_MAGIC = b"TPVHIST1"
+RECORD_MAGIC = b"GREC"
+# magic, record length, id, created, prompt hash, meta length, string count,
+# string bytes, token count, alternative count
+RECORD_HEADER = struct.Struct("<4sI16sd8sIIIII4x")
+CRC = struct.Struct("<I")
+
+_PREVIEW_CHARS = 120
+
+
+def prompt_hash(prompt: str) -> str:
+    """Return the hex digest used to look up generations by prompt."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _padded(size: int) -> int:
+    return (size + 3) & ~3
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (_padded(len(data)) - len(data))
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _view(buffer: memoryview, typecode: str):
+    """Read a little-endian section as typed values, without copying where possible."""
+    if sys.byteorder == "big":
+        values = array(typecode, buffer)
+        values.byteswap()
+        return values
+    return buffer.cast(typecode)
+
+
+def encode_record(
+    generation_id: str,
+    created: float,
+    params: Dict[str, Any],
+    text: str,
+    tokens: TokenSequence,
+    timings: Optional[Dict[str, float]] = None,
+) -> bytes:
+    """Serialize one generation as a segment record."""
+    meta = json.dumps(
+        {"params": params, "text": text, "timings": timings or {}}
+    ).encode("utf-8")
+
+    table: Dict[str, int] = {}
+    text_ids = array("I", (table.setdefault(t, len(table)) for t in tokens.texts))
+    alt_ids = array("I", (table.setdefault(t, len(table)) for t in tokens.alt_texts))
+    encoded = [t.encode("utf-8") for t in table]
+    string_bytes = b"".join(encoded)
+
+    body = b"".join(
+        (
+            _pad(meta),
+            _little_endian(array("I", (len(e) for e in encoded))),
+            _pad(string_bytes),
+            _little_endian(text_ids),
+            _little_endian(array("f", tokens.logprobs)),
+            _little_endian(array("I", tokens.alt_offsets)),
+            _little_endian(alt_ids),
+            _little_endian(array("f", tokens.alt_logprobs)),
+        )
+    )
+    header = RECORD_HEADER.pack(
+        RECORD_MAGIC,
+        RECORD_HEADER.size + len(body) + CRC.size,
+        uuid.UUID(generation_id).bytes,
+        created,
+        bytes.fromhex(prompt_hash(params.get("prompt", ""))),
+        len(meta),
+        len(table),
+        len(string_bytes),
+        len(tokens),
+        len(tokens.alt_texts),
+    )
+    record = header + body
+    return record + CRC.pack(zlib.crc32(record))
+
+
+class HistoryRecord:
+    """
+    A stored generation read from the segment file.
+
+    Token data stays in the memory map as typed views until it is needed;
+    to_packed encodes them straight from the map, and tokens builds a
+    TokenSequence for server-side processing.
+    """
+
+    def __init__(self, generation_id: str, created: float, buffer: memoryview):
+        (
+            _,
+            _,
+            _,
+            _,
+            digest,
+            meta_len,
+            n_strings,
+            strings_len,
+            n_tokens,
+            n_alts,
+        ) = RECORD_HEADER.unpack_from(buffer)
+        offset = RECORD_HEADER.size
+
+        def section(size: int) -> memoryview:
+            nonlocal offset
+            view = buffer[offset : offset + size]
+            offset += _padded(size)
+            return view
+
+        meta = json.loads(bytes(section(meta_len)))
+        self.id = generation_id
+        self.created = created
+        self.prompt_hash = digest.hex()
+        self.params: Dict[str, Any] = meta["params"]
+        self.text: str = meta["text"]
+        self.timings: Dict[str, float] = meta["timings"]
+
+        string_lengths = _view(section(4 * n_strings), "I")
+        string_bytes = section(strings_len)
+        self.strings: List[str] = []
+        start = 0
+        for length in string_lengths:
+            self.strings.append(
+                sys.intern(str(string_bytes[start : start + length], "utf-8"))
+            )
+            start += length
+
+        self._text_ids = _view(section(4 * n_tokens), "I")
+        self._logprobs = section(4 * n_tokens)
+        self._alt_offsets = _view(section(4 * (n_tokens + 1)), "I")
+        self._alt_ids = _view(section(4 * n_alts), "I")
+        self._alt_logprobs = section(4 * n_alts)
+
+    def tokens(self) -> TokenSequence:
+        """Build the generation's TokenSequence (probabilities follow from the logprobs)."""
+        strings = self.strings
+        sequence = TokenSequence()
+        sequence.texts = [strings[i] for i in self._text_ids]
+        sequence.logprobs = array("d", _view(self._logprobs, "f"))
+        sequence.probabilities = array("d", (2**v for v in sequence.logprobs))
+        sequence.alt_offsets = array("q", self._alt_offsets)
+        sequence.alt_texts = [strings[i] for i in self._alt_ids]
+        sequence.alt_logprobs = array("d", _view(self._alt_logprobs, "f"))
+        sequence.alt_probabilities = array("d", (2**v for v in sequence.alt_logprobs))
+        return sequence
+
+    def to_packed(self) -> Dict[str, Any]:
+        """
+        Return the tokens in the "packed" format of TokenSequence.to_packed.
+
+        The segment stores the same string table and float32 logprobs, so the
+        logprob columns are base64-encoded directly from the memory map.
+        """
+        return {
+            "strings": self.strings,
+            "text": self._text_ids.tolist(),
+            "logprob": base64.b64encode(self._logprobs).decode("ascii"),
+            "alt_offsets": self._alt_offsets.tolist(),
+            "alt_text": self._alt_ids.tolist(),
+            "alt_logprob": base64.b64encode(self._alt_logprobs).decode("ascii"),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the fields listed by GenerationHistory.list."""
+        return _summary(
+            self.id,
+            self.created,
+            self.prompt_hash,
+            self.params,
+            self.text,
+            len(self._text_ids),
+        )
+
+
+def _summary(
+    generation_id: str,
+    created: float,
+    digest: str,
+    params: Dict[str, Any],
+    text: str,
+    n_tokens: int,
+) -> Dict[str, Any]:
+    return {
+        "id": generation_id,
+        "created": created,
+        "service_type": params.get("service_type"),
+        "model": params.get("model"),
+        "prompt": params.get("prompt", "")[:_PREVIEW_CHARS],
+        "prompt_hash": digest,
+        "text": text[:_PREVIEW_CHARS],
+        "tokens": n_tokens,
+    }
+
+
+class GenerationHistory:
+    """
+    Append-only store of every generation, persisted across restarts.
+
+    Generations are appended as binary records (see the layout above) to a
+    single segment file that is memory-mapped for reading, so reopening a
+    past run reads its logprobs straight from the page cache. A small index
+    by id, prompt hash and model, in append (time) order, is rebuilt from the
+    record headers when the file is opened and kept up to date on append.
+
+    Records are written with a single O_APPEND write under a shared file
+    lock, so several processes can share one file on POSIX systems; each
+    picks up the others' records on its next read. A record torn by a crash
+    is cut off when the file is next opened, under an exclusive lock, so a
+    record another process is still writing is never mistaken for one. Where
+    file locks are unavailable (no fcntl module) the file must not be shared.
+    """
+
+    def __init__(self, path: str = config.HISTORY_PATH):
+        """
+        Open (or create) the segment file.
+
+        Args:
+            path: Path of the segment file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        flags = os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(path, flags, 0o644)
+        self._map: Optional[mmap.mmap] = None
+        self._end = len(FILE_MAGIC)
+
+        # Index: id -> (offset, created), and positions into _entries by prompt
+        # hash and by model; _entries holds list summaries in append order
+        self._offsets: Dict[str, Tuple[int, float]] = {}
+        self._entries: List[Dict[str, Any]] = []
+        self._by_prompt: Dict[str, List[int]] = {}
+        self._by_model: Dict[str, List[int]] = {}
+
+        with self._lock, self._file_lock(exclusive=True):
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                os.write(self._fd, FILE_MAGIC)
+            elif self._read_magic() != FILE_MAGIC:
+                raise ValueError(f"{path} is not a generation history file")
+            self._scan()
+            if self._end < os.fstat(self._fd).st_size:
+                logging.warning(
+                    f"Dropping incomplete record at the end of {path} (offset {self._end})"
+                )
+                os.ftruncate(self._fd, self._end)
+
+    def append(
+        self,
+        generation_id: str,
+        params: Dict[str, Any],
+        text: str,
+        tokens: TokenSequence,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> None:
+        """
+        Persist a generation.
+
+        Args:
+            generation_id: Id the generation was stored under (a uuid4 hex)
+            params: Generation settings, including service_type
+            text: The generated text
+            tokens: The raw tokens with their logprobs
+            timings: Optional stage durations in seconds
+        """
+        record = encode_record(
+            generation_id, time.time(), params, text, tokens, timings
+        )
+        with self._lock:
+            with self._file_lock(exclusive=False):
+                os.write(self._fd, record)
+            self._scan()
+
+    def get(self, generation_id: str) -> Optional[HistoryRecord]:
+        """Return the stored generation for an id, or None if unknown."""
+        with self._lock:
+            self._scan()
+            entry = self._offsets.get(generation_id)
+            if entry is None:
+                return None
+            offset, created = entry
+            buffer = memoryview(self._map)
+        (length,) = struct.unpack_from("<I", buffer, offset + 4)
+        return HistoryRecord(generation_id, created, buffer[offset : offset + length])
+
+    def list(
+        self,
+        model: Optional[str] = None,
+        digest: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: Optional[int] = 50,
+    ) -> List[Dict[str, Any]]:
+        """
+        List stored generations, newest first.
+
+        Args:
+            model: Only generations of this model
+            digest: Only generations of the prompt with this prompt_hash
+            since: Only generations created at or after this Unix time
+            until: Only generations created before this Unix time
+            limit: Maximum number of entries returned, None for all
+
+        Returns:
+            Summaries with id, created, service_type, model, prompt and text
+            previews, prompt_hash and token count
+        """
+        with self._lock:
+            self._scan()
+            if model is not None or digest is not None:
+                candidates = None
+                if model is not None:
+                    candidates = self._by_model.get(model, [])
+                if digest is not None:
+                    matching = self._by_prompt.get(digest, [])
+                    candidates = (
+                        matching
+                        if candidates is None
+                        else sorted(set(candidates).intersection(matching))
+                    )
+            else:
+                candidates = range(len(self._entries))
+
+            results = []
+            for position in reversed(candidates):
+                entry = self._entries[position]
+                if until is not None and entry["created"] >= until:
+                    continue
+                if since is not None and entry["created"] < since:
+                    break
+                results.append(entry)
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of stored generations and the segment size in bytes."""
+        with self._lock:
+            self._scan()
+            return {"entries": len(self._entries), "bytes": self._end}
+
+    def close(self) -> None:
+        """Close the memory map and the segment file."""
+        with self._lock:
+            if self._map is not None:
+                try:
+                    self._map.close()
+                except BufferError:
+                    # Records still being read hold views; the map is unmapped
+                    # once they are released
+                    pass
+                self._map = None
+            os.close(self._fd)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        """Hold a lock on the segment file shared with other processes, if supported."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read_magic(self) -> bytes:
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        return os.read(self._fd, len(FILE_MAGIC))
+
+    def _scan(self) -> None:
+        """Index records appended since the last scan, by this or another process."""
+        size = os.fstat(self._fd).st_size
+        if size <= self._end:
+            return
+        if self._map is None or len(self._map) < size:
+            # Views into an older map keep it alive until they are released
+            self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+        offset = self._end
+        while offset + RECORD_HEADER.size <= size:
+            (
+                magic,
+                length,
+                raw_id,
+                created,
+                digest,
+                meta_len,
+                _,
+                _,
+                n_tokens,
+                _,
+            ) = RECORD_HEADER.unpack_from(buffer, offset)
+            if magic != RECORD_MAGIC or offset + length > size:
+                break
+            (crc,) = CRC.unpack_from(buffer, offset + length - CRC.size)
+            if zlib.crc32(buffer[offset : offset + length - CRC.size]) == crc:
+                meta_start = offset + RECORD_HEADER.size
+                meta = json.loads(bytes(buffer[meta_start : meta_start + meta_len]))
+                self._index(
+                    uuid.UUID(bytes=raw_id).hex,
+                    offset,
+                    created,
+                    digest.hex(),
+                    meta,
+                    n_tokens,
+                )
+            else:
+                logging.warning(
+                    f"Skipping corrupted record in {self.path} (offset {offset})"
+                )
+            offset += length
+        self._end = offset
+
+    def _index(
+        self,
+        generation_id: str,
+        offset: int,
+        created: float,
+        digest: str,
+        meta: Dict[str, Any],
+        n_tokens: int,
+    ) -> None:
+        params = meta["params"]
+        entry = _summary(generation_id, created, digest, params, meta["text"], n_tokens)
+        position = len(self._entries)
+        self._entries.append(entry)
+        self._offsets[generation_id] = (offset, created)
+        self._by_prompt.setdefault(entry["prompt_hash"], []).append(position)
+        self._by_model.setdefault(params.get("model"), []).append(position)
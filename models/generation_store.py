@@ -0,0 +1,95 @@
+"""
+In-memory store of recent generations for re-deriving views without the API.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import logging
+import threading
+import uuid
+
+from models.generation_history import GenerationHistory
+from models.token_sequence import TokenSequence
+import config
+
+StoredGeneration = Tuple[Dict[str, Any], str, TokenSequence]
+
+
+class GenerationStore:
+    """
+    Bounded, thread-safe LRU of generations keyed by generation id.
+
+    With a GenerationHistory, every generation is also persisted, and ids that
+    are no longer (or were never) in memory are looked up there.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = config.GENERATION_STORE_MAX_ENTRIES,
+        history: Optional[GenerationHistory] = None,
+    ):
+        """
+        Initialize the store.
+
+        Args:
+            max_entries: Maximum number of generations kept; the least recently
+                         used are dropped first.
+            history: Optional persistent history every generation is appended to.
+        """
+        self.max_entries = max_entries
+        self.history = history
+        self._entries: "OrderedDict[str, StoredGeneration]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        params: Dict[str, Any],
+        text: str,
+        tokens: TokenSequence,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> str:
+        """
+        Store a generation.
+
+        Args:
+            params: Generation settings (prompt, model, temperature, top_p, ...)
+            text: The generated text
+            tokens: The raw tokens with their logprobs
+            timings: Optional stage durations in seconds, kept in the history
+
+        Returns:
+            The new generation id
+        """
+        generation_id = uuid.uuid4().hex
+        self._remember(generation_id, (params, text, tokens))
+        if self.history is not None:
+            try:
+                self.history.append(generation_id, params, text, tokens, timings)
+            except OSError as e:
+                logging.error(
+                    f"Error writing generation {generation_id} to history: {e}"
+                )
+        return generation_id
+
+    def get(self, generation_id: str) -> Optional[StoredGeneration]:
+        """Return (params, text, tokens) for a generation id, or None if unknown."""
+        with self._lock:
+            entry = self._entries.get(generation_id)
+            if entry is not None:
+                self._entries.move_to_end(generation_id)
+                return entry
+        if self.history is None:
+            return None
+        record = self.history.get(generation_id)
+        if record is None:
+            return None
+        entry = (record.params, record.text, record.tokens())
+        self._remember(generation_id, entry)
+        return entry
+
+    def _remember(self, generation_id: str, entry: StoredGeneration) -> None:
+        with self._lock:
+            self._entries[generation_id] = entry
+            self._entries.move_to_end(generation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
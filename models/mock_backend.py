@@ -0,0 +1,590 @@
+"""
+Offline stand-in for the OpenAI SDK, for load testing and benchmarks.
+"""
+
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+
+import httpx
+from openai import APITimeoutError
+from openai.types import Completion, Model
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+import config
+
+# Word-level vocabulary the mock model samples from
+VOCABULARY = tuple(
+    " " + word
+    for word in (
+        "the a of to and in is it that for on with as was by at from this be or are "
+        "an not but they which one we can all there their has more will would about "
+        "when so what time people could them some other into new like then only year "
+        "also first after way many most may these work world life day part place case "
+        "point number group model token text word language data system value result "
+        "question probability sample chance answer example idea story light water "
+        "city small large good great long little old high different important quickly "
+        "often never always usually really simply finally again together make take "
+        "see know think find give tell become show The It This In We They However For "
+        "When If"
+    ).split()
+) + (".", ",", ";", ":", "!", "?", "\n", "\n\n", " -", " (")
+
+# Number of candidate tokens considered at each position
+CANDIDATES_PER_POSITION = 40
+
+# Words (with their leading whitespace), punctuation and trailing whitespace of
+# an echoed prompt; together the matches cover the whole prompt
+PROMPT_TOKEN = re.compile(r"\s*\w+|\s*[^\w\s]|\s+")
+
+# Number of preceding tokens a scored prompt token's logprob depends on
+SCORE_CONTEXT_TOKENS = 4
+
+# URL of the requests named in the mock's timeout errors; nothing is sent to it
+MOCK_BASE_URL = "https://mock.invalid/v1"
+
+
+class MockToken(NamedTuple):
+    """One sampled token with its natural-log probability and top alternatives."""
+
+    text: str
+    logprob: Optional[float]
+    top_logprobs: List[Tuple[str, float]]
+
+
+class MockOpenAI:
+    """
+    Deterministic fake of the OpenAI client for chat and legacy completions.
+
+    Responses are real openai response types, built from tokens sampled from a
+    seeded pseudo-model, so they flow through the same parsing code as API
+    responses. The same seed, model and request settings always produce the
+    same tokens. Latency is simulated per token, both with and without
+    streaming.
+    """
+
+    def __init__(
+        self,
+        seed: int = config.MOCK_SEED,
+        token_latency: float = config.MOCK_TOKEN_LATENCY,
+        first_token_latency: float = config.MOCK_FIRST_TOKEN_LATENCY,
+        http_client: Optional[httpx.Client] = None,
+    ):
+        """
+        Initialize the mock client.
+
+        Args:
+            seed: Seed mixed into every request's random generator.
+            token_latency: Seconds spent per generated token.
+            first_token_latency: Seconds before the first token is produced.
+            http_client: Accepted for compatibility with the SDK; it is never
+                         used for requests but is closed with the client.
+        """
+        self.seed = seed
+        self.token_latency = token_latency
+        self.first_token_latency = first_token_latency
+        self._http_client = http_client
+        self.chat = _Namespace(completions=_ChatCompletions(self))
+        self.completions = _Completions(self)
+        self.models = _Models()
+
+    def close(self) -> None:
+        """Close the HTTP client handed to the constructor, if any."""
+        if self._http_client is not None:
+            self._http_client.close()
+
+    def sample_tokens(
+        self,
+        model: str,
+        prompt: str,
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        max_tokens: int = 16,
+        top_logprobs: int = 0,
+        sample: int = 0,
+    ) -> List[MockToken]:
+        """
+        Sample a deterministic token sequence for a request.
+
+        Each position draws candidate tokens and a sharpness, so some positions
+        are near-certain and others spread their mass over many alternatives.
+        Reported logprobs are natural logs of the untempered distribution, as
+        with the API; the choice itself honors temperature and top_p. Choices
+        of one request (n > 1) share the distributions and differ only in the
+        tokens drawn from them, selected by sample.
+
+        Returns:
+            List of sampled tokens
+        """
+        seed = f"{self.seed}:{model}:{prompt}:{temperature}:{top_p}:{max_tokens}"
+        rng = random.Random(seed)
+        choice_rng = random.Random(f"{seed}:{sample}")
+        tokens = []
+        for _ in range(max(0, max_tokens)):
+            candidates = rng.sample(VOCABULARY, CANDIDATES_PER_POSITION)
+            sharpness = rng.uniform(0.3, 4.0)
+            logits = sorted(
+                (
+                    -sharpness * rank**0.8 + rng.gauss(0.0, 0.3)
+                    for rank in range(CANDIDATES_PER_POSITION)
+                ),
+                reverse=True,
+            )
+            logprobs = _log_softmax(logits)
+
+            if temperature <= 0:
+                choice = 0
+            else:
+                weights = _nucleus_weights(
+                    [
+                        math.exp(lp)
+                        for lp in _log_softmax([x / temperature for x in logits])
+                    ],
+                    top_p,
+                )
+                choice = choice_rng.choices(range(CANDIDATES_PER_POSITION), weights)[0]
+
+            tokens.append(
+                MockToken(
+                    candidates[choice],
+                    logprobs[choice],
+                    list(zip(candidates[:top_logprobs], logprobs[:top_logprobs])),
+                )
+            )
+        return tokens
+
+    def score_tokens(
+        self, model: str, prompt: str, top_logprobs: int = 0
+    ) -> List[MockToken]:
+        """
+        Score the tokens of a prompt deterministically, as with echo=True.
+
+        Each token's logprob depends only on the token and the few tokens
+        before it, so overlapping windows of a document score the tokens they
+        share alike once past their first few tokens. The first token has no
+        logprob, as with the API.
+
+        Returns:
+            List of the prompt's tokens
+        """
+        texts = PROMPT_TOKEN.findall(prompt)
+        tokens = []
+        for i, text in enumerate(texts):
+            if i == 0:
+                tokens.append(MockToken(text, None, []))
+                continue
+            context = "".join(texts[max(0, i - SCORE_CONTEXT_TOKENS) : i])
+            rng = random.Random(f"{self.seed}:{model}:{context}:{text}")
+            candidates = [
+                candidate
+                for candidate in rng.sample(VOCABULARY, CANDIDATES_PER_POSITION)
+                if candidate != text
+            ][: CANDIDATES_PER_POSITION - 1]
+            rank = min(int(rng.expovariate(0.6)), len(candidates))
+            candidates.insert(rank, text)
+            sharpness = rng.uniform(0.3, 4.0)
+            logprobs = _log_softmax(
+                [-sharpness * r**0.8 for r in range(len(candidates))]
+            )
+            tokens.append(
+                MockToken(
+                    text,
+                    logprobs[rank],
+                    list(zip(candidates[:top_logprobs], logprobs[:top_logprobs])),
+                )
+            )
+        return tokens
+
+    def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _wait(self, seconds: float, timeout: Optional[float]) -> None:
+        """Spend simulated latency, failing like the SDK if it exceeds timeout."""
+        if timeout is not None and seconds > timeout:
+            self._sleep(timeout)
+            raise _timeout_error()
+        self._sleep(seconds)
+
+
+class AsyncMockOpenAI(MockOpenAI):
+    """Asyncio variant of MockOpenAI; create() and list() must be awaited."""
+
+    def __init__(
+        self,
+        seed: int = config.MOCK_SEED,
+        token_latency: float = config.MOCK_TOKEN_LATENCY,
+        first_token_latency: float = config.MOCK_FIRST_TOKEN_LATENCY,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        super().__init__(seed, token_latency, first_token_latency)
+        self._async_http_client = http_client
+        self.chat = _Namespace(completions=_AsyncResource(_ChatCompletions(self)))
+        self.completions = _AsyncResource(_Completions(self))
+        self.models = _AsyncResource(_Models())
+
+    async def close(self) -> None:
+        """Close the HTTP client handed to the constructor, if any."""
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+
+    def _sleep(self, seconds: float) -> None:
+        """Latency is awaited by the async resources rather than blocking here."""
+
+    def _wait(self, seconds: float, timeout: Optional[float]) -> None:
+        """Latency and timeouts are awaited by the async resources."""
+
+
+def _timeout_error() -> APITimeoutError:
+    return APITimeoutError(request=httpx.Request("POST", MOCK_BASE_URL))
+
+
+async def _await_latency(seconds: float, timeout: Optional[float]) -> None:
+    """Await simulated latency, failing like the SDK if it exceeds timeout."""
+    if timeout is not None and seconds > timeout:
+        await asyncio.sleep(timeout)
+        raise _timeout_error()
+    await asyncio.sleep(seconds)
+
+
+def _log_softmax(logits: List[float]) -> List[float]:
+    top = max(logits)
+    log_total = top + math.log(sum(math.exp(x - top) for x in logits))
+    return [x - log_total for x in logits]
+
+
+def _nucleus_weights(probabilities: List[float], top_p: float) -> List[float]:
+    """Zero out candidates outside the top_p nucleus (probabilities are sorted)."""
+    weights = []
+    cumulative = 0.0
+    for probability in probabilities:
+        weights.append(probability if cumulative < top_p or not weights else 0.0)
+        cumulative += probability
+    return weights
+
+
+def _request_digest(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}:{prompt}".encode("utf-8")).hexdigest()[:24]
+
+
+def _token_bytes(text: str) -> List[int]:
+    return list(text.encode("utf-8"))
+
+
+def _chat_logprobs(tokens: List[MockToken]) -> Dict[str, Any]:
+    return {
+        "content": [
+            {
+                "token": token.text,
+                "logprob": token.logprob,
+                "bytes": _token_bytes(token.text),
+                "top_logprobs": [
+                    {"token": text, "logprob": lp, "bytes": _token_bytes(text)}
+                    for text, lp in token.top_logprobs
+                ],
+            }
+            for token in tokens
+        ]
+    }
+
+
+def _completion_logprobs(tokens: List[MockToken], offset: int) -> Dict[str, Any]:
+    text_offset = []
+    for token in tokens:
+        text_offset.append(offset)
+        offset += len(token.text)
+    return {
+        "tokens": [token.text for token in tokens],
+        "token_logprobs": [token.logprob for token in tokens],
+        "top_logprobs": [dict(token.top_logprobs) for token in tokens],
+        "text_offset": text_offset,
+    }
+
+
+def _usage(prompt: str, samples: List[List[MockToken]]) -> Dict[str, int]:
+    prompt_tokens = max(1, len(prompt.split()))
+    completion_tokens = sum(len(tokens) for tokens in samples)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class _MockStream:
+    """Iterable over response chunks with the close() method of SDK streams."""
+
+    def __init__(self, chunks: Iterator[Any]):
+        self._chunks = chunks
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._chunks
+
+    def __next__(self) -> Any:
+        return next(self._chunks)
+
+    def close(self) -> None:
+        self._chunks.close()
+
+
+class _ChatCompletions:
+    """Mock of client.chat.completions."""
+
+    def __init__(self, owner: MockOpenAI):
+        self._owner = owner
+
+    def create(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        max_tokens: Optional[int] = None,
+        logprobs: Optional[bool] = None,
+        top_logprobs: Optional[int] = None,
+        stream: bool = False,
+        n: Optional[int] = None,
+        **kwargs,
+    ):
+        prompt = "\n".join(message.get("content") or "" for message in messages)
+        samples = [
+            self._owner.sample_tokens(
+                model,
+                prompt,
+                temperature,
+                top_p,
+                max_tokens if max_tokens is not None else 16,
+                (top_logprobs or 0) if logprobs else 0,
+                sample=i,
+            )
+            for i in range(1 if stream else max(1, n or 1))
+        ]
+        completion_id = f"chatcmpl-mock-{_request_digest(model, prompt)}"
+        timeout = kwargs.get("timeout")
+        if stream:
+            return _MockStream(
+                self._chunks(completion_id, model, samples[0], bool(logprobs), timeout)
+            )
+
+        self._owner._wait(
+            self._owner.first_token_latency
+            + self._owner.token_latency * len(samples[0]),
+            timeout,
+        )
+        return ChatCompletion.construct(
+            id=completion_id,
+            object="chat.completion",
+            created=int(time.time()),
+            model=model,
+            choices=[
+                {
+                    "index": i,
+                    "finish_reason": "length",
+                    "message": {
+                        "role": "assistant",
+                        "content": "".join(token.text for token in tokens),
+                    },
+                    "logprobs": _chat_logprobs(tokens) if logprobs else None,
+                }
+                for i, tokens in enumerate(samples)
+            ],
+            usage=_usage(prompt, samples),
+        )
+
+    def _chunks(
+        self,
+        completion_id: str,
+        model: str,
+        tokens: List[MockToken],
+        logprobs: bool,
+        timeout: Optional[float],
+    ) -> Iterator[ChatCompletionChunk]:
+        created = int(time.time())
+        self._owner._wait(self._owner.first_token_latency, timeout)
+        for i, token in enumerate(tokens):
+            if i:
+                self._owner._wait(self._owner.token_latency, timeout)
+            yield ChatCompletionChunk.construct(
+                id=completion_id,
+                object="chat.completion.chunk",
+                created=created,
+                model=model,
+                choices=[
+                    {
+                        "index": 0,
+                        "delta": {"content": token.text},
+                        "logprobs": _chat_logprobs([token]) if logprobs else None,
+                        "finish_reason": "length" if i == len(tokens) - 1 else None,
+                    }
+                ],
+            )
+
+
+class _Completions:
+    """Mock of client.completions (legacy completions endpoint)."""
+
+    def __init__(self, owner: MockOpenAI):
+        self._owner = owner
+
+    def create(
+        self,
+        model: str,
+        prompt: str,
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        max_tokens: Optional[int] = 16,
+        logprobs: Optional[int] = None,
+        stream: bool = False,
+        n: Optional[int] = None,
+        echo: bool = False,
+        **kwargs,
+    ):
+        samples = [
+            self._owner.sample_tokens(
+                model,
+                prompt,
+                temperature,
+                top_p,
+                max_tokens if max_tokens is not None else 16,
+                logprobs or 0,
+                sample=i,
+            )
+            for i in range(1 if stream else max(1, n or 1))
+        ]
+        # With echo, the prompt's own tokens come first in each choice
+        echoed = self._owner.score_tokens(model, prompt, logprobs or 0) if echo else []
+        completion_id = f"cmpl-mock-{_request_digest(model, prompt)}"
+        include_logprobs = logprobs is not None
+        timeout = kwargs.get("timeout")
+        if stream:
+            return _MockStream(
+                self._chunks(
+                    completion_id,
+                    model,
+                    prompt,
+                    samples[0],
+                    include_logprobs,
+                    timeout,
+                )
+            )
+
+        self._owner._wait(
+            self._owner.first_token_latency
+            + self._owner.token_latency * len(samples[0]),
+            timeout,
+        )
+        return Completion.construct(
+            id=completion_id,
+            object="text_completion",
+            created=int(time.time()),
+            model=model,
+            choices=[
+                {
+                    "index": i,
+                    "finish_reason": "length",
+                    "text": "".join(token.text for token in echoed + tokens),
+                    "logprobs": _completion_logprobs(
+                        echoed + tokens, 0 if echo else len(prompt)
+                    )
+                    if include_logprobs
+                    else None,
+                }
+                for i, tokens in enumerate(samples)
+            ],
+            usage=_usage(prompt, samples),
+        )
+
+    def _chunks(
+        self,
+        completion_id: str,
+        model: str,
+        prompt: str,
+        tokens: List[MockToken],
+        include_logprobs: bool,
+        timeout: Optional[float],
+    ) -> Iterator[Completion]:
+        created = int(time.time())
+        offset = len(prompt)
+        self._owner._wait(self._owner.first_token_latency, timeout)
+        for i, token in enumerate(tokens):
+            if i:
+                self._owner._wait(self._owner.token_latency, timeout)
+            yield Completion.construct(
+                id=completion_id,
+                object="text_completion",
+                created=created,
+                model=model,
+                choices=[
+                    {
+                        "index": 0,
+                        "text": token.text,
+                        "logprobs": _completion_logprobs([token], offset)
+                        if include_logprobs
+                        else None,
+                        "finish_reason": "length" if i == len(tokens) - 1 else None,
+                    }
+                ],
+            )
+            offset += len(token.text)
+
+
+class _Models:
+    """Mock of client.models, listing the configured models."""
+
+    def list(self):
+        return _Namespace(
+            data=[
+                Model.construct(id=model_id, object="model", created=0, owned_by="mock")
+                for model_id in config.AVAILABLE_MODELS
+            ]
+        )
+
+
+class _AsyncResource:
+    """
+    Async wrapper around a mock resource.
+
+    The wrapped resource runs without latency (see AsyncMockOpenAI._sleep);
+    latency is awaited here instead, so many requests can wait concurrently
+    on one loop.
+    """
+
+    def __init__(self, resource: Any):
+        self._resource = resource
+
+    async def create(self, **kwargs):
+        owner = self._resource._owner
+        result = self._resource.create(**kwargs)
+        timeout = kwargs.get("timeout")
+        if kwargs.get("stream"):
+            return self._stream(result, owner, timeout)
+        # Choices are generated side by side, so latency follows one choice's length
+        await _await_latency(
+            owner.first_token_latency
+            + owner.token_latency
+            * result.usage.completion_tokens
+            / max(1, len(result.choices)),
+            timeout,
+        )
+        return result
+
+    async def list(self):
+        return self._resource.list()
+
+    async def _stream(
+        self, stream: _MockStream, owner: MockOpenAI, timeout: Optional[float]
+    ) -> AsyncIterator[Any]:
+        await _await_latency(owner.first_token_latency, timeout)
+        for i, chunk in enumerate(stream):
+            if i:
+                await _await_latency(owner.token_latency, timeout)
+            yield chunk
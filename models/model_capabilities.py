@@ -0,0 +1,94 @@
+"""
+Record of which models reject logprobs in chat completions requests.
+"""
+
+from typing import Dict, List, Tuple
+import logging
+import re
+import threading
+import time
+
+import config
+
+
+# Matches error messages naming the logprobs parameters, e.g. "logprobs is not supported"
+_LOGPROBS_PARAM = re.compile(r"\b(?:top_)?logprobs\b", re.IGNORECASE)
+
+
+def logprobs_rejected(error: BaseException) -> bool:
+    """
+    Whether an SDK error is the API refusing logprobs (HTTP 400/422 naming them).
+
+    Other rejected requests, e.g. an exceeded context length or a content
+    filter, do not match, so they are raised instead of retried without logprobs.
+    """
+    if getattr(error, "status_code", None) not in (400, 422):
+        return False
+    if getattr(error, "param", None) in ("logprobs", "top_logprobs"):
+        return True
+    return _LOGPROBS_PARAM.search(str(getattr(error, "message", error))) is not None
+
+
+# Matches error messages naming the n parameter, e.g. "Invalid 'n'" or "n must be 1"
+_N_PARAM = re.compile(
+    r"['\"`]n['\"`]|\bn (?:parameter|must|is|should)\b|\bparameter n\b"
+)
+
+
+def n_rejected(error: BaseException) -> bool:
+    """Whether an SDK error is the API refusing the n (number of choices) parameter."""
+    if getattr(error, "status_code", None) != 400:
+        return False
+    if getattr(error, "param", None) == "n":
+        return True
+    return _N_PARAM.search(str(getattr(error, "message", error))) is not None
+
+
+class ModelCapabilities:
+    """
+    Thread-safe record of (service type, model) pairs that reject logprobs.
+
+    Models are assumed to support logprobs until a request with them is
+    rejected; from then on requests for that model are sent without logprobs
+    right away instead of failing first. Entries expire after `ttl` seconds so
+    a model that gains logprobs support is tried again.
+    """
+
+    def __init__(self, ttl: float = config.CAPABILITY_CACHE_TTL):
+        """
+        Initialize the record.
+
+        Args:
+            ttl: Seconds a model stays marked as not supporting logprobs, 0 = forever.
+        """
+        self.ttl = ttl
+        self._unsupported: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def supports_logprobs(self, service_type: str, model: str) -> bool:
+        """Whether requests for model should ask for logprobs."""
+        key = (service_type, model)
+        with self._lock:
+            marked_at = self._unsupported.get(key)
+            if marked_at is None:
+                return True
+            if self.ttl > 0 and time.monotonic() - marked_at > self.ttl:
+                del self._unsupported[key]
+                return True
+            return False
+
+    def mark_logprobs_unsupported(
+        self, service_type: str, model: str, error: BaseException
+    ) -> None:
+        """Remember that model rejected a request with logprobs."""
+        with self._lock:
+            self._unsupported[(service_type, model)] = time.monotonic()
+        logging.warning(
+            f"Logprobs not available for model {model} via chat completions, "
+            f"requesting it without logprobs from now on: {error}"
+        )
+
+    def logprobs_unsupported(self) -> List[str]:
+        """Return "service_type:model" for every model currently marked."""
+        with self._lock:
+            return sorted(f"{s}:{m}" for s, m in self._unsupported)
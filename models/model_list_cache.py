@@ -0,0 +1,149 @@
+"""
+Cache of available model listings with stale-while-revalidate refresh.
+"""
+
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import config
+
+ModelInfo = Dict[str, Any]
+
+
+class ModelList(NamedTuple):
+    """A cached model listing with its ETag and fetch time."""
+
+    models: List[ModelInfo]
+    etag: str
+    fetched_at: float
+
+
+class ModelListCache:
+    """
+    Thread-safe cache of model listings, keyed per service/credential set.
+
+    Listings younger than the TTL are served as-is. Older listings are still
+    served, but trigger a single background refresh; only listings older than
+    TTL + stale TTL (or never fetched) are fetched while the caller waits.
+    """
+
+    def __init__(
+        self,
+        ttl: float = config.MODEL_LIST_CACHE_TTL,
+        stale_ttl: float = config.MODEL_LIST_CACHE_STALE_TTL,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl: Seconds a listing is served without refreshing it.
+            stale_ttl: Seconds past the TTL a listing may still be served while a
+                       background refresh runs.
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: Dict[Hashable, ModelList] = {}
+        self._refreshing: Set[Hashable] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, fetch: Callable[[], List[ModelInfo]]) -> ModelList:
+        """
+        Return the listing for a key, fetching or refreshing it as needed.
+
+        Args:
+            key: Cache key, e.g. from ClientRegistry.make_key
+            fetch: Function returning a fresh model listing
+
+        Returns:
+            The cached ModelList
+        """
+        entry, refresh = self._lookup(key)
+        if entry is None:
+            return self._store(key, fetch())
+        if refresh:
+            threading.Thread(
+                target=self._refresh, args=(key, fetch), daemon=True
+            ).start()
+        return entry
+
+    async def aget(
+        self, key: Hashable, fetch: Callable[[], Awaitable[List[ModelInfo]]]
+    ) -> ModelList:
+        """Async variant of get, refreshing in a task on the running event loop."""
+        entry, refresh = self._lookup(key)
+        if entry is None:
+            return self._store(key, await fetch())
+        if refresh:
+            task = asyncio.get_running_loop().create_task(self._arefresh(key, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return entry
+
+    def clear(self) -> None:
+        """Drop every cached listing."""
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key: Hashable) -> Tuple[Optional[ModelList], bool]:
+        """
+        Find a usable entry and decide whether this caller should refresh it.
+
+        Returns:
+            Tuple of (entry or None if it must be fetched now, whether to start
+            a background refresh)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry.fetched_at > self.ttl + self.stale_ttl:
+                return None, False
+            if now - entry.fetched_at > self.ttl and key not in self._refreshing:
+                self._refreshing.add(key)
+                return entry, True
+            return entry, False
+
+    def _store(self, key: Hashable, models: List[ModelInfo]) -> ModelList:
+        digest = hashlib.sha256(
+            json.dumps(models, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:32]
+        entry = ModelList(models, digest, time.time())
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], List[ModelInfo]]) -> None:
+        try:
+            self._store(key, fetch())
+        except Exception as e:
+            logging.warning(f"Background model list refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _arefresh(
+        self, key: Hashable, fetch: Callable[[], Awaitable[List[ModelInfo]]]
+    ) -> None:
+        try:
+            self._store(key, await fetch())
+        except Exception as e:
+            logging.warning(f"Background model list refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
@@ -2,11 +2,27 @@
 OpenAI API client for token probability visualization.
 """
 
-from typing import Dict, List, Any, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any, Tuple, Optional, Iterator, Union
+import copy
 import logging
 
+import httpx
 from openai import OpenAI, AzureOpenAI
 
+from models.mock_backend import MockOpenAI
+from models.model_capabilities import (
+    ModelCapabilities,
+    logprobs_rejected,
+    n_rejected,
+)
+from models.rate_limiter import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    RequestScheduler,
+    estimate_tokens,
+)
+from models.token_sequence import TokenSequence
 import config
 
 
@@ -20,21 +36,38 @@ class OpenAIClient:
         azure_api_key: Optional[str] = config.AZURE_OPENAI_API_KEY,
         azure_endpoint: Optional[str] = config.AZURE_OPENAI_ENDPOINT,
         azure_api_version: Optional[str] = config.AZURE_API_VERSION,
+        http_client: Optional[httpx.Client] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        capabilities: Optional[ModelCapabilities] = None,
     ):
         """
         Initialize the OpenAI client for either standard OpenAI or Azure OpenAI.
 
         Args:
-            service_type: 'openai' or 'azure'.
+            service_type: 'openai', 'azure' or 'mock' (offline, see models/mock_backend.py).
             api_key: OpenAI API key. If None, will try to get from environment variable (config.OPENAI_API_KEY).
             azure_api_key: Azure OpenAI API key.
             azure_endpoint: Azure OpenAI endpoint name (e.g., your-resource-name).
             azure_api_version: Azure OpenAI API version.
+            http_client: Optional shared HTTP client (connection pool) for the SDK.
+                         If None, the SDK creates its own.
+            scheduler: Optional rate limiter every completion call goes through.
+                       It retries 429 responses itself, so the SDK's own
+                       retries are turned off when one is given.
+            capabilities: Optional record of models that reject logprobs, to
+                          share with other clients. If None, the client keeps
+                          its own.
         """
         self.service_type = service_type
+        self.scheduler = scheduler
+        self.capabilities = capabilities or ModelCapabilities()
+        self.timeout: Optional[float] = config.UPSTREAM_TIMEOUT or None
         self.client: Any
+        sdk_options: Dict[str, Any] = {"max_retries": 0} if scheduler else {}
 
-        if self.service_type == "azure":
+        if self.service_type == "mock":
+            self.client = MockOpenAI(http_client=http_client)
+        elif self.service_type == "azure":
             if not all([azure_api_key, azure_endpoint, azure_api_version]):
                 raise ValueError(
                     "For Azure OpenAI, AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, "
@@ -44,6 +77,8 @@ class OpenAIClient:
                 api_key=azure_api_key,
                 api_version=azure_api_version,
                 azure_endpoint=f"https://{azure_endpoint}.openai.azure.com/",
+                http_client=http_client,
+                **sdk_options,
             )
         else:
             self.api_key = api_key or config.OPENAI_API_KEY
@@ -51,7 +86,376 @@ class OpenAIClient:
                 raise ValueError(
                     "OpenAI API key is required. Set it as an argument or OPENAI_API_KEY environment variable/config."
                 )
-            self.client = OpenAI(api_key=self.api_key)
+            self.client = OpenAI(
+                api_key=self.api_key, http_client=http_client, **sdk_options
+            )
+
+    def close(self) -> None:
+        """Close the underlying SDK client and release its connection pool."""
+        self.client.close()
+
+    def with_timeout(self, timeout: Optional[float]) -> "OpenAIClient":
+        """
+        Return a copy of the client whose upstream calls time out after timeout seconds.
+
+        The copy shares the SDK client, connection pool and rate limiter, and
+        must not be closed itself. None leaves the SDK's default timeout.
+        """
+        client = copy.copy(self)
+        client.timeout = timeout
+        return client
+
+    def _schedule(
+        self,
+        create: Callable[..., Any],
+        create_args: Dict[str, Any],
+        priority: int,
+        prompt: str,
+    ) -> Any:
+        """Make an SDK create call, through the rate limiter if there is one."""
+        if self.timeout is not None:
+            create_args = {**create_args, "timeout": self.timeout}
+        if self.scheduler is None:
+            return create(**create_args)
+        return self.scheduler.call(
+            self.service_type,
+            create_args["model"],
+            lambda: create(**create_args),
+            tokens=estimate_tokens(
+                prompt, create_args["max_tokens"], create_args.get("n") or 1
+            ),
+            priority=priority,
+        )
+
+    def _chat_logprobs(self, model: str, logprobs: Optional[int]) -> Optional[int]:
+        """Return the logprobs to request from model, or None if it rejects them."""
+        if logprobs is None or logprobs <= 0:
+            return None
+        if not self.capabilities.supports_logprobs(self.service_type, model):
+            return None
+        return logprobs
+
+    def _create_chat(
+        self, request_args: Dict[str, Any], priority: int, prompt: str
+    ) -> Any:
+        """
+        Make a chat completions call, repeating it without logprobs if the model rejects them.
+
+        The rejection is remembered, so later calls for the model skip logprobs
+        from the start (see _chat_logprobs).
+        """
+        try:
+            return self._schedule(
+                self.client.chat.completions.create, request_args, priority, prompt
+            )
+        except Exception as e:
+            if "logprobs" not in request_args or not logprobs_rejected(e):
+                raise
+            self.capabilities.mark_logprobs_unsupported(
+                self.service_type, request_args["model"], e
+            )
+            request_args = {
+                k: v
+                for k, v in request_args.items()
+                if k not in ("logprobs", "top_logprobs")
+            }
+            return self._schedule(
+                self.client.chat.completions.create, request_args, priority, prompt
+            )
+
+    @staticmethod
+    def _chat_token_info(token_logprob_info: Any) -> Dict[str, Any]:
+        """Build a token info dictionary from a chat completions logprob entry."""
+        token_info: Dict[str, Any] = {
+            "token": token_logprob_info.token,
+            "text": token_logprob_info.token,
+            "logprob": token_logprob_info.logprob,
+            "probability": 2**token_logprob_info.logprob
+            if token_logprob_info.logprob is not None
+            else None,
+            "top_logprobs": {},
+        }
+        if token_logprob_info.top_logprobs:
+            for top_alt_token in token_logprob_info.top_logprobs:
+                token_info["top_logprobs"][top_alt_token.token] = {
+                    "logprob": top_alt_token.logprob,
+                    "probability": 2**top_alt_token.logprob
+                    if top_alt_token.logprob is not None
+                    else None,
+                }
+        return token_info
+
+    @staticmethod
+    def _completion_token_info(
+        token_str: str,
+        token_logp: Optional[float],
+        top_logprobs: Optional[Dict[str, float]],
+    ) -> Dict[str, Any]:
+        """Build a token info dictionary from legacy completions logprob lists."""
+        token_info: Dict[str, Any] = {
+            "token": token_str,
+            "text": token_str,
+            "logprob": token_logp,
+            "probability": 2**token_logp if token_logp is not None else None,
+            "top_logprobs": {},
+        }
+        if top_logprobs:
+            for alt_token_text, alt_logprob in top_logprobs.items():
+                token_info["top_logprobs"][alt_token_text] = {
+                    "logprob": alt_logprob,
+                    "probability": 2**alt_logprob if alt_logprob is not None else None,
+                }
+        return token_info
+
+    @staticmethod
+    def _char_token_info(char_token: str) -> Dict[str, Any]:
+        """Build a token info dictionary for text returned without logprobs."""
+        return {
+            "token": char_token,
+            "text": char_token,
+            "logprob": None,
+            "probability": None,
+            "top_logprobs": {},
+        }
+
+    @staticmethod
+    def _uses_completions_api(service_type: str, model: str) -> bool:
+        """Whether a model is served by the legacy completions endpoint."""
+        return service_type != "azure" and (
+            "instruct" in model or model in ["davinci-002", "babbage-002"]
+        )
+
+    @staticmethod
+    def _char_tokens(generated_text: str) -> TokenSequence:
+        """Build a sequence of one token per character for text without logprobs."""
+        tokens = TokenSequence()
+        for char_token in generated_text:
+            tokens.append(char_token, None)
+        return tokens
+
+    @staticmethod
+    def _chat_response_tokens(response: Any) -> Tuple[str, TokenSequence]:
+        """Extract the generated text and tokens from a chat completions response."""
+        return OpenAIClient._chat_choice_tokens(response.choices[0])
+
+    @staticmethod
+    def _chat_choice_tokens(choice: Any) -> Tuple[str, TokenSequence]:
+        """Extract the generated text and tokens from one chat completions choice."""
+        generated_text = choice.message.content or ""
+        if not (choice.logprobs and choice.logprobs.content):
+            return generated_text, OpenAIClient._char_tokens(generated_text)
+
+        tokens = TokenSequence()
+        for token_logprob_info in choice.logprobs.content:
+            tokens.append(
+                token_logprob_info.token,
+                token_logprob_info.logprob,
+                (
+                    (top_alt_token.token, top_alt_token.logprob)
+                    for top_alt_token in token_logprob_info.top_logprobs or ()
+                ),
+            )
+        return generated_text, tokens
+
+    @staticmethod
+    def _completion_response_tokens(api_response: Any) -> Tuple[str, TokenSequence]:
+        """Extract the generated text and tokens from a legacy completions response."""
+        return OpenAIClient._completion_choice_tokens(api_response.choices[0])
+
+    @staticmethod
+    def _completion_choice_tokens(choice: Any) -> Tuple[str, TokenSequence]:
+        """Extract the generated text and tokens from one legacy completions choice."""
+        generated_text = choice.text
+        tokens = TokenSequence()
+
+        if choice.logprobs:
+            raw_logprobs = choice.logprobs
+            resp_tokens = raw_logprobs.tokens if hasattr(raw_logprobs, "tokens") else []
+            resp_token_logprobs = (
+                raw_logprobs.token_logprobs
+                if hasattr(raw_logprobs, "token_logprobs")
+                else []
+            )
+            resp_top_logprobs = (
+                raw_logprobs.top_logprobs
+                if hasattr(raw_logprobs, "top_logprobs")
+                else []
+            )
+
+            for i, token_str in enumerate(resp_tokens):
+                token_logp = (
+                    resp_token_logprobs[i] if i < len(resp_token_logprobs) else None
+                )
+                alternatives = (
+                    resp_top_logprobs[i].items()
+                    if resp_top_logprobs
+                    and i < len(resp_top_logprobs)
+                    and resp_top_logprobs[i]
+                    else ()
+                )
+                tokens.append(token_str, token_logp, alternatives)
+        return generated_text, tokens
+
+    @staticmethod
+    def _score_windows(length: int, window_chars: int, overlap_chars: int) -> List[int]:
+        """
+        Start offsets of the windows a text of length characters is scored in.
+
+        Each window is window_chars long and overlaps the previous one by
+        overlap_chars, so its first tokens, scored with little context, can be
+        taken from the previous window instead.
+        """
+        if not 0 <= overlap_chars < window_chars:
+            raise ValueError("Scoring overlap must be smaller than the window")
+        starts = [0]
+        while starts[-1] + window_chars < length:
+            starts.append(starts[-1] + window_chars - overlap_chars)
+        return starts
+
+    @staticmethod
+    def _score_request(
+        model: str, text: str, logprobs: Optional[int]
+    ) -> Dict[str, Any]:
+        """Build the arguments of a completions call returning logprobs for text itself."""
+        return {
+            "model": model,
+            "prompt": text,
+            "max_tokens": 0,
+            "echo": True,
+            "logprobs": logprobs if logprobs is not None else 0,
+        }
+
+    @staticmethod
+    def _echo_tokens(
+        choice: Any, start: int
+    ) -> List[Tuple[int, str, Optional[float], Any]]:
+        """
+        Extract the echoed tokens of one scoring window.
+
+        Returns:
+            List of (offset in the whole text, token, logprob, alternatives)
+        """
+        raw_logprobs = choice.logprobs
+        if not raw_logprobs or not raw_logprobs.tokens:
+            return []
+        top_logprobs = raw_logprobs.top_logprobs or []
+        return [
+            (
+                start + raw_logprobs.text_offset[i],
+                token_str,
+                raw_logprobs.token_logprobs[i],
+                top_logprobs[i].items()
+                if i < len(top_logprobs) and top_logprobs[i]
+                else (),
+            )
+            for i, token_str in enumerate(raw_logprobs.tokens)
+        ]
+
+    @staticmethod
+    def _stitch_windows(
+        windows: List[Tuple[int, List[Tuple[int, str, Optional[float], Any]]]],
+        overlap_chars: int,
+    ) -> TokenSequence:
+        """
+        Join scored windows into one sequence without repeating the overlap.
+
+        Each seam is placed at a token boundary shared by both windows, past
+        the middle of their overlap: tokens before it come from the earlier
+        window, which saw more context for them, and tokens from it on come
+        from the later one, whose last tokens are not cut off by its end.
+
+        Args:
+            windows: (start offset, tokens from _echo_tokens) per window, in order
+            overlap_chars: Overlap between consecutive windows
+        """
+        stitched = list(windows[0][1]) if windows else []
+        for start, window_tokens in windows[1:]:
+            middle = start + overlap_chars // 2
+            boundaries = {token[0] for token in stitched if token[0] >= start}
+            later = [token[0] for token in window_tokens if token[0] >= middle]
+            seam = next((offset for offset in later if offset in boundaries), None)
+            if seam is None:
+                seam = later[0] if later else start + overlap_chars
+            while stitched and stitched[-1][0] >= seam:
+                stitched.pop()
+            stitched.extend(token for token in window_tokens if token[0] >= seam)
+
+        tokens = TokenSequence()
+        for _, token_str, token_logp, alternatives in stitched:
+            tokens.append(token_str, token_logp, alternatives)
+        return tokens
+
+    @staticmethod
+    def _chat_request(
+        prompt: str,
+        model: str,
+        temperature: float,
+        top_p: float,
+        max_tokens: int,
+        logprobs: Optional[int],
+    ) -> Dict[str, Any]:
+        """Build the arguments of a chat completions call, with logprobs if logprobs > 0."""
+        request_args: Dict[str, Any] = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+        }
+        if logprobs is not None and logprobs > 0:
+            request_args["logprobs"] = True
+            request_args["top_logprobs"] = logprobs
+        return request_args
+
+    @staticmethod
+    def _samples_request(
+        service_type: str,
+        prompt: str,
+        model: str,
+        temperature: float,
+        top_p: float,
+        max_tokens: int,
+        logprobs: Optional[int],
+        n: int,
+    ) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Build the arguments of a single API call asking for n choices.
+
+        Returns:
+            Tuple of (whether the legacy completions endpoint is used, keyword
+            arguments for its create method)
+        """
+        if OpenAIClient._uses_completions_api(service_type, model):
+            return True, {
+                "model": model,
+                "prompt": prompt,
+                "temperature": temperature,
+                "top_p": top_p,
+                "max_tokens": max_tokens,
+                "logprobs": logprobs if logprobs is not None else 0,
+                "n": n,
+            }
+        return False, {
+            **OpenAIClient._chat_request(
+                prompt, model, temperature, top_p, max_tokens, logprobs
+            ),
+            "n": n,
+        }
+
+    @staticmethod
+    def _response_samples(
+        api_response: Any, completions_api: bool
+    ) -> List[Tuple[str, TokenSequence]]:
+        """Extract (generated_text, tokens) for every choice of a response, in order."""
+        parse = (
+            OpenAIClient._completion_choice_tokens
+            if completions_api
+            else OpenAIClient._chat_choice_tokens
+        )
+        return [
+            parse(choice)
+            for choice in sorted(api_response.choices, key=lambda c: c.index or 0)
+        ]
 
     def get_available_models(self) -> List[Dict[str, Any]]:
         """
@@ -80,7 +484,8 @@ class OpenAIClient:
         top_p: float = 1.0,
         max_tokens: int = 100,
         logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
-    ) -> Tuple[str, List[Dict[str, Any]]]:
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Tuple[str, TokenSequence]:
         """
         Generate text and get token probabilities.
 
@@ -92,184 +497,361 @@ class OpenAIClient:
             max_tokens: Maximum number of tokens to generate.
             logprobs: Number of log probabilities to return per token.
                       Set to None to disable logprobs for models that don't support it well.
+            priority: Scheduling priority under rate limits (see models/rate_limiter.py).
 
         Returns:
             Tuple of (generated_text, token_probabilities)
         """
-        tokens: List[Dict[str, Any]] = []
-        generated_text: str = ""
+        if self._uses_completions_api(self.service_type, model):
+            api_response = self._schedule(
+                self.client.completions.create,
+                {
+                    "model": model,
+                    "prompt": prompt,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "max_tokens": max_tokens,
+                    "logprobs": logprobs if logprobs is not None else 0,
+                },
+                priority,
+                prompt,
+            )
+            return self._completion_response_tokens(api_response)
 
-        if self.service_type == "azure":
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-                logprobs=True if logprobs is not None and logprobs > 0 else None,
-                top_logprobs=logprobs
-                if logprobs is not None and logprobs > 0
-                else None,
+        # OpenAI and Azure chat models share one request and parsing path; text
+        # returned without logprobs becomes one token per character
+        api_response = self._create_chat(
+            self._chat_request(
+                prompt,
+                model,
+                temperature,
+                top_p,
+                max_tokens,
+                self._chat_logprobs(model, logprobs),
+            ),
+            priority,
+            prompt,
+        )
+        return self._chat_response_tokens(api_response)
+
+    @staticmethod
+    def can_continue(service_type: str, model: str) -> bool:
+        """
+        Whether continue_with_probabilities supports a model.
+
+        Only completions models take an arbitrary text to extend; chat models
+        answer a conversation and do not reliably continue a partial reply.
+        """
+        return OpenAIClient._uses_completions_api(service_type, model)
+
+    @staticmethod
+    def _continuation_request(
+        model: str,
+        text: str,
+        temperature: float,
+        top_p: float,
+        max_tokens: int,
+        logprobs: Optional[int],
+    ) -> Dict[str, Any]:
+        """Build the legacy completions arguments that extend text."""
+        return {
+            "model": model,
+            "prompt": text,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+            "logprobs": logprobs if logprobs is not None else 0,
+        }
+
+    def continue_with_probabilities(
+        self,
+        prompt: str,
+        prefix: str,
+        model: str = config.DEFAULT_MODEL,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        max_tokens: int = 100,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Tuple[str, TokenSequence, bool]:
+        """
+        Continue a response to prompt that already starts with prefix.
+
+        The model gets prompt + prefix as its prompt, so it needs a model served
+        by the completions endpoint (see can_continue).
+
+        Takes the arguments of generate_with_probabilities plus:
+            prefix: Text the response has so far.
+
+        Returns:
+            Tuple of (generated_text, token_probabilities, finished) for the text
+            after prefix; finished is whether the model stopped on its own
+            (finish_reason "stop") rather than at max_tokens
+
+        Raises:
+            ValueError: If the model is not served by the completions endpoint.
+        """
+        if not self.can_continue(self.service_type, model):
+            raise ValueError(
+                f"Continuing needs a model served by the completions endpoint, not {model}"
             )
-            generated_text = response.choices[0].message.content or ""
-
-            if response.choices[0].logprobs and response.choices[0].logprobs.content:
-                for token_logprob_info in response.choices[0].logprobs.content:
-                    token_info: Dict[str, Any] = {
-                        "token": token_logprob_info.token,
-                        "text": token_logprob_info.token,
-                        "logprob": token_logprob_info.logprob,
-                        "probability": 2**token_logprob_info.logprob
-                        if token_logprob_info.logprob is not None
-                        else None,
-                        "top_logprobs": {},
-                    }
-                    if token_logprob_info.top_logprobs:
-                        for top_alt_token in token_logprob_info.top_logprobs:
-                            token_info["top_logprobs"][top_alt_token.token] = {
-                                "logprob": top_alt_token.logprob,
-                                "probability": 2**top_alt_token.logprob
-                                if top_alt_token.logprob is not None
-                                else None,
-                            }
-                    tokens.append(token_info)
-            else:
-                for char_token in generated_text:
-                    tokens.append(
-                        {
-                            "token": char_token,
-                            "text": char_token,
-                            "logprob": None,
-                            "probability": None,
-                            "top_logprobs": {},
-                        }
-                    )
-            return generated_text, tokens
-
-        elif "instruct" in model or model in ["davinci-002", "babbage-002"]:
-            api_response = self.client.completions.create(
-                model=model,
-                prompt=prompt,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-                logprobs=logprobs if logprobs is not None else 0,
+        text = prompt + prefix
+        api_response = self._schedule(
+            self.client.completions.create,
+            self._continuation_request(
+                model, text, temperature, top_p, max_tokens, logprobs
+            ),
+            priority,
+            text,
+        )
+        generated_text, tokens = self._completion_response_tokens(api_response)
+        return generated_text, tokens, api_response.choices[0].finish_reason == "stop"
+
+    def score_prompt(
+        self,
+        prompt: str,
+        model: str = config.DEFAULT_MODEL,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        window_chars: int = config.SCORE_WINDOW_CHARS,
+        overlap_chars: int = config.SCORE_OVERLAP_CHARS,
+        max_concurrency: int = config.SCORE_MAX_CONCURRENCY,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Tuple[str, TokenSequence]:
+        """
+        Get the probability of every token of an existing text.
+
+        Uses the legacy completions endpoint with echo=True and max_tokens=0, so
+        the model returns logprobs for the text itself instead of generating.
+        Long texts are split into overlapping windows (see _score_windows) that
+        are scored concurrently and stitched back together (see _stitch_windows).
+
+        Args:
+            prompt: The text to score.
+            model: A model served by the completions endpoint.
+            logprobs: Number of alternatives to return per token.
+            window_chars: Characters per scored window.
+            overlap_chars: Characters shared by consecutive windows.
+            max_concurrency: Maximum number of windows scored at once.
+            priority: Scheduling priority under rate limits.
+
+        Returns:
+            Tuple of (prompt, token_probabilities); the first token has no logprob
+        """
+        if not self._uses_completions_api(self.service_type, model):
+            raise ValueError(
+                f"Scoring needs a model served by the completions endpoint, not {model}"
             )
-            generated_text = api_response.choices[0].text
+        starts = self._score_windows(len(prompt), window_chars, overlap_chars)
 
-            if api_response.choices[0].logprobs:
-                raw_logprobs = api_response.choices[0].logprobs
-                resp_tokens = (
-                    raw_logprobs.tokens if hasattr(raw_logprobs, "tokens") else []
-                )
-                resp_token_logprobs = (
-                    raw_logprobs.token_logprobs
-                    if hasattr(raw_logprobs, "token_logprobs")
-                    else []
-                )
-                resp_top_logprobs = (
-                    raw_logprobs.top_logprobs
-                    if hasattr(raw_logprobs, "top_logprobs")
-                    else []
-                )
+        def score(start: int):
+            window = prompt[start : start + window_chars]
+            api_response = self._schedule(
+                self.client.completions.create,
+                self._score_request(model, window, logprobs),
+                priority,
+                window,
+            )
+            return start, self._echo_tokens(api_response.choices[0], start)
 
-                for i, token_str in enumerate(resp_tokens):
-                    token_logp = (
-                        resp_token_logprobs[i] if i < len(resp_token_logprobs) else None
-                    )
-                    token_info = {
-                        "token": token_str,
-                        "text": token_str,
-                        "logprob": token_logp,
-                        "probability": 2**token_logp
-                        if token_logp is not None
-                        else None,
-                        "top_logprobs": {},
-                    }
-                    if (
-                        resp_top_logprobs
-                        and i < len(resp_top_logprobs)
-                        and resp_top_logprobs[i]
-                    ):
-                        for alt_token_text, alt_logprob in resp_top_logprobs[i].items():
-                            token_info["top_logprobs"][alt_token_text] = {
-                                "logprob": alt_logprob,
-                                "probability": 2**alt_logprob
-                                if alt_logprob is not None
-                                else None,
-                            }
-                    tokens.append(token_info)
-            return generated_text, tokens
+        if len(starts) == 1:
+            windows = [score(0)]
         else:
+            workers = max(1, min(max_concurrency, len(starts)))
+            with ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="score-prompt"
+            ) as executor:
+                windows = list(executor.map(score, starts))
+        return prompt, self._stitch_windows(windows, overlap_chars)
+
+    def generate_samples(
+        self,
+        prompt: str,
+        model: str = config.DEFAULT_MODEL,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        max_tokens: int = 100,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        n: int = 1,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> List[Tuple[str, TokenSequence]]:
+        """
+        Generate n independent samples for one prompt.
+
+        The samples are requested as n choices of a single API call. If the
+        model rejects n (HTTP 400 naming the parameter), or returns fewer
+        choices, the missing samples come from concurrent single generations
+        (see generate_batch); any other error is raised.
+
+        Takes the arguments of generate_with_probabilities plus:
+            n: Number of samples to generate.
+
+        Returns:
+            List of n tuples of (generated_text, token_probabilities)
+        """
+        request_args = {
+            "prompt": prompt,
+            "model": model,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+            "logprobs": logprobs,
+        }
+        samples: List[Tuple[str, TokenSequence]] = []
+        try:
+            completions_api, create_args = self._samples_request(
+                self.service_type,
+                n=n,
+                **{**request_args, "logprobs": self._chat_logprobs(model, logprobs)},
+            )
+            # Chat calls go through _create_chat, so a model rejecting logprobs
+            # is retried without them like single generations
+            api_response = (
+                self._schedule(
+                    self.client.completions.create, create_args, priority, prompt
+                )
+                if completions_api
+                else self._create_chat(create_args, priority, prompt)
+            )
+            samples = self._response_samples(api_response, completions_api)
+        except Exception as e:
+            # Only a model refusing n gets separate calls; other errors would recur
+            if not n_rejected(e):
+                raise
+            logging.warning(
+                f"Could not request {n} choices from model {model} in one call, "
+                f"falling back to separate calls: {e}"
+            )
+
+        if len(samples) < n:
+            for outcome in self.generate_batch(
+                [request_args] * (n - len(samples)),
+                max_concurrency=n,
+                priority=priority,
+            ):
+                if isinstance(outcome, Exception):
+                    raise outcome
+                samples.append(outcome)
+        return samples[:n]
+
+    def generate_batch(
+        self,
+        requests: List[Dict[str, Any]],
+        max_concurrency: int = config.BATCH_MAX_CONCURRENCY,
+        priority: int = PRIORITY_BATCH,
+    ) -> List[Union[Tuple[str, TokenSequence], Exception]]:
+        """
+        Run several generations concurrently.
+
+        Requests are dispatched on a thread pool sharing this client's connection
+        pool, with at most max_concurrency in flight at a time.
+
+        Args:
+            requests: Keyword argument dictionaries for generate_with_probabilities,
+                      one per generation (prompt, model, temperature, ...).
+            max_concurrency: Maximum number of requests running at once.
+            priority: Scheduling priority of requests that do not set their own;
+                      batches queue behind interactive requests by default.
+
+        Returns:
+            List in the same order as requests; each entry is either a tuple of
+            (generated_text, token_probabilities) or the exception that request raised
+        """
+
+        def run(request_args: Dict[str, Any]):
             try:
-                api_response = self.client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=temperature,
-                    top_p=top_p,
-                    max_tokens=max_tokens,
-                    logprobs=True if logprobs is not None and logprobs > 0 else None,
-                    top_logprobs=logprobs
-                    if logprobs is not None and logprobs > 0
-                    else None,
+                return self.generate_with_probabilities(
+                    **{"priority": priority, **request_args}
                 )
-                generated_text = api_response.choices[0].message.content or ""
-
-                if (
-                    api_response.choices[0].logprobs
-                    and api_response.choices[0].logprobs.content
-                ):
-                    for token_logprob_info in api_response.choices[0].logprobs.content:
-                        token_info = {
-                            "token": token_logprob_info.token,
-                            "text": token_logprob_info.token,
-                            "logprob": token_logprob_info.logprob,
-                            "probability": 2**token_logprob_info.logprob
-                            if token_logprob_info.logprob is not None
+            except Exception as e:
+                logging.warning(f"Batch generation failed: {e}")
+                return e
+
+        if not requests:
+            return []
+        workers = max(1, min(max_concurrency, len(requests)))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="generate-batch"
+        ) as executor:
+            return list(executor.map(run, requests))
+
+    def stream_with_probabilities(
+        self,
+        prompt: str,
+        model: str = config.DEFAULT_MODEL,
+        temperature: float = 0.7,
+        top_p: float = 1.0,
+        max_tokens: int = 100,
+        logprobs: Optional[int] = config.DEFAULT_LOGPROBS,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Stream generated tokens with their probabilities as they arrive.
+
+        Takes the same arguments as generate_with_probabilities and yields token
+        information dictionaries of the same shape, one per token. The upstream
+        stream is closed when the iterator is exhausted or closed early.
+
+        Yields:
+            Token information dictionaries
+        """
+        if self._uses_completions_api(self.service_type, model):
+            stream = self._schedule(
+                self.client.completions.create,
+                {
+                    "model": model,
+                    "prompt": prompt,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "max_tokens": max_tokens,
+                    "logprobs": logprobs if logprobs is not None else 0,
+                    "stream": True,
+                },
+                priority,
+                prompt,
+            )
+            try:
+                for chunk in stream:
+                    if not chunk.choices or not chunk.choices[0].logprobs:
+                        continue
+                    raw_logprobs = chunk.choices[0].logprobs
+                    resp_tokens = raw_logprobs.tokens or []
+                    resp_token_logprobs = raw_logprobs.token_logprobs or []
+                    resp_top_logprobs = raw_logprobs.top_logprobs or []
+                    for i, token_str in enumerate(resp_tokens):
+                        yield self._completion_token_info(
+                            token_str,
+                            resp_token_logprobs[i]
+                            if i < len(resp_token_logprobs)
+                            else None,
+                            resp_top_logprobs[i]
+                            if i < len(resp_top_logprobs)
                             else None,
-                            "top_logprobs": {},
-                        }
-                        if token_logprob_info.top_logprobs:
-                            for top_alt_token in token_logprob_info.top_logprobs:
-                                token_info["top_logprobs"][top_alt_token.token] = {
-                                    "logprob": top_alt_token.logprob,
-                                    "probability": 2**top_alt_token.logprob
-                                    if top_alt_token.logprob is not None
-                                    else None,
-                                }
-                        tokens.append(token_info)
-                else:
-                    for char_token in generated_text:
-                        tokens.append(
-                            {
-                                "token": char_token,
-                                "text": char_token,
-                                "logprob": None,
-                                "probability": None,
-                                "top_logprobs": {},
-                            }
                         )
-                return generated_text, tokens
-            except Exception as e:
-                logging.warning(
-                    f"Logprobs not available for model {model} via chat completions or error: {e}"
-                )
-                api_response = self.client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=temperature,
-                    top_p=top_p,
-                    max_tokens=max_tokens,
-                )
-                generated_text = api_response.choices[0].message.content or ""
-                for char_token in generated_text:
-                    tokens.append(
-                        {
-                            "token": char_token,
-                            "text": char_token,
-                            "logprob": None,
-                            "probability": None,
-                            "top_logprobs": {},
-                        }
-                    )
-                return generated_text, tokens
+            finally:
+                stream.close()
+            return
+
+        request_args = self._chat_request(
+            prompt,
+            model,
+            temperature,
+            top_p,
+            max_tokens,
+            self._chat_logprobs(model, logprobs),
+        )
+        stream = self._create_chat({**request_args, "stream": True}, priority, prompt)
+
+        try:
+            for chunk in stream:
+                # Azure sends content filter results in chunks without choices
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.logprobs and choice.logprobs.content:
+                    for token_logprob_info in choice.logprobs.content:
+                        yield self._chat_token_info(token_logprob_info)
+                elif choice.delta and choice.delta.content:
+                    for char_token in choice.delta.content:
+                        yield self._char_token_info(char_token)
+        finally:
+            stream.close()
@@ -0,0 +1,438 @@
+"""
+Rate limiting and priority scheduling of upstream completion calls.
+"""
+
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import httpx
+from openai import APITimeoutError
+
+from utils import metrics
+import config
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+# Fraction of a backoff delay added at random, so throttled callers do not retry in lockstep
+BACKOFF_JITTER = 0.25
+
+LaneKey = Tuple[str, str]
+Ticket = Tuple[int, int]
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call waits longer than the scheduler's max_wait for its turn."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(prompt: str, max_tokens: int, n: int = 1) -> int:
+    """
+    Estimate the tokens a request counts against a tokens-per-minute budget.
+
+    The prompt is counted at about 4 characters per token, and every choice is
+    assumed to use all of max_tokens, as the API does when reserving quota.
+    """
+    return len(prompt or "") // 4 + 1 + max(0, max_tokens) * max(1, n)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Whether an SDK error is an HTTP 429 response."""
+    return getattr(error, "status_code", None) == 429
+
+
+def is_throttled(error: BaseException) -> bool:
+    """Whether an error means the call was held back by rate limits, upstream or here."""
+    return isinstance(error, SchedulerTimeout) or is_rate_limited(error)
+
+
+def is_upstream_timeout(error: BaseException) -> bool:
+    """Whether an error means an upstream call was abandoned at its timeout."""
+    return isinstance(error, (APITimeoutError, httpx.TimeoutException))
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Return the delay an error's Retry-After(-Ms) header asks for, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        milliseconds = headers.get("retry-after-ms")
+        if milliseconds:
+            return max(0.0, float(milliseconds) / 1000)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    """Budget refilled continuously up to a per-minute limit; a limit of 0 is unlimited."""
+
+    __slots__ = ("limit", "level", "updated")
+
+    def __init__(self, per_minute: float):
+        self.limit = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken from the bucket."""
+        if self.limit <= 0:
+            return 0.0
+        self.level = min(
+            self.limit, self.level + (now - self.updated) * self.limit / 60.0
+        )
+        self.updated = now
+        # A request larger than the whole budget waits for a full bucket
+        amount = min(amount, self.limit)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.limit
+
+    def take(self, amount: float) -> None:
+        """Take amount from the bucket; call only after delay returned 0."""
+        if self.limit > 0:
+            self.level -= min(amount, self.limit)
+
+
+class _Lane:
+    """Budgets, 429 cooldown and waiting callers of one service type and model."""
+
+    __slots__ = ("requests", "tokens", "blocked_until", "waiters")
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = _Bucket(requests_per_minute)
+        self.tokens = _Bucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.waiters: List[Ticket] = []
+
+
+class RequestScheduler:
+    """
+    Admits upstream calls per (service type, model) within rate budgets.
+
+    Each service type and model has a requests-per-minute and a
+    tokens-per-minute budget. Calls that do not fit wait in a queue ordered by
+    priority (interactive before batch) and then arrival. A call rejected with
+    HTTP 429 is retried after the Retry-After delay, or an exponential backoff
+    if the response has none, plus jitter; the delay pauses the whole lane, so
+    queued calls do not run into the same limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = config.RATE_LIMIT_RPM,
+        tokens_per_minute: float = config.RATE_LIMIT_TPM,
+        limits: Optional[Dict[str, Dict[str, float]]] = None,
+        max_retries: int = config.RATE_LIMIT_MAX_RETRIES,
+        backoff_base: float = config.RATE_LIMIT_BACKOFF_BASE,
+        backoff_max: float = config.RATE_LIMIT_BACKOFF_MAX,
+        max_wait: float = config.RATE_LIMIT_MAX_WAIT,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            requests_per_minute: Default requests per minute per lane, 0 = unlimited.
+            tokens_per_minute: Default estimated tokens per minute per lane, 0 = unlimited.
+            limits: Overrides keyed by "service_type:model", "model" or
+                    "service_type", each with optional "rpm" and "tpm".
+                    Defaults to config.RATE_LIMITS.
+            max_retries: Retries of a call rejected with HTTP 429.
+            backoff_base: First backoff delay in seconds when no Retry-After is sent.
+            backoff_max: Longest backoff delay in seconds.
+            max_wait: Seconds a call may wait in the queue before SchedulerTimeout.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.limits = config.RATE_LIMITS if limits is None else limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self._lanes: Dict[LaneKey, _Lane] = {}
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._sequence = itertools.count()
+        self.retries = 0
+        self.timeouts = 0
+
+    def call(
+        self,
+        service_type: str,
+        model: str,
+        fn: Callable[[], Any],
+        tokens: int = 1,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Any:
+        """
+        Run fn once the lane has budget, retrying it on HTTP 429.
+
+        Args:
+            service_type: Service type of the call
+            model: Model (or Azure deployment) of the call
+            fn: Function making the upstream call
+            tokens: Estimated tokens of the call (see estimate_tokens)
+            priority: PRIORITY_INTERACTIVE, PRIORITY_BATCH or another int;
+                      lower values go first
+
+        Returns:
+            The result of fn
+
+        Raises:
+            SchedulerTimeout: If the call waited longer than max_wait for its turn
+        """
+        for attempt in itertools.count():
+            self.acquire(service_type, model, tokens, priority)
+            try:
+                return fn()
+            except Exception as e:
+                if not self._back_off(service_type, model, e, attempt):
+                    raise
+
+    def acquire(
+        self,
+        service_type: str,
+        model: str,
+        tokens: int = 1,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> float:
+        """
+        Wait until the call is first in its lane's queue and fits its budgets.
+
+        Returns:
+            Seconds waited
+        """
+        key = (service_type, model)
+        started = time.monotonic()
+        with self._condition:
+            ticket = self._enqueue(key, priority)
+            try:
+                while True:
+                    delay = self._poll(key, ticket, tokens)
+                    if delay == 0:
+                        break
+                    remaining = self._remaining(key, ticket, started)
+                    self._condition.wait(
+                        remaining if delay is None else min(remaining, delay)
+                    )
+            except BaseException:
+                self._leave(key, ticket)
+                raise
+            finally:
+                # The next caller in the queue may be able to go now
+                self._condition.notify_all()
+        return self._record_wait(service_type, priority, started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, 429 cooldowns and retry/timeout counts per lane."""
+        now = time.monotonic()
+        with self._lock:
+            lanes = {
+                f"{service_type}:{model}": {
+                    "queued": len(lane.waiters),
+                    "cooldown": round(max(0.0, lane.blocked_until - now), 3),
+                }
+                for (service_type, model), lane in self._lanes.items()
+            }
+            return {
+                "queued": sum(lane["queued"] for lane in lanes.values()),
+                "retries": self.retries,
+                "timeouts": self.timeouts,
+                "lanes": lanes,
+            }
+
+    def _lane_limits(self, service_type: str, model: str) -> Tuple[float, float]:
+        """Return (requests, tokens) per minute for a lane, applying overrides."""
+        for name in (f"{service_type}:{model}", model, service_type):
+            override = self.limits.get(name)
+            if override is not None:
+                return (
+                    float(override.get("rpm", self.requests_per_minute)),
+                    float(override.get("tpm", self.tokens_per_minute)),
+                )
+        return self.requests_per_minute, self.tokens_per_minute
+
+    def _enqueue(self, key: LaneKey, priority: int) -> Ticket:
+        """Add a waiting caller to its lane. Caller holds the lock."""
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(*self._lane_limits(*key))
+        ticket = (priority, next(self._sequence))
+        heapq.heappush(lane.waiters, ticket)
+        self._update_depth(key, lane)
+        return ticket
+
+    def _poll(self, key: LaneKey, ticket: Ticket, tokens: int) -> Optional[float]:
+        """
+        Admit the caller if it is first in line and the budgets allow. Caller holds the lock.
+
+        Returns:
+            0 if admitted, seconds until the budgets allow it if it is first in
+            line, or None if other callers are ahead of it
+        """
+        lane = self._lanes[key]
+        if lane.waiters[0] != ticket:
+            return None
+        now = time.monotonic()
+        delay = max(
+            lane.blocked_until - now,
+            lane.requests.delay(1, now),
+            lane.tokens.delay(tokens, now),
+        )
+        if delay > 0:
+            return delay
+        heapq.heappop(lane.waiters)
+        lane.requests.take(1)
+        lane.tokens.take(tokens)
+        self._update_depth(key, lane)
+        return 0
+
+    def _remaining(self, key: LaneKey, ticket: Ticket, started: float) -> float:
+        """Seconds the caller may still wait. Caller holds the lock."""
+        remaining = started + self.max_wait - time.monotonic()
+        if remaining > 0:
+            return remaining
+        self.timeouts += 1
+        metrics.SCHEDULER_TIMEOUTS.inc(service_type=key[0], model=key[1])
+        lane = self._lanes[key]
+        retry_after = max(self.backoff_base, lane.blocked_until - time.monotonic())
+        raise SchedulerTimeout(
+            f"Timed out after {self.max_wait:g}s waiting for rate limit budget for "
+            f"{key[0]} model {key[1]} ({len(lane.waiters) - 1} other requests queued)",
+            retry_after=retry_after,
+        )
+
+    def _leave(self, key: LaneKey, ticket: Ticket) -> None:
+        """Remove a caller that gave up waiting. Caller holds the lock."""
+        lane = self._lanes[key]
+        if ticket in lane.waiters:
+            lane.waiters.remove(ticket)
+            heapq.heapify(lane.waiters)
+            self._update_depth(key, lane)
+
+    def _back_off(
+        self, service_type: str, model: str, error: Exception, attempt: int
+    ) -> bool:
+        """
+        Pause the lane after a 429 so the call can be retried.
+
+        Returns:
+            Whether the call should be retried
+        """
+        if not is_rate_limited(error) or attempt >= self.max_retries:
+            return False
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        if delay > self.max_wait:
+            return False
+        delay *= 1 + random.random() * BACKOFF_JITTER
+        logging.warning(
+            f"Rate limited by {service_type} for model {model}, "
+            f"retrying in {delay:.2f}s (attempt {attempt + 1} of {self.max_retries})"
+        )
+        with self._lock:
+            lane = self._lanes[(service_type, model)]
+            lane.blocked_until = max(lane.blocked_until, time.monotonic() + delay)
+            self.retries += 1
+        metrics.UPSTREAM_RETRIES.inc(service_type=service_type, model=model)
+        return True
+
+    def _update_depth(self, key: LaneKey, lane: _Lane) -> None:
+        metrics.SCHEDULER_QUEUE_DEPTH.set(
+            len(lane.waiters), service_type=key[0], model=key[1]
+        )
+
+    @staticmethod
+    def _record_wait(service_type: str, priority: int, started: float) -> float:
+        waited = time.monotonic() - started
+        metrics.SCHEDULER_WAIT.observe(
+            waited,
+            service_type=service_type,
+            priority=PRIORITY_NAMES.get(priority, str(priority)),
+        )
+        return waited
+
+
+class AsyncRequestScheduler(RequestScheduler):
+    """RequestScheduler for coroutines on one event loop; waiting callers do not block it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Replaced every time a caller is admitted or leaves, waking those waiting on it
+        self._changed = asyncio.Event()
+
+    async def acall(
+        self,
+        service_type: str,
+        model: str,
+        fn: Callable[[], Awaitable[Any]],
+        tokens: int = 1,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Any:
+        """Async variant of call; fn returns the awaitable making the upstream call."""
+        for attempt in itertools.count():
+            await self.aacquire(service_type, model, tokens, priority)
+            try:
+                return await fn()
+            except Exception as e:
+                if not self._back_off(service_type, model, e, attempt):
+                    raise
+
+    async def aacquire(
+        self,
+        service_type: str,
+        model: str,
+        tokens: int = 1,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> float:
+        """Async variant of acquire."""
+        key = (service_type, model)
+        started = time.monotonic()
+        with self._lock:
+            ticket = self._enqueue(key, priority)
+        try:
+            while True:
+                with self._lock:
+                    delay = self._poll(key, ticket, tokens)
+                    if delay == 0:
+                        break
+                    remaining = self._remaining(key, ticket, started)
+                    changed = self._changed
+                try:
+                    await asyncio.wait_for(
+                        changed.wait(),
+                        remaining if delay is None else min(remaining, delay),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._lock:
+                self._leave(key, ticket)
+            raise
+        finally:
+            self._changed.set()
+            self._changed = asyncio.Event()
+        return self._record_wait(service_type, priority, started)
@@ -0,0 +1,196 @@
+"""
+Cache of generation results for deterministic requests.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+from models.token_sequence import TokenSequence
+import config
+
+CachedResult = Tuple[str, TokenSequence]
+
+
+class ResponseCache:
+    """
+    Two-tier cache of (generated_text, tokens) results.
+
+    The memory tier is a bounded LRU. The optional disk tier is a SQLite file
+    that survives restarts. Entries in both tiers expire after the TTL, and the
+    disk tier keeps only its newest entries. Disk hits are promoted to memory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = config.RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = config.RESPONSE_CACHE_TTL,
+        disk_path: Optional[str] = config.RESPONSE_CACHE_PATH,
+        max_disk_entries: int = config.RESPONSE_CACHE_MAX_DISK_ENTRIES,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of results held in memory.
+            ttl: Seconds a result stays valid. 0 disables expiry.
+            disk_path: Path of the SQLite file for the disk tier, or None/"" to
+                       keep the cache in memory only.
+            max_disk_entries: Maximum number of results kept on disk.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Tuple[float, CachedResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, created REAL NOT NULL, payload BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(
+        service_type: str,
+        model: str,
+        prompt: str,
+        temperature: float,
+        top_p: float,
+        max_tokens: int,
+        logprobs: Optional[int],
+    ) -> str:
+        """Build a cache key from the parameters that determine a generation."""
+        raw = json.dumps(
+            [service_type, model, prompt, temperature, top_p, max_tokens, logprobs]
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """
+        Look up a cached result.
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            Tuple of (generated_text, tokens), or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._memory[key]
+
+            result = self._disk_get(key, now)
+            if result is not None:
+                self._memory_put(key, result, now)
+                self.hits += 1
+                self.disk_hits += 1
+                return result
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, text: str, tokens: TokenSequence) -> None:
+        """Store a result in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, (text, tokens), now)
+            self._disk_put(key, text, tokens, now)
+
+    def clear(self) -> None:
+        """Drop every cached result and reset the counters."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+            self.hits = self.misses = self.disk_hits = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current tier sizes."""
+        with self._lock:
+            disk_entries = None
+            if self._db is not None:
+                disk_entries = self._db.execute(
+                    "SELECT COUNT(*) FROM responses"
+                ).fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl > 0 and now - created > self.ttl
+
+    def _memory_put(self, key: str, result: CachedResult, now: float) -> None:
+        """Insert into the LRU tier. Caller holds the lock."""
+        self._memory[key] = (now, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[CachedResult]:
+        """Read from the SQLite tier. Caller holds the lock."""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT created, payload FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[0], now):
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            payload = json.loads(zlib.decompress(row[1]))
+            return payload["text"], TokenSequence.from_list(payload["tokens"])
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache disk read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, text: str, tokens: TokenSequence, now: float) -> None:
+        """Write to the SQLite tier and apply TTL/size eviction. Caller holds the lock."""
+        if self._db is None:
+            return
+        payload = zlib.compress(
+            json.dumps({"text": text, "tokens": tokens.to_list()}).encode("utf-8")
+        )
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, created, payload) VALUES (?, ?, ?)",
+                (key, now, payload),
+            )
+            if self.ttl > 0:
+                self._db.execute(
+                    "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+                )
+            self._db.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                (self.max_disk_entries,),
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache disk write failed: {e}")
@@ -0,0 +1,142 @@
+"""
+Coalescing of identical concurrent calls into a single execution.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+import threading
+import time
+
+import config
+
+
+class _Flight:
+    """State of one coalesced call."""
+
+    __slots__ = ("event", "future", "result", "error", "finished_at")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.future: Optional[asyncio.Future] = None
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers share its result.
+
+    The first caller for a key (the leader) runs the function while later callers
+    with the same key wait for it and receive the same result or exception. A
+    successful result stays joinable for `window` seconds after it completes, so
+    requests arriving just after the leader finished are served too. Failures
+    are never shared beyond the callers already waiting.
+    """
+
+    def __init__(self, window: float = config.COALESCE_WINDOW):
+        """
+        Initialize the coalescer.
+
+        Args:
+            window: Seconds a completed result can still be joined. 0 shares
+                    results only between callers that overlap with the leader.
+        """
+        self.window = window
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn for key, or wait for the call already running for it.
+
+        Args:
+            key: Identity of the call; callers with equal keys are coalesced
+            fn: Function to run if no call for key is in flight
+
+        Returns:
+            Tuple of (result, whether it was shared from another caller's call)
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._finish(key, flight)
+            flight.event.set()
+        return flight.result, False
+
+    def stats(self) -> Dict[str, int]:
+        """Return how many calls ran and how many callers shared a result."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": sum(
+                    1 for f in self._flights.values() if f.finished_at is None
+                ),
+            }
+
+    def _join(self, key: Hashable) -> Tuple[_Flight, bool]:
+        """Return the flight for key and whether the caller must lead it."""
+        now = time.monotonic()
+        with self._lock:
+            for stale in [
+                k
+                for k, f in self._flights.items()
+                if f.finished_at is not None and now - f.finished_at > self.window
+            ]:
+                del self._flights[stale]
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+                return flight, True
+            self.coalesced += 1
+            return flight, False
+
+    def _finish(self, key: Hashable, flight: _Flight) -> None:
+        """Mark a flight done, dropping it right away if it failed or has no window."""
+        with self._lock:
+            flight.finished_at = time.monotonic()
+            if (flight.error is not None or self.window <= 0) and self._flights.get(
+                key
+            ) is flight:
+                del self._flights[key]
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines on one event loop; waiting callers do not block it."""
+
+    async def ado(
+        self, key: Hashable, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Async variant of do; fn returns the awaitable to run."""
+        flight, leader = self._join(key)
+        if not leader:
+            if flight.finished_at is None:
+                await asyncio.shield(flight.future)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        flight.future = asyncio.get_running_loop().create_future()
+        try:
+            flight.result = await fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._finish(key, flight)
+            flight.future.set_result(None)
+        return flight.result, False
@@ -3,7 +3,34 @@ Token probability processing utilities.
 """
 
 import json
+from array import array
+from collections import Counter
 from html import escape
+from typing import NamedTuple
+
+import numpy as np
+
+from models.token_sequence import TokenSequence
+import config
+
+
+def _optional(value: float | None) -> float | None:
+    """Map a NaN placeholder back to None, leaving other values untouched."""
+    return None if value is None or value != value else value
+
+
+class _PackedCandidates(NamedTuple):
+    """Dense candidate matrix plus the per-token data needed to build output."""
+
+    probs: np.ndarray  # (n_tokens x k), chosen token in column 0, NaN if missing
+    alt_index: np.ndarray  # Index into the alt_* sequences, -1 for column 0/padding
+    token_strings: list[str]
+    texts: list[str]
+    probabilities: list[float | None]
+    logprobs: list[float | None]
+    alt_texts: list[str]
+    alt_probabilities: list[float | None]
+    alt_logprobs: list[float | None]
 
 
 class TokenProcessor:
@@ -37,200 +64,629 @@ class TokenProcessor:
 
     @staticmethod
     def process_tokens(
-        tokens: list[dict[str, any]], top_p: float
+        tokens: TokenSequence | list[dict[str, any]], top_p: float
     ) -> list[dict[str, any]]:
         """
         Process tokens for visualization and calculate selection chance based on top_p.
 
         Args:
-            tokens: list of token information dictionaries from OpenAI API
+            tokens: TokenSequence from OpenAIClient, or list of token information
+                    dictionaries in the JSON format
             top_p: The top_p value used for generation
 
         Returns:
             Processed tokens with visualization data and selection chance
         """
-        processed_tokens_list = []
+        if len(tokens) >= config.VECTORIZED_MIN_TOKENS:
+            return TokenProcessor.process_tokens_batch(tokens, top_p)
+        return [
+            TokenProcessor.process_token(raw_token_info, top_p)
+            for raw_token_info in tokens
+        ]
 
-        for i, raw_token_info in enumerate(tokens):
-            chosen_prob = raw_token_info.get("probability")
-            chosen_text = raw_token_info.get("text", "")
+    @staticmethod
+    def process_tokens_batch(
+        tokens: TokenSequence | list[dict[str, any]], top_p: float
+    ) -> list[dict[str, any]]:
+        """
+        Vectorized equivalent of process_tokens for long token sequences.
 
-            # --- Nucleus Sampling Calculation ---
-            candidate_tokens = []
-            # Add the actually chosen token first (important for reference)
-            if chosen_prob is not None:
-                candidate_tokens.append(
-                    {
-                        "text": chosen_text,
-                        "probability": chosen_prob,
-                    }
-                )
+        All candidates (chosen token in column 0, alternatives after it) are packed
+        into a dense (n_tokens x k) probability matrix, and sorting, nucleus
+        selection and renormalization run as whole-array operations. Per-token
+        dictionaries are only built for the final output, which is identical to
+        what process_token produces.
 
-            # Add alternatives from top_logprobs
-            raw_alternatives = raw_token_info.get("top_logprobs", {})
-            if raw_alternatives:
-                for alt_text, alt_info in raw_alternatives.items():
-                    # Skip adding if it's the same as the chosen token
-                    if alt_text == chosen_text:
-                        continue
-                    alt_prob = alt_info.get("probability")
-                    if alt_prob is not None:
-                        candidate_tokens.append(
-                            {
-                                "text": alt_text,
-                                "probability": alt_prob,
-                            }
-                        )
-
-            # Sort candidates by probability (descending)
-            candidate_tokens.sort(key=lambda x: x.get("probability", 0), reverse=True)
-
-            nucleus_tokens = []
-            cumulative_prob = 0.0
-            nucleus_prob_sum = 0.0
-
-            if (
-                top_p < 1.0
-            ):  # Only apply nucleus logic if top_p is not 1 (where all are included)
-                for cand in candidate_tokens:
-                    nucleus_tokens.append(cand)  # Add to nucleus first
-                    nucleus_prob_sum += cand["probability"]
-                    cumulative_prob += cand["probability"]
-                    if cumulative_prob >= top_p:
-                        break  # Stop adding once threshold is met or exceeded
-            else:  # top_p is 1.0, include all candidates
-                nucleus_tokens = candidate_tokens
-                nucleus_prob_sum = sum(c.get("probability", 0) for c in nucleus_tokens)
-
-            # Calculate selection chance for each candidate
-            candidate_chances = {}
-            for cand in candidate_tokens:
-                cand_text = cand["text"]
-                is_in_nucleus = any(n["text"] == cand_text for n in nucleus_tokens)
+        Args:
+            tokens: TokenSequence or list of token information dictionaries
+            top_p: The top_p value used for generation
+
+        Returns:
+            Processed tokens with visualization data and selection chance
+        """
+        if len(tokens) == 0:
+            return []
+
+        if isinstance(tokens, TokenSequence):
+            packed = TokenProcessor._pack_sequence(tokens)
+        else:
+            packed = TokenProcessor._pack_dicts(tokens)
+        order, chances = TokenProcessor._nucleus_chances(packed.probs, top_p)
 
-                if is_in_nucleus and nucleus_prob_sum > 0:
-                    chance = cand["probability"] / nucleus_prob_sum
-                    candidate_chances[cand_text] = chance
-                else:
-                    candidate_chances[cand_text] = 0.0
-            # --- End Nucleus Sampling Calculation ---
+        # Selection chance of the chosen token, scattered back to column 0
+        chosen_chances = np.zeros_like(chances)
+        np.put_along_axis(chosen_chances, order, chances, axis=1)
+        chosen_chances = chosen_chances[:, 0].tolist()
+        sorted_alt_index = np.take_along_axis(packed.alt_index, order, axis=1).tolist()
+        chance_rows = chances.tolist()
 
-            # --- Process Main Token ---
+        processed_tokens_list = []
+        for i, chosen_prob in enumerate(packed.probabilities):
             processed_token = {
-                "token": raw_token_info.get("token", ""),
-                "text": chosen_text,
+                "token": packed.token_strings[i],
+                "text": packed.texts[i],
                 "probability": chosen_prob,
-                "logprob": raw_token_info.get("logprob"),
+                "logprob": packed.logprobs[i],
                 "color": TokenProcessor.calculate_color(chosen_prob),
-                "selection_chance": candidate_chances.get(
-                    chosen_text, 0.0
-                ),  # Get calculated chance
+                "selection_chance": chosen_chances[i],
                 "top_alternatives": [],
             }
-
-            # --- Process Alternatives ---
-            # Use the sorted candidates list, map chances back
-            if raw_alternatives:
-                # Create a dictionary of alternatives from raw_alternatives for easier lookup
-                alt_dict = {
-                    alt_text: info for alt_text, info in raw_alternatives.items()
-                }
-
-                # Iterate through sorted candidates *excluding* the chosen one to build alternatives list
-                for cand in candidate_tokens:
-                    cand_text = cand["text"]
-                    if cand_text == chosen_text:  # Skip the chosen token itself
-                        continue
-
-                    # Check if the candidate is in the nucleus (chance > 0) before adding
-                    cand_chance = candidate_chances.get(cand_text, 0.0)
-                    if cand_chance > 0.0 and cand_text in alt_dict:
-                        alt_info = alt_dict[cand_text]
-                        alt_prob = alt_info.get("probability")
-                        processed_token["top_alternatives"].append(
-                            {
-                                "text": cand_text,
-                                "probability": alt_prob,
-                                "logprob": alt_info.get("logprob"),
-                                "color": TokenProcessor.calculate_color(alt_prob),
-                                "selection_chance": cand_chance,  # Use pre-calculated chance
-                            }
-                        )
-
+            # Alternatives in descending probability order, nucleus members only
+            for alt_idx, cand_chance in zip(sorted_alt_index[i], chance_rows[i]):
+                if alt_idx < 0 or cand_chance <= 0.0:
+                    continue
+                alt_prob = _optional(packed.alt_probabilities[alt_idx])
+                processed_token["top_alternatives"].append(
+                    {
+                        "text": packed.alt_texts[alt_idx],
+                        "probability": alt_prob,
+                        "logprob": _optional(packed.alt_logprobs[alt_idx]),
+                        "color": TokenProcessor.calculate_color(alt_prob),
+                        "selection_chance": cand_chance,
+                    }
+                )
             processed_tokens_list.append(processed_token)
 
         return processed_tokens_list
 
     @staticmethod
-    def tokens_to_html(processed_tokens: list[dict[str, any]]) -> str:
+    def process_samples(
+        samples: list[TokenSequence], top_p: float
+    ) -> list[list[dict[str, any]]]:
         """
-        Convert processed tokens to HTML for visualization.
+        Process the tokens of several samples in one pass.
+
+        The samples are concatenated so that long enough inputs go through the
+        vectorized path once, instead of once per sample.
 
         Args:
-            processed_tokens: list of processed token dictionaries
+            samples: Token sequences, one per sample
+            top_p: The top_p value used for generation
 
         Returns:
-            HTML string with token visualization
+            Processed tokens per sample, as returned by process_tokens
         """
-        html_parts = ['<div class="token-container">']
+        combined = TokenSequence()
+        for tokens in samples:
+            combined.extend(tokens)
+        processed_tokens = TokenProcessor.process_tokens(combined, top_p)
+
+        per_sample = []
+        start = 0
+        for tokens in samples:
+            per_sample.append(processed_tokens[start : start + len(tokens)])
+            start += len(tokens)
+        return per_sample
 
-        for token in processed_tokens:
-            prob_text = (
-                f"{token['probability']:.4f}"
-                if token["probability"] is not None
-                else "N/A"
-            )
-            logprob_text = (
-                f"{token['logprob']:.4f}" if token["logprob"] is not None else "N/A"
+    @staticmethod
+    def sample_statistics(samples: list[TokenSequence]) -> dict[str, list]:
+        """
+        Aggregate several samples of the same prompt position by position.
+
+        Positions are token indices, so once samples diverge a position compares
+        whatever each sample generated at that index. Samples shorter than a
+        position do not count towards it.
+
+        Args:
+            samples: Token sequences, one per sample
+
+        Returns:
+            Dictionary of parallel lists, one entry per position:
+                count: samples reaching the position
+                token: most frequent token text
+                agreement: share of those samples that chose that token
+                mean_probability, min_probability: of the chosen tokens
+                entropy: mean entropy in bits of the returned candidates
+            Probability values are None where no sample had logprobs
+        """
+        n_positions = max((len(tokens) for tokens in samples), default=0)
+        probs = np.full((len(samples), n_positions), np.nan)
+        entropies = np.full((len(samples), n_positions), np.nan)
+        for row, tokens in enumerate(samples):
+            probs[row, : len(tokens)] = np.frombuffer(
+                tokens.probabilities, dtype=np.float64
             )
-            prob_class = token.get("color", "unknown-prob")
-            chance_text = (
-                f"{token.get('selection_chance', 0.0) * 100:.2f}%"  # Format chance
+            entropies[row, : len(tokens)] = TokenProcessor._candidate_entropy(tokens)
+
+        def nan_mean(values: np.ndarray) -> list[float | None]:
+            valid = ~np.isnan(values)
+            counts = valid.sum(axis=0)
+            means = np.divide(
+                np.where(valid, values, 0.0).sum(axis=0),
+                counts,
+                out=np.full(n_positions, np.nan),
+                where=counts > 0,
             )
+            return [_optional(v) for v in means.tolist()]
+
+        counts, modes, agreement = [], [], []
+        for position in range(n_positions):
+            texts = [t.texts[position] for t in samples if position < len(t)]
+            mode, mode_count = Counter(texts).most_common(1)[0]
+            counts.append(len(texts))
+            modes.append(mode)
+            agreement.append(mode_count / len(texts))
+
+        return {
+            "count": counts,
+            "token": modes,
+            "agreement": agreement,
+            "mean_probability": nan_mean(probs),
+            "min_probability": [
+                _optional(v)
+                for v in (
+                    np.fmin.reduce(probs, axis=0).tolist() if len(samples) else []
+                )
+            ],
+            "entropy": nan_mean(entropies),
+        }
 
-            # --- Create tooltip data dictionary ---
-            tooltip_data = {
-                "text": token.get("text", ""),
-                "probability": prob_text,
-                "logprob": logprob_text,
-                "selection_chance": chance_text,  # Add formatted chance
-                "alternatives": [],
-            }
+    @staticmethod
+    def _candidate_entropy(tokens: TokenSequence) -> np.ndarray:
+        """
+        Entropy in bits of each token's returned candidates.
 
-            if token.get("top_alternatives"):
-                for alt in token["top_alternatives"]:
-                    alt_prob = (
-                        f"{alt.get('probability'):.4f}"
-                        if alt.get("probability") is not None
-                        else "N/A"
-                    )
-                    alt_logprob = (
-                        f"{alt.get('logprob'):.4f}"
-                        if alt.get("logprob") is not None
-                        else "N/A"
+        The chosen token and its distinct alternatives are the candidates; their
+        probabilities are used as returned, without renormalization, so this is
+        the part of the entropy carried by the top candidates. NaN for tokens
+        without logprobs.
+        """
+        n_tokens = len(tokens)
+        if n_tokens == 0:
+            return np.empty(0)
+        offsets = np.frombuffer(tokens.alt_offsets, dtype=np.int64)
+        rows = np.repeat(np.arange(n_tokens), np.diff(offsets))
+        distinct = (
+            np.array(tokens.alt_texts, dtype=object)
+            != np.array(tokens.texts, dtype=object)[rows]
+        )
+        alt_terms = -(
+            np.frombuffer(tokens.alt_probabilities, dtype=np.float64)[distinct]
+            * np.frombuffer(tokens.alt_logprobs, dtype=np.float64)[distinct]
+        )
+        chosen_terms = -(
+            np.frombuffer(tokens.probabilities, dtype=np.float64)
+            * np.frombuffer(tokens.logprobs, dtype=np.float64)
+        )
+        return chosen_terms + np.bincount(
+            rows[distinct], weights=np.nan_to_num(alt_terms), minlength=n_tokens
+        )
+
+    @staticmethod
+    def _pack_dicts(tokens: list[dict[str, any]]) -> _PackedCandidates:
+        """Pack token dictionaries into a candidate matrix, one token per row."""
+        width = 1 + max(len(t.get("top_logprobs") or {}) for t in tokens)
+        probs = np.full((len(tokens), width), np.nan)
+        alt_index = np.full((len(tokens), width), -1, dtype=np.int64)
+        alt_texts, alt_probabilities, alt_logprobs = [], [], []
+        for i, raw_token_info in enumerate(tokens):
+            chosen_text = raw_token_info.get("text", "")
+            chosen_prob = raw_token_info.get("probability")
+            if chosen_prob is not None:
+                probs[i, 0] = chosen_prob
+            col = 1
+            for alt_text, alt_info in (
+                raw_token_info.get("top_logprobs") or {}
+            ).items():
+                # Skip the alternative that is the chosen token itself
+                if alt_text == chosen_text:
+                    continue
+                alt_prob = alt_info.get("probability")
+                if alt_prob is not None:
+                    probs[i, col] = alt_prob
+                alt_index[i, col] = len(alt_texts)
+                alt_texts.append(alt_text)
+                alt_probabilities.append(alt_prob)
+                alt_logprobs.append(alt_info.get("logprob"))
+                col += 1
+
+        return _PackedCandidates(
+            probs=probs,
+            alt_index=alt_index,
+            token_strings=[t.get("token", "") for t in tokens],
+            texts=[t.get("text", "") for t in tokens],
+            probabilities=[t.get("probability") for t in tokens],
+            logprobs=[t.get("logprob") for t in tokens],
+            alt_texts=alt_texts,
+            alt_probabilities=alt_probabilities,
+            alt_logprobs=alt_logprobs,
+        )
+
+    @staticmethod
+    def _pack_sequence(tokens: TokenSequence) -> _PackedCandidates:
+        """Pack a TokenSequence into a candidate matrix straight from its arrays."""
+        n_tokens = len(tokens)
+        offsets = np.frombuffer(tokens.alt_offsets, dtype=np.int64)
+        rows = np.repeat(np.arange(n_tokens), np.diff(offsets))
+
+        # Drop alternatives that repeat the chosen token, then give each remaining
+        # alternative its column (1-based position within its row)
+        chosen_texts = np.array(tokens.texts, dtype=object)
+        kept = np.flatnonzero(
+            np.array(tokens.alt_texts, dtype=object) != chosen_texts[rows]
+        )
+        kept_rows = rows[kept]
+        kept_counts = np.bincount(kept_rows, minlength=n_tokens)
+        row_starts = np.cumsum(kept_counts) - kept_counts
+        cols = 1 + np.arange(len(kept)) - row_starts[kept_rows]
+
+        width = 1 + int(kept_counts.max())
+        probs = np.full((n_tokens, width), np.nan)
+        probs[:, 0] = np.frombuffer(tokens.probabilities, dtype=np.float64)
+        probs[kept_rows, cols] = np.frombuffer(
+            tokens.alt_probabilities, dtype=np.float64
+        )[kept]
+        alt_index = np.full((n_tokens, width), -1, dtype=np.int64)
+        alt_index[kept_rows, cols] = kept
+
+        probabilities = [_optional(p) for p in tokens.probabilities]
+        return _PackedCandidates(
+            probs=probs,
+            alt_index=alt_index,
+            token_strings=tokens.texts,
+            texts=tokens.texts,
+            probabilities=probabilities,
+            logprobs=[_optional(lp) for lp in tokens.logprobs],
+            alt_texts=tokens.alt_texts,
+            alt_probabilities=tokens.alt_probabilities,
+            alt_logprobs=tokens.alt_logprobs,
+        )
+
+    @staticmethod
+    def _nucleus_chances(probs: np.ndarray, top_p: float) -> tuple[np.ndarray, ...]:
+        """
+        Compute nucleus selection chances for a candidate matrix.
+
+        Args:
+            probs: (n_tokens x k) candidate probabilities, NaN for missing entries
+            top_p: The top_p value used for generation
+
+        Returns:
+            Tuple of (order, chances): the descending sort order of each row and
+            the selection chance of each candidate in that sorted order
+        """
+        valid = ~np.isnan(probs)
+        # Stable descending sort keeps ties in insertion order, like list.sort
+        order = np.argsort(-np.where(valid, probs, -np.inf), axis=1, kind="stable")
+        sorted_probs = np.take_along_axis(np.where(valid, probs, 0.0), order, axis=1)
+        sorted_valid = np.take_along_axis(valid, order, axis=1)
+        # Sequential running sums, matching the scalar accumulation exactly
+        cumulative = np.cumsum(sorted_probs, axis=1)
+
+        if top_p < 1.0:
+            # A candidate joins the nucleus while the sum before it is below top_p
+            previous = np.empty_like(cumulative)
+            previous[:, 0] = -np.inf
+            previous[:, 1:] = cumulative[:, :-1]
+            in_nucleus = sorted_valid & (previous < top_p)
+        else:
+            in_nucleus = sorted_valid
+
+        nucleus_size = in_nucleus.sum(axis=1)
+        nucleus_prob_sum = np.where(
+            nucleus_size > 0,
+            cumulative[np.arange(len(probs)), np.maximum(nucleus_size - 1, 0)],
+            0.0,
+        )
+        chances = np.divide(
+            sorted_probs,
+            nucleus_prob_sum[:, None],
+            out=np.zeros_like(sorted_probs),
+            where=in_nucleus & (nucleus_prob_sum[:, None] > 0),
+        )
+        return order, chances
+
+    @staticmethod
+    def process_token(raw_token_info: dict[str, any], top_p: float) -> dict[str, any]:
+        """
+        Process a single token and calculate its selection chance based on top_p.
+
+        Args:
+            raw_token_info: Token information dictionary from OpenAI API
+            top_p: The top_p value used for generation
+
+        Returns:
+            Processed token with visualization data and selection chance
+        """
+        chosen_prob = raw_token_info.get("probability")
+        chosen_text = raw_token_info.get("text", "")
+
+        # --- Nucleus Sampling Calculation ---
+        candidate_tokens = []
+        # Add the actually chosen token first (important for reference)
+        if chosen_prob is not None:
+            candidate_tokens.append(
+                {
+                    "text": chosen_text,
+                    "probability": chosen_prob,
+                }
+            )
+
+        # Add alternatives from top_logprobs
+        raw_alternatives = raw_token_info.get("top_logprobs", {})
+        if raw_alternatives:
+            for alt_text, alt_info in raw_alternatives.items():
+                # Skip adding if it's the same as the chosen token
+                if alt_text == chosen_text:
+                    continue
+                alt_prob = alt_info.get("probability")
+                if alt_prob is not None:
+                    candidate_tokens.append(
+                        {
+                            "text": alt_text,
+                            "probability": alt_prob,
+                        }
                     )
-                    alt_color_class = alt.get("color", "unknown-prob")
-                    alt_chance_text = f"{alt.get('selection_chance', 0.0) * 100:.2f}%"  # Format chance
 
-                    tooltip_data["alternatives"].append(
+        # Sort candidates by probability (descending)
+        candidate_tokens.sort(key=lambda x: x.get("probability", 0), reverse=True)
+
+        nucleus_tokens = []
+        cumulative_prob = 0.0
+        nucleus_prob_sum = 0.0
+
+        if (
+            top_p < 1.0
+        ):  # Only apply nucleus logic if top_p is not 1 (where all are included)
+            for cand in candidate_tokens:
+                nucleus_tokens.append(cand)  # Add to nucleus first
+                nucleus_prob_sum += cand["probability"]
+                cumulative_prob += cand["probability"]
+                if cumulative_prob >= top_p:
+                    break  # Stop adding once threshold is met or exceeded
+        else:  # top_p is 1.0, include all candidates
+            nucleus_tokens = candidate_tokens
+            nucleus_prob_sum = sum(c.get("probability", 0) for c in nucleus_tokens)
+
+        # Calculate selection chance for each candidate
+        candidate_chances = {}
+        nucleus_texts = {n["text"] for n in nucleus_tokens}
+        for cand in candidate_tokens:
+            cand_text = cand["text"]
+            is_in_nucleus = cand_text in nucleus_texts
+
+            if is_in_nucleus and nucleus_prob_sum > 0:
+                chance = cand["probability"] / nucleus_prob_sum
+                candidate_chances[cand_text] = chance
+            else:
+                candidate_chances[cand_text] = 0.0
+        # --- End Nucleus Sampling Calculation ---
+
+        # --- Process Main Token ---
+        processed_token = {
+            "token": raw_token_info.get("token", ""),
+            "text": chosen_text,
+            "probability": chosen_prob,
+            "logprob": raw_token_info.get("logprob"),
+            "color": TokenProcessor.calculate_color(chosen_prob),
+            "selection_chance": candidate_chances.get(
+                chosen_text, 0.0
+            ),  # Get calculated chance
+            "top_alternatives": [],
+        }
+
+        # --- Process Alternatives ---
+        # Use the sorted candidates list, map chances back
+        if raw_alternatives:
+            # Create a dictionary of alternatives from raw_alternatives for easier lookup
+            alt_dict = {alt_text: info for alt_text, info in raw_alternatives.items()}
+
+            # Iterate through sorted candidates *excluding* the chosen one to build alternatives list
+            for cand in candidate_tokens:
+                cand_text = cand["text"]
+                if cand_text == chosen_text:  # Skip the chosen token itself
+                    continue
+
+                # Check if the candidate is in the nucleus (chance > 0) before adding
+                cand_chance = candidate_chances.get(cand_text, 0.0)
+                if cand_chance > 0.0 and cand_text in alt_dict:
+                    alt_info = alt_dict[cand_text]
+                    alt_prob = alt_info.get("probability")
+                    processed_token["top_alternatives"].append(
                         {
-                            "text": alt.get("text", ""),
+                            "text": cand_text,
                             "probability": alt_prob,
-                            "logprob": alt_logprob,
-                            "color_class": alt_color_class,
-                            "selection_chance": alt_chance_text,  # Add formatted chance
+                            "logprob": alt_info.get("logprob"),
+                            "color": TokenProcessor.calculate_color(alt_prob),
+                            "selection_chance": cand_chance,  # Use pre-calculated chance
                         }
                     )
-            # --- End tooltip data creation ---
 
-            tooltip_json = json.dumps(tooltip_data)
-            escaped_tooltip_json = escape(tooltip_json, quote=True)
-            escaped_token_text = escape(token.get("text", ""))
+        return processed_token
 
-            html_parts.append(
-                f"<span class='token {prob_class}' data-tooltip='{escaped_tooltip_json}'>"
-                f"{escaped_token_text}</span>"
-            )
+    @staticmethod
+    def rescale_temperature(tokens: TokenSequence, temperature: float) -> TokenSequence:
+        """
+        Re-derive token probabilities as if sampled at a different temperature.
+
+        Each token's candidates (the chosen token and its returned alternatives)
+        are rescaled to p ** (1 / temperature) and renormalized over those
+        candidates. Logprobs stay in the same base as the probabilities
+        (probability == 2 ** logprob). Tokens without logprobs are unchanged.
+
+        Args:
+            tokens: TokenSequence holding the original logprobs
+            temperature: Temperature of the view; 1.0 returns the tokens as-is
+
+        Returns:
+            New TokenSequence with rescaled logprobs and probabilities
+        """
+        if temperature == 1.0 or len(tokens) == 0:
+            return tokens
+        temperature = max(temperature, config.MIN_VIEW_TEMPERATURE)
+
+        n_tokens = len(tokens)
+        offsets = np.frombuffer(tokens.alt_offsets, dtype=np.int64)
+        rows = np.repeat(np.arange(n_tokens), np.diff(offsets))
+        chosen = np.frombuffer(tokens.logprobs, dtype=np.float64) / temperature
+        alts = np.frombuffer(tokens.alt_logprobs, dtype=np.float64) / temperature
+
+        # The alternative repeating the chosen token is not a separate candidate
+        distinct = (
+            np.array(tokens.alt_texts, dtype=object)
+            != np.array(tokens.texts, dtype=object)[rows]
+        )
+        distinct_rows = rows[distinct]
+
+        # log2-sum-exp2 per token, shifted by the row maximum for stability
+        row_max = chosen.copy()
+        np.fmax.at(row_max, distinct_rows, alts[distinct])
+        weights = np.nan_to_num(np.exp2(chosen - row_max)) + np.bincount(
+            distinct_rows,
+            weights=np.nan_to_num(np.exp2(alts[distinct] - row_max[distinct_rows])),
+            minlength=n_tokens,
+        )
+        log_norm = row_max + np.log2(weights)
+        chosen_logprobs = chosen - log_norm
+        alt_logprobs = alts - log_norm[rows]
+
+        rescaled = TokenSequence()
+        rescaled.texts = list(tokens.texts)
+        rescaled.logprobs = array("d", chosen_logprobs.tobytes())
+        rescaled.probabilities = array("d", np.exp2(chosen_logprobs).tobytes())
+        rescaled.alt_offsets = array("q", tokens.alt_offsets)
+        rescaled.alt_texts = list(tokens.alt_texts)
+        rescaled.alt_logprobs = array("d", alt_logprobs.tobytes())
+        rescaled.alt_probabilities = array("d", np.exp2(alt_logprobs).tobytes())
+        return rescaled
+
+    @staticmethod
+    def to_compact(processed_tokens: list[dict[str, any]]) -> dict[str, list]:
+        """
+        Convert processed tokens to a compact columnar payload for client rendering.
 
+        Only raw numbers are sent; colors and display formatting are derived in
+        the browser (see static/js/visualizer.js).
+
+        Args:
+            processed_tokens: list of processed token dictionaries
+
+        Returns:
+            Dictionary of parallel lists: text, probability, logprob,
+            selection_chance and alternatives, where each token's alternatives
+            are [text, probability, logprob, selection_chance] rows
+        """
+        return {
+            "text": [t["text"] for t in processed_tokens],
+            "probability": [t["probability"] for t in processed_tokens],
+            "logprob": [t["logprob"] for t in processed_tokens],
+            "selection_chance": [t["selection_chance"] for t in processed_tokens],
+            "alternatives": [
+                [
+                    [
+                        alt["text"],
+                        alt["probability"],
+                        alt["logprob"],
+                        alt["selection_chance"],
+                    ]
+                    for alt in t["top_alternatives"]
+                ]
+                for t in processed_tokens
+            ],
+        }
+
+    @staticmethod
+    def tokens_to_html(processed_tokens: list[dict[str, any]]) -> str:
+        """
+        Convert processed tokens to HTML for visualization.
+
+        Args:
+            processed_tokens: list of processed token dictionaries
+
+        Returns:
+            HTML string with token visualization
+        """
+        html_parts = ['<div class="token-container">']
+        html_parts.extend(
+            TokenProcessor.token_to_html(token) for token in processed_tokens
+        )
         html_parts.append("</div>")
         return "".join(html_parts)
+
+    @staticmethod
+    def token_to_html(token: dict[str, any]) -> str:
+        """
+        Convert a single processed token to its HTML span with tooltip data.
+
+        Args:
+            token: Processed token dictionary
+
+        Returns:
+            HTML string for the token span
+        """
+        prob_text = (
+            f"{token['probability']:.4f}" if token["probability"] is not None else "N/A"
+        )
+        logprob_text = (
+            f"{token['logprob']:.4f}" if token["logprob"] is not None else "N/A"
+        )
+        prob_class = token.get("color", "unknown-prob")
+        chance_text = (
+            f"{token.get('selection_chance', 0.0) * 100:.2f}%"  # Format chance
+        )
+
+        # --- Create tooltip data dictionary ---
+        tooltip_data = {
+            "text": token.get("text", ""),
+            "probability": prob_text,
+            "logprob": logprob_text,
+            "selection_chance": chance_text,  # Add formatted chance
+            "alternatives": [],
+        }
+
+        if token.get("top_alternatives"):
+            for alt in token["top_alternatives"]:
+                alt_prob = (
+                    f"{alt.get('probability'):.4f}"
+                    if alt.get("probability") is not None
+                    else "N/A"
+                )
+                alt_logprob = (
+                    f"{alt.get('logprob'):.4f}"
+                    if alt.get("logprob") is not None
+                    else "N/A"
+                )
+                alt_color_class = alt.get("color", "unknown-prob")
+                alt_chance_text = (
+                    f"{alt.get('selection_chance', 0.0) * 100:.2f}%"  # Format chance
+                )
+
+                tooltip_data["alternatives"].append(
+                    {
+                        "text": alt.get("text", ""),
+                        "probability": alt_prob,
+                        "logprob": alt_logprob,
+                        "color_class": alt_color_class,
+                        "selection_chance": alt_chance_text,  # Add formatted chance
+                    }
+                )
+        # --- End tooltip data creation ---
+
+        tooltip_json = json.dumps(tooltip_data)
+        escaped_tooltip_json = escape(tooltip_json, quote=True)
+        escaped_token_text = escape(token.get("text", ""))
+
+        return (
+            f"<span class='token {prob_class}' data-tooltip='{escaped_tooltip_json}'>"
+            f"{escaped_token_text}</span>"
+        )
@@ -0,0 +1,212 @@
+"""
+Compact columnar container for generated tokens and their probabilities.
+"""
+
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import base64
+import math
+import sys
+
+_MISSING = math.nan  # Stored in place of a None logprob/probability
+
+
+def _to_optional(value: float) -> Optional[float]:
+    """Convert a stored float back to None if it marks a missing value."""
+    return None if math.isnan(value) else value
+
+
+def _pack_floats(values: array) -> str:
+    """Encode floats as base64 of little-endian float32 values."""
+    packed = array("f", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+class TokenSequence:
+    """
+    Struct-of-arrays representation of a generation's tokens.
+
+    Instead of a dictionary per token and per alternative, values are kept in
+    flat typed arrays: one entry per token for the chosen token, and one entry
+    per alternative with ``alt_offsets`` marking where each token's
+    alternatives start (alternatives of token i are
+    ``alt_offsets[i]:alt_offsets[i + 1]``). Token strings are interned, so
+    repeated tokens share one string object. Missing logprobs are stored as NaN.
+    """
+
+    __slots__ = (
+        "texts",
+        "logprobs",
+        "probabilities",
+        "alt_offsets",
+        "alt_texts",
+        "alt_logprobs",
+        "alt_probabilities",
+    )
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.logprobs = array("d")
+        self.probabilities = array("d")
+        self.alt_offsets = array("q", [0])
+        self.alt_texts: List[str] = []
+        self.alt_logprobs = array("d")
+        self.alt_probabilities = array("d")
+
+    def append(
+        self,
+        text: str,
+        logprob: Optional[float],
+        alternatives: Iterable[Tuple[str, Optional[float]]] = (),
+        probability: Optional[float] = None,
+    ) -> None:
+        """
+        Append a token and its top alternatives.
+
+        Args:
+            text: The chosen token text.
+            logprob: Log probability of the chosen token, or None if unavailable.
+            alternatives: (text, logprob) pairs of the top alternatives. Later
+                          duplicates of a text overwrite earlier ones, as with
+                          the dictionary format.
+            probability: Probability of the chosen token. Derived from logprob
+                         when not given.
+        """
+        if probability is None and logprob is not None:
+            probability = 2**logprob
+        self.texts.append(sys.intern(text))
+        self.logprobs.append(_MISSING if logprob is None else logprob)
+        self.probabilities.append(_MISSING if probability is None else probability)
+        for alt_text, alt_logprob in dict(alternatives).items():
+            self.alt_texts.append(sys.intern(alt_text))
+            if alt_logprob is None:
+                self.alt_logprobs.append(_MISSING)
+                self.alt_probabilities.append(_MISSING)
+            else:
+                self.alt_logprobs.append(alt_logprob)
+                self.alt_probabilities.append(2**alt_logprob)
+        self.alt_offsets.append(len(self.alt_texts))
+
+    def extend(self, other: "TokenSequence") -> None:
+        """Append all tokens of another sequence to this one."""
+        base = len(self.alt_texts)
+        self.texts.extend(other.texts)
+        self.logprobs.extend(other.logprobs)
+        self.probabilities.extend(other.probabilities)
+        self.alt_offsets.extend(offset + base for offset in other.alt_offsets[1:])
+        self.alt_texts.extend(other.alt_texts)
+        self.alt_logprobs.extend(other.alt_logprobs)
+        self.alt_probabilities.extend(other.alt_probabilities)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if index < 0:
+            index += len(self.texts)
+        if not 0 <= index < len(self.texts):
+            raise IndexError("TokenSequence index out of range")
+        return self.token_dict(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self.texts)):
+            yield self.token_dict(i)
+
+    def token_dict(self, index: int) -> Dict[str, Any]:
+        """
+        Materialize one token in the dictionary format used by the JSON API.
+
+        Args:
+            index: Position of the token in the sequence
+
+        Returns:
+            Token information dictionary with token, text, logprob, probability
+            and top_logprobs keys
+        """
+        text = self.texts[index]
+        top_logprobs: Dict[str, Any] = {}
+        for j in range(self.alt_offsets[index], self.alt_offsets[index + 1]):
+            top_logprobs[self.alt_texts[j]] = {
+                "logprob": _to_optional(self.alt_logprobs[j]),
+                "probability": _to_optional(self.alt_probabilities[j]),
+            }
+        return {
+            "token": text,
+            "text": text,
+            "logprob": _to_optional(self.logprobs[index]),
+            "probability": _to_optional(self.probabilities[index]),
+            "top_logprobs": top_logprobs,
+        }
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Convert the whole sequence to the list-of-dictionaries JSON format."""
+        return [self.token_dict(i) for i in range(len(self.texts))]
+
+    def to_columns(self) -> Dict[str, List[Any]]:
+        """
+        Convert the sequence to a columnar JSON-serializable dictionary.
+
+        Probabilities are omitted since they follow from the logprobs
+        (probability == 2**logprob).
+
+        Returns:
+            Dictionary with text, logprob, alt_offsets, alt_text and
+            alt_logprob lists; missing logprobs are None
+        """
+        return {
+            "text": self.texts,
+            "logprob": [_to_optional(v) for v in self.logprobs],
+            "alt_offsets": self.alt_offsets.tolist(),
+            "alt_text": self.alt_texts,
+            "alt_logprob": [_to_optional(v) for v in self.alt_logprobs],
+        }
+
+    def to_packed(self) -> Dict[str, Any]:
+        """
+        Convert the sequence to a compact JSON-serializable dictionary.
+
+        Holds the same columns as to_columns, but every distinct token text is
+        sent once in "strings" and referenced by index, and logprobs are
+        base64-encoded little-endian float32 arrays with NaN for missing values.
+
+        Returns:
+            Dictionary with strings, text, logprob, alt_offsets, alt_text and
+            alt_logprob entries
+        """
+        table: Dict[str, int] = {}
+        text_ids = [table.setdefault(text, len(table)) for text in self.texts]
+        alt_ids = [table.setdefault(text, len(table)) for text in self.alt_texts]
+        return {
+            "strings": list(table),
+            "text": text_ids,
+            "logprob": _pack_floats(self.logprobs),
+            "alt_offsets": self.alt_offsets.tolist(),
+            "alt_text": alt_ids,
+            "alt_logprob": _pack_floats(self.alt_logprobs),
+        }
+
+    @classmethod
+    def from_list(cls, tokens: Iterable[Dict[str, Any]]) -> "TokenSequence":
+        """
+        Build a sequence from token dictionaries in the JSON format.
+
+        Args:
+            tokens: Token information dictionaries as produced by to_list
+
+        Returns:
+            TokenSequence holding the same data
+        """
+        sequence = cls()
+        for token in tokens:
+            sequence.append(
+                token.get("text", ""),
+                token.get("logprob"),
+                (
+                    (alt_text, alt_info.get("logprob"))
+                    for alt_text, alt_info in (token.get("top_logprobs") or {}).items()
+                ),
+                probability=token.get("probability"),
+            )
+        return sequence
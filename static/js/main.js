@@ -9,12 +9,19 @@ const temperatureValue = document.getElementById('temperature-value');
 const topPSlider = document.getElementById('top-p-slider');
 const topPValue = document.getElementById('top-p-value');
 const maxTokensInput = document.getElementById('max-tokens-input');
+const samplesInput = document.getElementById('samples-input');
+const compareModelsInput = document.getElementById('compare-models-input');
 const promptInput = document.getElementById('prompt-input');
 const generateBtn = document.getElementById('generate-btn');
+const stopBtn = document.getElementById('stop-btn');
 const loadingIndicator = document.getElementById('loading-indicator');
 const errorMessage = document.getElementById('error-message');
 const tokenVisualization = document.getElementById('token-visualization');
 const serviceTypeSelect = document.getElementById('service-type-select');
+const streamCheckbox = document.getElementById('stream-checkbox');
+const scoreCheckbox = document.getElementById('score-checkbox');
+const rescaleViewCheckbox = document.getElementById('rescale-view-checkbox');
+const historySelect = document.getElementById('history-select');
 
 // Application state
 let appConfig = {
@@ -27,6 +34,17 @@ let appConfig = {
 };
 let currentModels = [];
 let currentDefaultModel = '';
+let currentTokens = []; // Processed tokens backing the visualization and its tooltips
+let currentRawTokens = null; // Raw logprobs of the last generation, for live top_p/temperature views
+let currentSamples = null; // Raw logprobs per sample and per-position stats of a multi-sample generation
+let currentComparison = null; // Columns of a model comparison, each with its own raw logprobs
+let currentGenerationId = null; // Server id of the shown generation, for exploring branches from it
+let currentAbortController = null; // Aborts the request of the generation in progress
+let chunkObserver = null; // IntersectionObserver used by the windowed rendering mode
+
+// Outputs with more tokens than this are rendered in windowed chunks
+const VIRTUALIZE_THRESHOLD = 2000;
+const CHUNK_SIZE = 500;
 
 // Initialize the application
 async function initializeApp() {
@@ -64,6 +82,7 @@ async function initializeApp() {
 
         // Initial load of models for the selected/default service type
         await loadModelsForService(serviceTypeSelect.value);
+        await loadHistory();
 
     } catch (error) {
         showError(error.message);
@@ -130,7 +149,9 @@ async function generateText() {
     const temperature = parseFloat(temperatureSlider.value);
     const topP = parseFloat(topPSlider.value);
     const maxTokens = parseInt(maxTokensInput.value);
+    const samples = parseInt(samplesInput.value) || 1;
     const prompt = promptInput.value.trim();
+    const compareModels = compareModelsInput.value.split(',').map(name => name.trim()).filter(Boolean);
     
     // Validate input
     if (!prompt) {
@@ -138,25 +159,54 @@ async function generateText() {
         return;
     }
     
+    // A new generation replaces the one in progress, whose request is aborted
+    const controller = beginGeneration();
+    const signal = controller.signal;
     try {
         // Show loading indicator
         showLoading(true);
         hideError();
         
-        // Send request to API
+        const payload = {
+            prompt,
+            model,
+            temperature,
+            top_p: topP,
+            max_tokens: maxTokens,
+            service_type: selectedServiceType
+        };
+
+        // Scoring shows how likely the model finds the prompt itself
+        if (scoreCheckbox.checked) {
+            await scorePrompt(payload, signal);
+            return;
+        }
+
+        // Comparisons stream every model at once, one column each
+        if (compareModels.length > 0) {
+            await compareGeneration(payload, [model, ...compareModels], signal);
+            return;
+        }
+
+        // Several samples come back together, so they are not streamed
+        if (samples > 1) {
+            await generateSamples(payload, samples, signal);
+            return;
+        }
+
+        if (streamCheckbox.checked) {
+            await streamGeneration(payload, signal);
+            return;
+        }
+        
+        // Send request to API, asking for packed raw logprobs that the browser processes itself
         const response = await fetch('/api/generate', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({
-                prompt,
-                model,
-                temperature,
-                top_p: topP,
-                max_tokens: maxTokens,
-                service_type: selectedServiceType
-            })
+            body: JSON.stringify({ ...payload, format: 'packed' }),
+            signal
         });
         
         if (!response.ok) {
@@ -167,109 +217,601 @@ async function generateText() {
         const data = await response.json();
         
         // Display the visualization
-        tokenVisualization.innerHTML = data.html;
-        
-        // Initialize token tooltips
-        initializeTokenTooltips();
+        currentSamples = null;
+        currentComparison = null;
+        currentGenerationId = data.generation_id;
+        currentRawTokens = window.TokenVisualizer.expandRawColumns(
+            window.TokenVisualizer.unpackColumns(data.packed)
+        );
+        refreshView();
         
     } catch (error) {
+        if (error.name === 'AbortError') {
+            return;
+        }
         showError(error.message);
         console.error('Generation error:', error);
     } finally {
-        // Hide loading indicator
-        showLoading(false);
+        // A replaced or stopped generation leaves the loading state to its successor
+        if (finishGeneration(controller)) {
+            showLoading(false);
+            loadHistory();
+        }
     }
 }
 
-// Initialize token tooltips
-function initializeTokenTooltips() {
-    console.log('Initializing tooltips...');
-    const tokens = document.querySelectorAll('.token');
-    console.log(`Found ${tokens.length} token elements.`);
-    
-    tokens.forEach((token, index) => {
-        console.log(`Processing token ${index + 1}`);
-        try {
-            // Get tooltip data from data attribute (as JSON)
-            const tooltipJSON = token.getAttribute('data-tooltip');
-            console.log('  Raw data-tooltip:', tooltipJSON);
-            if (!tooltipJSON) {
-                console.warn('  Token missing data-tooltip attribute.');
-                return;
-            }
-            
-            const tooltipData = JSON.parse(tooltipJSON);
-            console.log('  Parsed tooltip data:', tooltipData);
-            
-            // --- Get the color class for the main token --- Needed for the tooltip text
-            // We need to retrieve it from the parent token's class list
-            let mainTokenColorClass = 'unknown-prob';
-            const tokenClasses = token.className.split(' ');
-            const probClasses = ['high-prob', 'medium-high-prob', 'medium-prob', 'medium-low-prob', 'low-prob'];
-            for (const cls of tokenClasses) {
-                if (probClasses.includes(cls)) {
-                    mainTokenColorClass = cls;
-                    break;
+// Abort the request of the generation in progress, if any, and start tracking a new one
+function beginGeneration() {
+    cancelGeneration();
+    currentAbortController = new AbortController();
+    return currentAbortController;
+}
+
+// Stop tracking a generation; returns false if it was already replaced or cancelled
+function finishGeneration(controller) {
+    if (currentAbortController !== controller) {
+        return false;
+    }
+    currentAbortController = null;
+    return true;
+}
+
+// Abort the generation in progress, so the server stops its upstream call too
+function cancelGeneration() {
+    if (currentAbortController) {
+        currentAbortController.abort();
+        currentAbortController = null;
+    }
+}
+
+// List past generations persisted by the server in the history dropdown
+async function loadHistory() {
+    try {
+        const response = await fetch('/api/history?limit=100');
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        historySelect.disabled = !data.enabled;
+        historySelect.length = 1;
+        data.generations.forEach(entry => {
+            const option = document.createElement('option');
+            option.value = entry.id;
+            const created = new Date(entry.created * 1000).toLocaleString();
+            option.textContent = `${created} - ${entry.model}: ${entry.prompt.slice(0, 40)}`;
+            option.title = entry.prompt;
+            historySelect.appendChild(option);
+        });
+    } catch (error) {
+        console.error('History loading error:', error);
+    }
+}
+
+// Reopen a past generation from the history, without calling the model again
+async function openHistoryEntry(generationId) {
+    try {
+        hideError();
+        const response = await fetch(`/api/history/${generationId}?format=packed`);
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.error || 'Failed to load the generation');
+        }
+        const data = await response.json();
+
+        // Restore the prompt and settings the generation was made with
+        const params = data.params;
+        promptInput.value = params.prompt;
+        maxTokensInput.value = params.max_tokens;
+        temperatureSlider.value = params.temperature;
+        temperatureValue.textContent = parseFloat(params.temperature).toFixed(2);
+        topPSlider.value = params.top_p;
+        topPValue.textContent = parseFloat(params.top_p).toFixed(2);
+
+        currentSamples = null;
+        currentComparison = null;
+        currentGenerationId = params.mode === 'score' ? null : data.generation_id;
+        currentRawTokens = window.TokenVisualizer.expandRawColumns(
+            window.TokenVisualizer.unpackColumns(data.packed)
+        );
+        refreshView();
+    } catch (error) {
+        showError(error.message);
+        console.error('History error:', error);
+    }
+}
+
+// Score the prompt's own tokens and show them like a generation
+async function scorePrompt(payload, signal) {
+    const response = await fetch('/api/score', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ ...payload, format: 'packed' }),
+        signal
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || 'Failed to score the prompt');
+    }
+
+    const data = await response.json();
+    currentSamples = null;
+    currentComparison = null;
+    currentGenerationId = null; // Branches continue generations, not scored prompts
+    currentRawTokens = window.TokenVisualizer.expandRawColumns(
+        window.TokenVisualizer.unpackColumns(data.packed)
+    );
+    refreshView();
+}
+
+// Continue the shown generation from an alternative token instead of the one
+// the model picked; the server reuses continuations it has already explored
+async function exploreBranch(position, alternative) {
+    const controller = beginGeneration();
+    try {
+        showLoading(true);
+        hideError();
+        const response = await fetch('/api/branch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                generation_id: currentGenerationId,
+                position,
+                alternative,
+                max_tokens: parseInt(maxTokensInput.value),
+                format: 'packed'
+            }),
+            signal: controller.signal
+        });
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.error || 'Failed to explore the branch');
+        }
+
+        const data = await response.json();
+        currentGenerationId = data.generation_id;
+        currentRawTokens = window.TokenVisualizer.expandRawColumns(
+            window.TokenVisualizer.unpackColumns(data.packed)
+        );
+        refreshView();
+    } catch (error) {
+        if (error.name === 'AbortError') {
+            return;
+        }
+        showError(error.message);
+        console.error('Branch error:', error);
+    } finally {
+        if (finishGeneration(controller)) {
+            showLoading(false);
+            loadHistory();
+        }
+    }
+}
+
+// Generate several samples in one request and show them as stacked rows
+async function generateSamples(payload, n, signal) {
+    const response = await fetch('/api/generate', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ ...payload, n, format: 'packed' }),
+        signal
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || 'Failed to generate text');
+    }
+
+    const data = await response.json();
+    currentRawTokens = null;
+    currentComparison = null;
+    currentGenerationId = null;
+    currentSamples = {
+        raw: data.samples.map(sample => window.TokenVisualizer.expandRawColumns(
+            window.TokenVisualizer.unpackColumns(sample.packed)
+        )),
+        stats: data.stats
+    };
+    refreshView();
+}
+
+// Stream generation over Server-Sent Events, appending tokens as they arrive
+async function streamGeneration(payload, signal) {
+    const response = await fetch('/api/generate/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ ...payload, include_raw: true }),
+        signal
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || 'Failed to generate text');
+    }
+
+    currentSamples = null;
+    currentComparison = null;
+    currentGenerationId = null;
+    currentRawTokens = [];
+    renderVisualization([]);
+    const container = tokenVisualization.querySelector('.token-container');
+
+    await readEventStream(response, event => handleStreamEvent(event, container));
+
+    // Switch long streamed outputs over to windowed rendering, and apply any
+    // view settings changed while streaming
+    if (currentTokens.length > VIRTUALIZE_THRESHOLD || rescaleViewCheckbox.checked) {
+        refreshView();
+    }
+}
+
+// Stream one prompt from several models at once, each into its own column
+async function compareGeneration(payload, models, signal) {
+    const response = await fetch('/api/compare/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ ...payload, models, include_raw: true }),
+        signal
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || 'Failed to compare models');
+    }
+
+    currentSamples = null;
+    currentRawTokens = null;
+    currentGenerationId = null;
+    currentComparison = { columns: [] };
+    renderComparison([]);
+
+    await readEventStream(response, handleCompareEvent);
+
+    // Apply any view settings changed while streaming
+    if (rescaleViewCheckbox.checked) {
+        refreshView();
+    }
+}
+
+// Read a Server-Sent Events response, passing each parsed event to onEvent
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        // SSE messages are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            onEvent(parseStreamEvent(message));
+        }
+    }
+}
+
+// Parse a single SSE message into its event name and JSON data
+function parseStreamEvent(message) {
+    let event = 'message';
+    let data = '';
+    message.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            data += line.slice(5).trim();
+        }
+    });
+    return { event, data: data ? JSON.parse(data) : {} };
+}
+
+// Apply a streamed event to the visualization
+function handleStreamEvent({ event, data }, container) {
+    if (event === 'token') {
+        currentRawTokens.push(window.TokenVisualizer.rawTokenFromDict(data.raw));
+        currentTokens.push(data.token);
+        container.insertAdjacentHTML(
+            'beforeend',
+            window.TokenVisualizer.createTokenSpanHTML(data.token, currentTokens.length - 1)
+        );
+    } else if (event === 'done') {
+        currentGenerationId = data.generation_id;
+    } else if (event === 'error') {
+        throw new Error(data.error || 'Failed to generate text');
+    }
+}
+
+// Apply a streamed comparison event to its column; a failed model does not stop the others
+function handleCompareEvent({ event, data }) {
+    if (event === 'start') {
+        currentComparison.columns = data.columns.map(column => ({ ...column, raw: [], status: 'Generating...' }));
+        renderComparison([]);
+        return;
+    }
+    const column = currentComparison.columns[data.column];
+    if (!column) {
+        return;
+    }
+    const columnElement = tokenVisualization.querySelector(`.compare-column[data-column="${data.column}"]`);
+    if (event === 'token') {
+        column.raw.push(window.TokenVisualizer.rawTokenFromDict(data.raw));
+        currentTokens.push(data.token);
+        columnElement.querySelector('.token-container').insertAdjacentHTML(
+            'beforeend',
+            window.TokenVisualizer.createTokenSpanHTML(data.token, currentTokens.length - 1)
+        );
+        return;
+    }
+    if (event === 'done') {
+        column.status = data.cached ? 'cached' : `${data.seconds.toFixed(1)}s`;
+    } else if (event === 'error') {
+        column.error = data.error || 'Failed to generate text';
+    } else {
+        return;
+    }
+    columnElement.querySelector('.compare-status').outerHTML = window.TokenVisualizer.createCompareStatusHTML(column);
+}
+
+// Re-derive the visualization from the stored raw logprobs for the current
+// Top P (and temperature, if the view is rescaled) without calling the API
+function refreshView() {
+    if (currentSamples) {
+        renderSamples(currentSamples.raw.map(deriveView), currentSamples.stats);
+        return;
+    }
+    if (currentComparison) {
+        renderComparison(currentComparison.columns.map(column => deriveView(column.raw)));
+        return;
+    }
+    if (!currentRawTokens) {
+        return;
+    }
+    renderVisualization(deriveView(currentRawTokens));
+}
+
+// Processed tokens for raw tokens under the current view settings
+function deriveView(rawTokens) {
+    if (rescaleViewCheckbox.checked) {
+        rawTokens = window.TokenVisualizer.rescaleTemperature(rawTokens, parseFloat(temperatureSlider.value));
+    }
+    return window.TokenVisualizer.deriveTokens(rawTokens, parseFloat(topPSlider.value));
+}
+
+// Render samples as stacked rows under a row of per-position statistics
+function renderSamples(samples, stats) {
+    hideTooltip();
+    if (chunkObserver) {
+        chunkObserver.disconnect();
+        chunkObserver = null;
+    }
+    const statTokens = window.TokenVisualizer.statsTokens(stats);
+    // Tooltips look tokens up by index, so all rows share one flat array
+    currentTokens = statTokens.concat(...samples);
+    tokenVisualization.innerHTML = window.TokenVisualizer.createSamplesHTML(statTokens, samples);
+}
+
+// Render the comparison columns from their processed tokens
+function renderComparison(columnTokens) {
+    hideTooltip();
+    if (chunkObserver) {
+        chunkObserver.disconnect();
+        chunkObserver = null;
+    }
+    // Tooltips look tokens up by index, so all columns share one flat array
+    currentTokens = [].concat(...columnTokens);
+    tokenVisualization.innerHTML = window.TokenVisualizer.createCompareHTML(currentComparison.columns, columnTokens);
+}
+
+// Render processed tokens, switching to windowed chunks for large outputs
+function renderVisualization(tokens) {
+    currentTokens = tokens;
+    hideTooltip();
+    if (chunkObserver) {
+        chunkObserver.disconnect();
+        chunkObserver = null;
+    }
+
+    if (tokens.length <= VIRTUALIZE_THRESHOLD || !('IntersectionObserver' in window)) {
+        tokenVisualization.innerHTML = window.TokenVisualizer.createTokenVisualizationHTML(tokens);
+        return;
+    }
+    renderVirtualized(tokens);
+}
+
+// Windowed rendering: only chunks near the viewport have their token spans in the DOM
+function renderVirtualized(tokens) {
+    const container = document.createElement('div');
+    container.className = 'token-container virtualized';
+    chunkRanges(tokens).forEach(([start, end]) => {
+        const chunk = document.createElement('div');
+        chunk.className = 'token-chunk';
+        chunk.dataset.start = start;
+        chunk.dataset.end = end;
+        chunk.style.height = `${estimateChunkHeight(tokens, start, end)}px`;
+        container.appendChild(chunk);
+    });
+    tokenVisualization.innerHTML = '';
+    tokenVisualization.appendChild(container);
+
+    chunkObserver = new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            const chunk = entry.target;
+            const start = parseInt(chunk.dataset.start);
+            const end = parseInt(chunk.dataset.end);
+            if (entry.isIntersecting && !chunk.dataset.rendered) {
+                const htmlParts = [];
+                for (let i = start; i < end; i++) {
+                    htmlParts.push(window.TokenVisualizer.createTokenSpanHTML(currentTokens[i], i));
                 }
+                chunk.innerHTML = htmlParts.join('');
+                chunk.style.height = '';
+                chunk.dataset.rendered = 'true';
+            } else if (!entry.isIntersecting && chunk.dataset.rendered) {
+                // Keep the measured height so the scroll position doesn't jump
+                chunk.style.height = `${chunk.offsetHeight}px`;
+                chunk.innerHTML = '';
+                delete chunk.dataset.rendered;
             }
-            // --- End getting main token color class ---
-            
-            // Create tooltip element
-            const tooltip = document.createElement('div');
-            tooltip.className = 'token-tooltip';
-            
-            // Create token info - Add span with color class for the token text
-            let tooltipHTML = `<div class="token-info">Token: <span class="${mainTokenColorClass}">${tooltipData.text}</span></div>`;
-            tooltipHTML += `<div class="token-info">Probability: ${tooltipData.probability}</div>`;
-            tooltipHTML += `<div class="token-info">Log Probability: ${tooltipData.logprob}</div>`;
-            // Add Selection Chance for main token
-            if (tooltipData.selection_chance !== undefined) {
-                 tooltipHTML += `<div class="token-info">Selection Chance (Top P): ${tooltipData.selection_chance}</div>`;
+        });
+    }, { rootMargin: '1000px 0px' });
+    container.querySelectorAll('.token-chunk').forEach(chunk => chunkObserver.observe(chunk));
+}
+
+// Split tokens into chunks, preferring to break right after a newline token
+function chunkRanges(tokens) {
+    const ranges = [];
+    let start = 0;
+    while (start < tokens.length) {
+        let end = Math.min(start + CHUNK_SIZE, tokens.length);
+        const hardLimit = Math.min(start + 2 * CHUNK_SIZE, tokens.length);
+        while (end < hardLimit && !tokens[end - 1].text.includes('\n')) {
+            end++;
+        }
+        ranges.push([start, end]);
+        start = end;
+    }
+    return ranges;
+}
+
+// Rough height of a chunk before it is rendered, based on its text length
+function estimateChunkHeight(tokens, start, end) {
+    const charWidth = 9;
+    const lineHeight = 29;
+    const charsPerLine = Math.max(1, Math.floor(tokenVisualization.clientWidth / charWidth));
+    let lines = 1;
+    let column = 0;
+    for (let i = start; i < end; i++) {
+        for (const char of tokens[i].text) {
+            if (char === '\n' || ++column > charsPerLine) {
+                lines++;
+                column = 0;
             }
-            
-            // Add alternatives if available
-            if (tooltipData.alternatives && tooltipData.alternatives.length > 0) {
-                tooltipHTML += '<div class="token-alternatives"><h4>Alternatives:</h4>';
-                
-                tooltipData.alternatives.forEach(alt => {
-                    const altColorClass = alt.color_class || 'unknown-prob'; 
-                    tooltipHTML += `<div class="alt-token ${altColorClass}">`; 
-                    tooltipHTML += `<span class="alt-text"><span class="${altColorClass}">${alt.text}</span></span>`; 
-                    tooltipHTML += `<span class="alt-prob">P: ${alt.probability}</span>`;
-                    tooltipHTML += `<span class="alt-logprob">LogP: ${alt.logprob}</span>`;
-                    // Add Selection Chance for alternative token
-                    if (alt.selection_chance !== undefined) {
-                        tooltipHTML += `<span class="alt-chance">Chance: ${alt.selection_chance}</span>`;
-                    }
-                    tooltipHTML += '</div>';
-                });
-                
-                tooltipHTML += '</div>';
+        }
+    }
+    return lines * lineHeight;
+}
+
+// Shared tooltip element, filled on demand from the token array
+function getTooltipElement() {
+    let tooltip = document.getElementById('token-tooltip');
+    if (!tooltip) {
+        tooltip = document.createElement('div');
+        tooltip.id = 'token-tooltip';
+        tooltip.className = 'token-tooltip hidden';
+        document.body.appendChild(tooltip);
+    }
+    return tooltip;
+}
+
+// Show the tooltip for a token span above it
+function showTooltip(tokenElement) {
+    const index = parseInt(tokenElement.dataset.index);
+    const token = currentTokens[index];
+    if (!token) {
+        return;
+    }
+    const tooltip = getTooltipElement();
+    tooltip.innerHTML = window.TokenVisualizer.createTooltipHTML(token);
+    tooltip.dataset.index = index;
+    tooltip.classList.remove('hidden');
+
+    const rect = tokenElement.getBoundingClientRect();
+    const left = Math.min(
+        Math.max(rect.left + rect.width / 2 - tooltip.offsetWidth / 2, 0),
+        window.innerWidth - tooltip.offsetWidth
+    );
+    const top = rect.top - tooltip.offsetHeight - 6;
+    tooltip.style.left = `${left}px`;
+    tooltip.style.top = `${top >= 0 ? top : rect.bottom + 6}px`;
+}
+
+// Hide the shared tooltip, unpinning it
+function hideTooltip() {
+    const tooltip = document.getElementById('token-tooltip');
+    if (tooltip) {
+        tooltip.classList.add('hidden');
+        tooltip.classList.remove('pinned');
+    }
+}
+
+// Whether the tooltip is pinned open by a click, so its alternatives can be clicked
+function isTooltipPinned() {
+    const tooltip = document.getElementById('token-tooltip');
+    return Boolean(tooltip && tooltip.classList.contains('pinned'));
+}
+
+// One delegated hover handler serves every token span; clicking a token pins
+// its tooltip, and clicking an alternative in it explores that branch
+function initializeTooltipHandlers() {
+    tokenVisualization.addEventListener('mouseover', event => {
+        const tokenElement = event.target.closest('.token');
+        if (tokenElement && !isTooltipPinned()) {
+            showTooltip(tokenElement);
+        }
+    });
+    tokenVisualization.addEventListener('mouseout', event => {
+        const tokenElement = event.target.closest('.token');
+        if (tokenElement && !tokenElement.contains(event.relatedTarget) && !isTooltipPinned()) {
+            hideTooltip();
+        }
+    });
+    tokenVisualization.addEventListener('click', event => {
+        const tokenElement = event.target.closest('.token');
+        // Branches continue a single generation, whose token indexes are its positions
+        if (!tokenElement || !currentGenerationId || !currentRawTokens || generateBtn.disabled) {
+            return;
+        }
+        event.stopPropagation();
+        showTooltip(tokenElement);
+        const tooltip = getTooltipElement();
+        tooltip.classList.add('pinned');
+        tooltip.querySelectorAll('.alt-token').forEach(altElement => {
+            if (altElement.dataset.alt !== currentTokens[parseInt(tooltip.dataset.index)].text) {
+                altElement.classList.add('branchable');
             }
-            
-            tooltip.innerHTML = tooltipHTML;
-            console.log('  Generated tooltip HTML:', tooltipHTML);
-            
-            // Add tooltip to token
-            token.appendChild(tooltip);
-            console.log('  Appended tooltip element:', tooltip);
-            
-            // Remove data-tooltip attribute to avoid duplication
-            token.removeAttribute('data-tooltip');
-        } catch (error) {
-            console.error(`Error creating tooltip for token ${index + 1}:`, error, 'Raw JSON:', tooltipJSON);
+        });
+    });
+    getTooltipElement().addEventListener('click', event => {
+        const altElement = event.target.closest('.alt-token.branchable');
+        if (altElement) {
+            const position = parseInt(event.currentTarget.dataset.index);
+            hideTooltip();
+            exploreBranch(position, altElement.dataset.alt);
+        }
+    });
+    document.addEventListener('click', event => {
+        if (isTooltipPinned() && !event.target.closest('#token-tooltip')) {
+            hideTooltip();
         }
     });
-    console.log('Tooltip initialization finished.');
+    window.addEventListener('scroll', hideTooltip, { passive: true });
 }
 
 // Show/hide loading indicator
 function showLoading(isLoading) {
     if (isLoading) {
         loadingIndicator.classList.remove('hidden');
+        stopBtn.classList.remove('hidden');
         generateBtn.disabled = true;
     } else {
         loadingIndicator.classList.add('hidden');
+        stopBtn.classList.add('hidden');
         generateBtn.disabled = false;
     }
 }
@@ -293,21 +835,51 @@ function hideError() {
 document.addEventListener('DOMContentLoaded', () => {
     // Initialize the application
     initializeApp();
+    initializeTooltipHandlers();
     
     // Temperature slider
     temperatureSlider.addEventListener('input', () => {
         // Format to two decimal places
         temperatureValue.textContent = parseFloat(temperatureSlider.value).toFixed(2);
+        if (rescaleViewCheckbox.checked && !generateBtn.disabled) {
+            refreshView();
+        }
     });
     
-    // Top P slider
+    // Top P slider - updates the current visualization live
     topPSlider.addEventListener('input', () => {
         // Format to two decimal places
         topPValue.textContent = parseFloat(topPSlider.value).toFixed(2);
+        if (!generateBtn.disabled) {
+            refreshView();
+        }
+    });
+    
+    // Toggle the temperature-rescaled view
+    rescaleViewCheckbox.addEventListener('change', () => {
+        if (!generateBtn.disabled) {
+            refreshView();
+        }
     });
     
     // Generate button
     generateBtn.addEventListener('click', generateText);
+
+    // Stop button - aborts the request, which also stops the server's upstream call
+    stopBtn.addEventListener('click', () => {
+        cancelGeneration();
+        showLoading(false);
+    });
+
+    // Don't leave a generation running for a page that is going away
+    window.addEventListener('pagehide', cancelGeneration);
+
+    // Reopen the selected past generation
+    historySelect.addEventListener('change', () => {
+        if (historySelect.value) {
+            openHistoryEntry(historySelect.value);
+        }
+    });
     
     // Allow Enter key in prompt input to trigger generation
     promptInput.addEventListener('keydown', (event) => {
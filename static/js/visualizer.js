@@ -10,6 +10,9 @@ const PROBABILITY_THRESHOLDS = {
     MEDIUM_LOW: 0.2
 };
 
+// Lowest temperature used for temperature views, matching config.MIN_VIEW_TEMPERATURE
+const MIN_VIEW_TEMPERATURE = 0.01;
+
 const PROBABILITY_COLORS = {
     HIGH: '#00cc00',        // Bright green
     MEDIUM_HIGH: '#66cc33', // Light green
@@ -19,6 +22,39 @@ const PROBABILITY_COLORS = {
     UNKNOWN: '#808080'      // Gray
 };
 
+// CSS classes for probability levels, matching TokenProcessor.calculate_color
+const PROBABILITY_CLASSES = {
+    HIGH: 'high-prob',
+    MEDIUM_HIGH: 'medium-high-prob',
+    MEDIUM: 'medium-prob',
+    MEDIUM_LOW: 'medium-low-prob',
+    LOW: 'low-prob',
+    UNKNOWN: 'unknown-prob'
+};
+
+/**
+ * Calculate CSS class based on token probability
+ * @param {number} probability - Token probability (0.0 to 1.0)
+ * @returns {string} - CSS class name for probability visualization
+ */
+function calculateColorClass(probability) {
+    if (probability === null || probability === undefined) {
+        return PROBABILITY_CLASSES.UNKNOWN;
+    }
+
+    if (probability > PROBABILITY_THRESHOLDS.HIGH) {
+        return PROBABILITY_CLASSES.HIGH;
+    } else if (probability > PROBABILITY_THRESHOLDS.MEDIUM_HIGH) {
+        return PROBABILITY_CLASSES.MEDIUM_HIGH;
+    } else if (probability > PROBABILITY_THRESHOLDS.MEDIUM) {
+        return PROBABILITY_CLASSES.MEDIUM;
+    } else if (probability > PROBABILITY_THRESHOLDS.MEDIUM_LOW) {
+        return PROBABILITY_CLASSES.MEDIUM_LOW;
+    } else {
+        return PROBABILITY_CLASSES.LOW;
+    }
+}
+
 /**
  * Calculate color based on token probability
  * @param {number} probability - Token probability (0.0 to 1.0)
@@ -56,57 +92,401 @@ function formatProbability(probability, decimalPlaces = 4) {
     return probability.toFixed(decimalPlaces);
 }
 
+/**
+ * Format selection chance as a percentage
+ * @param {number} chance - Selection chance (0.0 to 1.0)
+ * @returns {string} - Formatted percentage string
+ */
+function formatChance(chance) {
+    return `${((chance || 0) * 100).toFixed(2)}%`;
+}
+
+/**
+ * Escape text for safe use in HTML content and attributes
+ * @param {string} text - Raw text
+ * @returns {string} - Escaped text
+ */
+function escapeHTML(text) {
+    return String(text)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#x27;');
+}
+
+/**
+ * Expand a compact columnar payload from /api/generate into token objects
+ * @param {Object} payload - Parallel arrays: text, probability, logprob, selection_chance, alternatives
+ * @returns {Array} - Processed tokens in the same shape as the server's processed tokens
+ */
+function expandCompactTokens(payload) {
+    return payload.text.map((text, i) => ({
+        token: text,
+        text: text,
+        probability: payload.probability[i],
+        logprob: payload.logprob[i],
+        color: calculateColorClass(payload.probability[i]),
+        selection_chance: payload.selection_chance[i],
+        top_alternatives: payload.alternatives[i].map(([altText, probability, logprob, chance]) => ({
+            text: altText,
+            probability: probability,
+            logprob: logprob,
+            color: calculateColorClass(probability),
+            selection_chance: chance
+        }))
+    }));
+}
+
+/**
+ * Expand raw columnar token data (format=raw) into raw token objects
+ * @param {Object} raw - Columns: text, logprob, alt_offsets, alt_text, alt_logprob
+ * @returns {Array} - Raw tokens: {text, logprob, probability, alternatives: [{text, logprob, probability}]}
+ */
+function expandRawColumns(raw) {
+    return raw.text.map((text, i) => {
+        const alternatives = [];
+        for (let j = raw.alt_offsets[i]; j < raw.alt_offsets[i + 1]; j++) {
+            alternatives.push(createRawCandidate(raw.alt_text[j], raw.alt_logprob[j]));
+        }
+        return { ...createRawCandidate(text, raw.logprob[i]), alternatives };
+    });
+}
+
+/**
+ * Decode base64 little-endian float32 values, with NaN marking missing values
+ * @param {string} base64 - Encoded values
+ * @returns {Array} - Numbers, or null for missing values
+ */
+function decodeFloat32(base64) {
+    const binary = atob(base64);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    const view = new DataView(bytes.buffer);
+    const values = new Array(bytes.length / 4);
+    for (let i = 0; i < values.length; i++) {
+        const value = view.getFloat32(i * 4, true);
+        values[i] = Number.isNaN(value) ? null : value;
+    }
+    return values;
+}
+
+/**
+ * Convert a packed payload from /api/generate with format "packed" into raw columns
+ * Mirrors TokenSequence.to_packed: texts are indices into a string table and
+ * logprobs are base64 float32 arrays.
+ * @param {Object} packed - Entries: strings, text, logprob, alt_offsets, alt_text, alt_logprob
+ * @returns {Object} - Columns for expandRawColumns
+ */
+function unpackColumns(packed) {
+    return {
+        text: packed.text.map(index => packed.strings[index]),
+        logprob: decodeFloat32(packed.logprob),
+        alt_offsets: packed.alt_offsets,
+        alt_text: packed.alt_text.map(index => packed.strings[index]),
+        alt_logprob: decodeFloat32(packed.alt_logprob)
+    };
+}
+
+/**
+ * Convert a raw token dictionary (token/text/logprob/top_logprobs) into a raw token object
+ * @param {Object} tokenInfo - Token information in the API's JSON format
+ * @returns {Object} - Raw token object
+ */
+function rawTokenFromDict(tokenInfo) {
+    const alternatives = Object.entries(tokenInfo.top_logprobs || {}).map(
+        ([text, info]) => createRawCandidate(text, info.logprob)
+    );
+    return { ...createRawCandidate(tokenInfo.text, tokenInfo.logprob), alternatives };
+}
+
+function createRawCandidate(text, logprob) {
+    const known = logprob !== null && logprob !== undefined;
+    return {
+        text: text,
+        logprob: known ? logprob : null,
+        probability: known ? Math.pow(2, logprob) : null
+    };
+}
+
+/**
+ * Re-derive raw token probabilities as if sampled at another temperature
+ * Mirrors TokenProcessor.rescale_temperature: p ** (1 / T), renormalized over each
+ * token's chosen token and returned alternatives.
+ * @param {Array} rawTokens - Raw token objects
+ * @param {number} temperature - View temperature; 1.0 returns the tokens unchanged
+ * @returns {Array} - Rescaled raw token objects
+ */
+function rescaleTemperature(rawTokens, temperature) {
+    if (temperature === 1.0) {
+        return rawTokens;
+    }
+    const t = Math.max(temperature, MIN_VIEW_TEMPERATURE);
+    return rawTokens.map(token => {
+        const candidates = [token, ...token.alternatives.filter(alt => alt.text !== token.text)]
+            .filter(c => c.logprob !== null);
+        if (candidates.length === 0) {
+            return token;
+        }
+        // log2-sum-exp2, shifted by the maximum for stability
+        const maxScaled = Math.max(...candidates.map(c => c.logprob / t));
+        const logNorm = maxScaled + Math.log2(
+            candidates.reduce((sum, c) => sum + Math.pow(2, c.logprob / t - maxScaled), 0)
+        );
+        const rescale = c => createRawCandidate(c.text, c.logprob === null ? null : c.logprob / t - logNorm);
+        return { ...rescale(token), alternatives: token.alternatives.map(rescale) };
+    });
+}
+
+/**
+ * Derive processed tokens (selection chance, nucleus alternatives, colors) for a top_p
+ * Mirrors TokenProcessor.process_token so the view can change without an API call.
+ * @param {Array} rawTokens - Raw token objects
+ * @param {number} topP - Top P value for the nucleus
+ * @returns {Array} - Processed tokens
+ */
+function deriveTokens(rawTokens, topP) {
+    return rawTokens.map(token => {
+        // Candidates: chosen token first, then alternatives other than the chosen one
+        const candidates = [];
+        if (token.probability !== null) {
+            candidates.push(token);
+        }
+        token.alternatives.forEach(alt => {
+            if (alt.text !== token.text && alt.probability !== null) {
+                candidates.push(alt);
+            }
+        });
+        // Array.prototype.sort is stable, so ties keep their order as in Python
+        candidates.sort((a, b) => b.probability - a.probability);
+
+        let nucleusSize = candidates.length;
+        let nucleusSum = 0;
+        if (topP < 1.0) {
+            nucleusSize = 0;
+            for (const cand of candidates) {
+                nucleusSize++;
+                nucleusSum += cand.probability;
+                if (nucleusSum >= topP) {
+                    break;
+                }
+            }
+        } else {
+            candidates.forEach(cand => { nucleusSum += cand.probability; });
+        }
+        const chanceOf = index => (index < nucleusSize && nucleusSum > 0)
+            ? candidates[index].probability / nucleusSum
+            : 0.0;
+
+        let selectionChance = 0.0;
+        const alternatives = [];
+        candidates.forEach((cand, index) => {
+            const chance = chanceOf(index);
+            if (cand === token) {
+                selectionChance = chance;
+            } else if (chance > 0.0) {
+                alternatives.push({
+                    text: cand.text,
+                    probability: cand.probability,
+                    logprob: cand.logprob,
+                    color: calculateColorClass(cand.probability),
+                    selection_chance: chance
+                });
+            }
+        });
+
+        return {
+            token: token.text,
+            text: token.text,
+            probability: token.probability,
+            logprob: token.logprob,
+            color: calculateColorClass(token.probability),
+            selection_chance: selectionChance,
+            top_alternatives: alternatives
+        };
+    });
+}
+
+/**
+ * Create HTML for a single token span
+ * @param {Object} token - Processed token object
+ * @param {number} index - Position of the token in the in-memory token array
+ * @returns {string} - HTML string for the token span
+ */
+function createTokenSpanHTML(token, index) {
+    const colorClass = token.color || calculateColorClass(token.probability);
+    return `<span class="token ${colorClass}" data-index="${index}">${escapeHTML(token.text)}</span>`;
+}
+
 /**
  * Create HTML for token visualization
+ * Tooltip data is not embedded; tooltips are built on demand from the token array.
  * @param {Array} tokens - Array of token objects with probability information
+ * @param {number} start - Index of the first token to render
+ * @param {number} end - Index after the last token to render
  * @returns {string} - HTML string for visualization
  */
-function createTokenVisualizationHTML(tokens) {
-    let html = '<div class="token-container">';
-    
-    tokens.forEach(token => {
-        const color = calculateColor(token.probability);
-        const probText = formatProbability(token.probability);
-        const logprobText = token.logprob !== null ? formatProbability(token.logprob) : 'N/A';
-        
-        // Create tooltip content - encode HTML entities to avoid HTML injection and encoding issues
-        let tooltipData = {};
-        tooltipData.text = token.text;
-        tooltipData.probability = probText;
-        tooltipData.logprob = logprobText;
-        tooltipData.alternatives = [];
-        
-        // Add alternatives if available
-        if (token.top_alternatives && token.top_alternatives.length > 0) {
-            token.top_alternatives.forEach(alt => {
-                tooltipData.alternatives.push({
-                    text: alt.text,
-                    probability: formatProbability(alt.probability),
-                    logprob: alt.logprob !== null ? formatProbability(alt.logprob) : 'N/A',
-                    color: calculateColor(alt.probability)
-                });
-            });
+function createTokenVisualizationHTML(tokens, start = 0, end = tokens.length) {
+    const htmlParts = ['<div class="token-container">'];
+    for (let i = start; i < end; i++) {
+        htmlParts.push(createTokenSpanHTML(tokens[i], i));
+    }
+    htmlParts.push('</div>');
+    return htmlParts.join('');
+}
+
+/**
+ * Build one token object per position from multi-sample statistics
+ * The most frequent token is shown, colored by how many samples agree on it.
+ * @param {Object} stats - Columns from /api/generate with n: count, token, agreement,
+ *                         mean_probability, min_probability, entropy
+ * @returns {Array} - Token objects carrying the position's statistics in `stats`
+ */
+function statsTokens(stats) {
+    return stats.token.map((text, i) => ({
+        token: text,
+        text: text,
+        probability: stats.mean_probability[i],
+        logprob: null,
+        color: calculateColorClass(stats.agreement[i]),
+        top_alternatives: [],
+        stats: {
+            count: stats.count[i],
+            agreement: stats.agreement[i],
+            mean_probability: stats.mean_probability[i],
+            min_probability: stats.min_probability[i],
+            entropy: stats.entropy[i]
         }
-        
-        // Store the data as JSON in the data-tooltip attribute
-        const tooltipJSON = JSON.stringify(tooltipData);
-        
-        // Create token element
-        html += `<span class="token" style="background-color: ${color};" data-tooltip='${tooltipJSON}'>`;
-        html += token.text;
-        html += '</span>';
+    }));
+}
+
+/**
+ * Create HTML for stacked sample rows under a row of per-position statistics
+ * Token indices run across all rows in order, statistics row first.
+ * @param {Array} statTokens - Tokens from statsTokens
+ * @param {Array} samples - Processed tokens per sample
+ * @returns {string} - HTML string for visualization
+ */
+function createSamplesHTML(statTokens, samples) {
+    const rows = [['Agreement', statTokens, 'sample-row stats-row']].concat(
+        samples.map((tokens, i) => [`Sample ${i + 1}`, tokens, 'sample-row'])
+    );
+    const htmlParts = ['<div class="samples-container">'];
+    let offset = 0;
+    rows.forEach(([label, tokens, className]) => {
+        htmlParts.push(`<div class="${className}"><div class="sample-label">${label}</div><div class="token-container">`);
+        tokens.forEach((token, i) => htmlParts.push(createTokenSpanHTML(token, offset + i)));
+        htmlParts.push('</div></div>');
+        offset += tokens.length;
     });
+    htmlParts.push('</div>');
+    return htmlParts.join('');
+}
+
+/**
+ * Create HTML for a side-by-side model comparison
+ * Token indices continue from one column to the next, matching the flat token
+ * array the tooltips look tokens up in.
+ * @param {Array} columns - Column objects with service_type, model and status
+ * @param {Array} columnTokens - Array of processed token arrays, one per column
+ * @returns {string} - HTML string for the comparison view
+ */
+function createCompareHTML(columns, columnTokens) {
+    const htmlParts = ['<div class="compare-container">'];
+    let offset = 0;
+    columns.forEach((column, i) => {
+        const tokens = columnTokens[i] || [];
+        htmlParts.push(
+            `<div class="compare-column" data-column="${i}">` +
+            '<div class="compare-header">' +
+            `<span>${escapeHTML(column.model)} (${escapeHTML(column.service_type)})</span>` +
+            createCompareStatusHTML(column) +
+            '</div><div class="token-container">'
+        );
+        tokens.forEach((token, j) => htmlParts.push(createTokenSpanHTML(token, offset + j)));
+        htmlParts.push('</div></div>');
+        offset += tokens.length;
+    });
+    htmlParts.push('</div>');
+    return htmlParts.join('');
+}
+
+/**
+ * Create the status label of a comparison column
+ * @param {Object} column - Column object with status and, after a failure, error
+ * @returns {string} - HTML string for the status label
+ */
+function createCompareStatusHTML(column) {
+    if (column.error) {
+        return `<span class="compare-status error" title="${escapeHTML(column.error)}">Error</span>`;
+    }
+    return `<span class="compare-status">${escapeHTML(column.status)}</span>`;
+}
+
+/**
+ * Create the tooltip content for a position of the statistics row
+ * @param {Object} token - Token object from statsTokens
+ * @returns {string} - HTML string for the tooltip body
+ */
+function createStatsTooltipHTML(token) {
+    const stats = token.stats;
+    const entropy = stats.entropy === null ? 'N/A' : `${stats.entropy.toFixed(3)} bits`;
+    return [
+        `<div class="token-info">Most frequent: <span class="${token.color}">${escapeHTML(token.text)}</span></div>`,
+        `<div class="token-info">Agreement: ${formatChance(stats.agreement)} of ${stats.count} samples</div>`,
+        `<div class="token-info">Mean Probability: ${formatProbability(stats.mean_probability)}</div>`,
+        `<div class="token-info">Min Probability: ${formatProbability(stats.min_probability)}</div>`,
+        `<div class="token-info">Entropy (top candidates): ${entropy}</div>`
+    ].join('');
+}
+
+/**
+ * Create the tooltip content for a token
+ * @param {Object} token - Processed token object
+ * @returns {string} - HTML string for the tooltip body
+ */
+function createTooltipHTML(token) {
+    if (token.stats) {
+        return createStatsTooltipHTML(token);
+    }
+    const colorClass = token.color || calculateColorClass(token.probability);
+    const htmlParts = [
+        `<div class="token-info">Token: <span class="${colorClass}">${escapeHTML(token.text)}</span></div>`,
+        `<div class="token-info">Probability: ${formatProbability(token.probability)}</div>`,
+        `<div class="token-info">Log Probability: ${formatProbability(token.logprob)}</div>`,
+        `<div class="token-info">Selection Chance (Top P): ${formatChance(token.selection_chance)}</div>`
+    ];
     
-    html += '</div>';
-    return html;
+    const alternatives = token.top_alternatives || [];
+    if (alternatives.length > 0) {
+        htmlParts.push('<div class="token-alternatives"><h4>Alternatives:</h4>');
+        alternatives.forEach(alt => {
+            const altColorClass = alt.color || calculateColorClass(alt.probability);
+            htmlParts.push(
+                `<div class="alt-token ${altColorClass}" data-alt="${escapeHTML(alt.text)}">` +
+                `<span class="alt-text"><span class="${altColorClass}">${escapeHTML(alt.text)}</span></span>` +
+                `<span class="alt-prob">P: ${formatProbability(alt.probability)}</span>` +
+                `<span class="alt-logprob">LogP: ${formatProbability(alt.logprob)}</span>` +
+                `<span class="alt-chance">Chance: ${formatChance(alt.selection_chance)}</span>` +
+                '</div>'
+            );
+        });
+        htmlParts.push('</div>');
+    }
+    return htmlParts.join('');
 }
 
 /**
  * Process raw token data from API
- * @param {Array} rawTokens - Raw token data from API
+ * @param {Array|Object} rawTokens - Raw token data from API, or a compact columnar payload
  * @returns {Array} - Processed tokens with visualization data
  */
 function processTokens(rawTokens) {
+    if (!Array.isArray(rawTokens)) {
+        return expandCompactTokens(rawTokens);
+    }
     return rawTokens.map(token => {
         const processed = {
             token: token.token || '',
@@ -141,7 +521,22 @@ function processTokens(rawTokens) {
 // Export functions for use in main.js
 window.TokenVisualizer = {
     calculateColor,
+    calculateColorClass,
     formatProbability,
+    formatChance,
+    escapeHTML,
+    expandCompactTokens,
+    expandRawColumns,
+    unpackColumns,
+    rawTokenFromDict,
+    rescaleTemperature,
+    deriveTokens,
+    createTokenSpanHTML,
     createTokenVisualizationHTML,
+    statsTokens,
+    createSamplesHTML,
+    createCompareHTML,
+    createCompareStatusHTML,
+    createTooltipHTML,
     processTokens
 };
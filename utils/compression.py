@@ -0,0 +1,65 @@
+"""
+Negotiated compression of response bodies (gzip, and brotli when installed).
+"""
+
+from typing import Optional
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+import config
+
+
+def _accepted(accept_encoding: str) -> dict:
+    """Parse an Accept-Encoding header into {coding: q-value}."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the content coding for a response from the request's Accept-Encoding.
+
+    Brotli is preferred over gzip when the client accepts both and the brotli
+    module is installed.
+
+    Returns:
+        "br", "gzip", or None to send the body uncompressed
+    """
+    if not config.COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    accepted = _accepted(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    for coding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+def should_compress(body_size: int, mimetype: Optional[str]) -> bool:
+    """Whether a body is large enough and of a type worth compressing."""
+    return body_size >= config.COMPRESSION_MIN_SIZE and (
+        mimetype or ""
+    ).startswith(("application/json", "text/"))
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a body with the coding returned by choose_encoding."""
+    if encoding == "br":
+        return brotli.compress(body, quality=config.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=config.COMPRESSION_GZIP_LEVEL)
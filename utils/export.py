@@ -0,0 +1,200 @@
+"""
+Streaming export of token-level rows as Arrow IPC streams or Parquet files.
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import math
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; exports are unavailable without it
+    pa = None
+    pq = None
+
+from models.token_processor import TokenProcessor
+from models.token_sequence import TokenSequence
+import config
+
+# Export format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# (generation_id, params, tokens) of one generation to export
+ExportSource = Tuple[str, Dict[str, Any], TokenSequence]
+
+
+def available() -> bool:
+    """Whether pyarrow is installed, so exports can be written."""
+    return pa is not None
+
+
+def schema():
+    """Arrow schema of the exported rows, one per generated token."""
+    return pa.schema(
+        [
+            ("run_id", pa.string()),
+            ("model", pa.string()),
+            ("position", pa.int32()),
+            ("token", pa.string()),
+            ("logprob", pa.float64()),
+            ("probability", pa.float64()),
+            ("selection_chance", pa.float64()),
+            ("rank", pa.int32()),
+            ("alt_tokens", pa.list_(pa.string())),
+            ("alt_logprobs", pa.list_(pa.float64())),
+        ]
+    )
+
+
+def token_alternatives(
+    tokens: TokenSequence, index: int
+) -> List[Tuple[str, Optional[float]]]:
+    """
+    Every alternative returned for a token, most likely first.
+
+    Unlike top_alternatives of a processed token, candidates outside the
+    top_p nucleus are kept. The chosen token is left out and alternatives
+    without a logprob come last.
+    """
+    chosen = tokens.texts[index]
+    alternatives = [
+        (tokens.alt_texts[j], tokens.alt_logprobs[j])
+        for j in range(tokens.alt_offsets[index], tokens.alt_offsets[index + 1])
+        if tokens.alt_texts[j] != chosen
+    ]
+    alternatives.sort(key=lambda alt: math.inf if math.isnan(alt[1]) else -alt[1])
+    return [
+        (text, None if math.isnan(logprob) else logprob)
+        for text, logprob in alternatives
+    ]
+
+
+def token_rank(
+    logprob: Optional[float], alternatives: List[Tuple[str, Optional[float]]]
+) -> Optional[int]:
+    """Rank of the chosen token among all its returned candidates, 1 for the most likely."""
+    if logprob is None:
+        return None
+    return 1 + sum(
+        1
+        for _, alt_logprob in alternatives
+        if alt_logprob is not None and alt_logprob > logprob
+    )
+
+
+class _ChunkSink:
+    """Write-only file object that collects bytes until they are drained."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _RowBuffer:
+    """Columns of the rows collected for the next record batch."""
+
+    def __init__(self):
+        self.columns: Dict[str, list] = {name: [] for name in schema().names}
+
+    def __len__(self) -> int:
+        return len(self.columns["position"])
+
+    def add(
+        self,
+        generation_id: str,
+        model: str,
+        tokens: TokenSequence,
+        processed_tokens: List[Dict[str, Any]],
+    ) -> None:
+        columns = self.columns
+        for position, token in enumerate(processed_tokens):
+            alternatives = token_alternatives(tokens, position)
+            columns["run_id"].append(generation_id)
+            columns["model"].append(model)
+            columns["position"].append(position)
+            columns["token"].append(token["text"])
+            columns["logprob"].append(token["logprob"])
+            columns["probability"].append(token["probability"])
+            columns["selection_chance"].append(token["selection_chance"])
+            columns["rank"].append(token_rank(token["logprob"], alternatives))
+            columns["alt_tokens"].append([text for text, _ in alternatives])
+            columns["alt_logprobs"].append([logprob for _, logprob in alternatives])
+
+    def take_batch(self):
+        batch = pa.RecordBatch.from_pydict(self.columns, schema=schema())
+        for values in self.columns.values():
+            values.clear()
+        return batch
+
+
+def export_stream(
+    generations: Iterable[ExportSource],
+    export_format: str,
+    batch_rows: int = config.EXPORT_BATCH_ROWS,
+) -> Iterator[bytes]:
+    """
+    Export the tokens of generations as an Arrow IPC stream or a Parquet file.
+
+    Each generation is run through TokenProcessor.process_tokens with the
+    top_p it was generated with. Rows are written in record batches (Parquet
+    row groups) of at least batch_rows, and the bytes of each are yielded as
+    soon as it is written, so only the current batch and the generation being
+    processed are held in memory.
+
+    Args:
+        generations: (generation_id, params, tokens) per generation, consumed lazily
+        export_format: "arrow" or "parquet"
+        batch_rows: Rows per record batch
+
+    Yields:
+        Chunks of the encoded stream or file
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Export format must be one of {', '.join(EXPORT_FORMATS)}")
+    sink = _ChunkSink()
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(
+            sink, schema(), compression=config.EXPORT_PARQUET_COMPRESSION
+        )
+    else:
+        writer = pa.ipc.new_stream(sink, schema())
+
+    rows = _RowBuffer()
+    try:
+        for generation_id, params, tokens in generations:
+            processed_tokens = TokenProcessor.process_tokens(
+                tokens, top_p=params.get("top_p", config.DEFAULT_TOP_P)
+            )
+            rows.add(generation_id, params.get("model"), tokens, processed_tokens)
+            if len(rows) >= batch_rows:
+                writer.write_batch(rows.take_batch())
+                yield sink.drain()
+        if len(rows):
+            writer.write_batch(rows.take_batch())
+    finally:
+        writer.close()
+    yield sink.drain()
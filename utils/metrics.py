@@ -0,0 +1,320 @@
+"""
+In-process metrics exposed in the Prometheus text format.
+"""
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import threading
+import time
+
+LabelValues = Tuple[str, ...]
+
+# Default histogram buckets in seconds, from sub-millisecond processing stages
+# up to slow upstream completions
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    """Base class holding name, help text, label names and a lock."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self) -> List[str]:
+        """Return the metric in the Prometheus text exposition format."""
+        header = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        return header + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """Increase the counter for the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        """Return the current value for the given labels."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    """Value per label set that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """Set the gauge for the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets per label set."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """Record one observation for the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(names, key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {_format_value(count)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together for the /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "token_visualizer_http_requests_total",
+    "HTTP requests by endpoint, method and status code.",
+    ("endpoint", "method", "status"),
+)
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    "token_visualizer_http_response_bytes_total",
+    "Bytes sent in non-streamed response bodies by endpoint.",
+    ("endpoint",),
+)
+ERRORS = REGISTRY.counter(
+    "token_visualizer_errors_total",
+    "Errors raised while handling requests, by endpoint and exception type.",
+    ("endpoint", "type"),
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "token_visualizer_upstream_latency_seconds",
+    "Latency of upstream completion calls by service type and model.",
+    ("service_type", "model"),
+)
+STAGE_DURATION = REGISTRY.histogram(
+    "token_visualizer_stage_duration_seconds",
+    "Time spent in each stage of handling a generation request.",
+    ("stage",),
+)
+TOKENS_PROCESSED = REGISTRY.counter(
+    "token_visualizer_tokens_processed_total",
+    "Tokens run through TokenProcessor.",
+)
+COALESCED_REQUESTS = REGISTRY.counter(
+    "token_visualizer_coalesced_requests_total",
+    "Generation requests served by joining an identical in-flight upstream call.",
+)
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    "token_visualizer_scheduler_queue_depth",
+    "Upstream calls waiting for rate limit budget, by service type and model.",
+    ("service_type", "model"),
+)
+SCHEDULER_WAIT = REGISTRY.histogram(
+    "token_visualizer_scheduler_wait_seconds",
+    "Time upstream calls waited for rate limit budget, by service type and priority.",
+    ("service_type", "priority"),
+)
+SCHEDULER_TIMEOUTS = REGISTRY.counter(
+    "token_visualizer_scheduler_timeouts_total",
+    "Upstream calls given up after waiting too long for rate limit budget.",
+    ("service_type", "model"),
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "token_visualizer_upstream_retries_total",
+    "Upstream calls retried after an HTTP 429 response, by service type and model.",
+    ("service_type", "model"),
+)
+CANCELLED_REQUESTS = REGISTRY.counter(
+    "token_visualizer_cancelled_requests_total",
+    "Generations abandoned before finishing, by endpoint and reason (disconnect or timeout).",
+    ("endpoint", "reason"),
+)
+RESPONSE_CACHE_EVENTS = REGISTRY.gauge(
+    "token_visualizer_response_cache_events",
+    "Response cache lookups by result since startup or the last clear (hits, misses, disk_hits).",
+    ("result",),
+)
+RESPONSE_CACHE_ENTRIES = REGISTRY.gauge(
+    "token_visualizer_response_cache_entries",
+    "Entries currently held by the response cache, by tier.",
+    ("tier",),
+)
+
+
+@contextmanager
+def stage_timer(
+    stage: str, timings: Optional[Dict[str, float]] = None
+) -> Iterator[None]:
+    """
+    Time a block as a request stage.
+
+    The duration is recorded in the stage histogram and, if given, added to
+    timings (stage name -> seconds) for a Server-Timing header.
+
+    Args:
+        stage: Stage name, e.g. "upstream" or "process_tokens"
+        timings: Optional per-request dictionary of stage durations
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def upstream_timer(
+    service_type: str, model: str, timings: Optional[Dict[str, float]] = None
+) -> Iterator[None]:
+    """Time an upstream completion call as the "upstream" stage and by model."""
+    started = time.perf_counter()
+    try:
+        with stage_timer("upstream", timings):
+            yield
+    finally:
+        UPSTREAM_LATENCY.observe(
+            time.perf_counter() - started, service_type=service_type, model=model
+        )
+
+
+def record_error(endpoint: str, error: BaseException) -> None:
+    """Count an error by endpoint and exception type."""
+    ERRORS.inc(endpoint=endpoint, type=type(error).__name__)
+
+
+def record_cancelled(endpoint: str, reason: str) -> None:
+    """Count a generation abandoned before it finished, by endpoint and reason."""
+    CANCELLED_REQUESTS.inc(endpoint=endpoint, reason=reason)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Format stage durations as a Server-Timing header value (milliseconds)."""
+    return ", ".join(
+        f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()
+    )